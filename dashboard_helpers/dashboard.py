@@ -2,85 +2,132 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+from data_layer import (
+    load_transactions, daily_totals, date_slice, running_balance, page_count, page_rows,
+    open_store, store_accounts, store_bounds, store_filter, query_store,
+)
+
+TABLE_PAGE_SIZE = 50
+DEFAULT_DATASET = "data/transactions"
+# Seconds before store queries are re-run to pick up newly extracted statements
+STORE_TTL = 300
+
 # --- Page Config ---
 st.set_page_config("📊 Peepalytics Dashboard", layout="wide")
 st.title("📊 Peepalytics Transaction Dashboard")
 
-# --- Upload CSV ---
-st.sidebar.header("📁 Upload Redacted CSV")
-uploaded_file = st.sidebar.file_uploader("Upload a file", type=["csv"])
+# --- Data Source ---
+st.sidebar.header("📁 Data Source")
+dataset_dir = st.sidebar.text_input("Transactions dataset", value=DEFAULT_DATASET,
+                                    help="Parquet dataset or transaction index written by the extractor "
+                                         "(<output>/transactions or <output>/index)")
+uploaded_file = st.sidebar.file_uploader("Or upload a redacted CSV", type=["csv"])
 
-if not uploaded_file:
-    st.info("Please upload a redacted transaction CSV file to begin.")
-    st.stop()
 
-# --- Load Data ---
-df = pd.read_csv(uploaded_file)
-df.fillna(0, inplace=True)
-df.iloc[9,3] =  df.iloc[9,2]
-df.iloc[9,2] = 0
-df.iloc[11,3] =  df.iloc[11,2]
-df.iloc[11,2] = 0
-df.iloc[-8,3] =  df.iloc[-8,2]
-df.iloc[-8,2] = 0
+@st.cache_data(show_spinner="Loading transactions...")
+def load_data(data: bytes):
+    # Cached on the file's content: re-running with the same upload skips parsing
+    df = load_transactions(data)
+    return df, daily_totals(df)
+
+
+@st.cache_resource(ttl=STORE_TTL)
+def get_store(path: str):
+    return open_store(path)
+
+
+@st.cache_data(ttl=STORE_TTL)
+def load_store_accounts(path: str):
+    return store_accounts(get_store(path))
+
 
+@st.cache_data(ttl=STORE_TTL)
+def load_store_bounds(path: str, accounts: tuple):
+    return store_bounds(get_store(path), accounts)
 
-# Step 1: Replace slashes with dashes if appears
-df['date'] = df['date'].astype(str).str.replace('/', '-', regex=False)
-# Step 2: Parse to datetime
-df['date'] = pd.to_datetime(df['date'], dayfirst=True, errors='coerce')
-df['description'] = df['description'].fillna("")
 
-# --- Clean unwanted rows ---
-non_transaction_keywords = ['opening balance', 'closing balance', 'statement balance']
-df = df[~df['description'].str.lower().isin(non_transaction_keywords)]
+@st.cache_data(ttl=STORE_TTL, show_spinner="Querying transactions...")
+def load_store_rows(path: str, accounts: tuple, start, end, amounts, text: str):
+    # Only rows matching every filter leave the Parquet scan
+    min_amount, max_amount = amounts if amounts else (None, None)
+    return query_store(get_store(path), store_filter(start, end, min_amount, max_amount, text, accounts))
+
+
+store = None if uploaded_file else get_store(dataset_dir)
+if not uploaded_file and store is None:
+    st.info("No transactions found. Run the extractor to populate the dataset, or upload a redacted transaction CSV.")
+    st.stop()
 
 # --- Sidebar Filters ---
 st.sidebar.header("🔍 Filters")
 
+if store is not None:
+    accounts = tuple(st.sidebar.multiselect("Accounts", load_store_accounts(dataset_dir)))
+    bounds = load_store_bounds(dataset_dir, accounts)
+    if not bounds:
+        st.info("No transactions for the selected accounts.")
+        st.stop()
+    min_date, max_date = bounds['min_date'], bounds['max_date']
+    min_amt, max_amt = bounds['min_amount'], bounds['max_amount']
+    transaction_start_date, transaction_end_date = bounds['first_active'], bounds['last_active']
+else:
+    df, daily = load_data(uploaded_file.getvalue())
+    min_date, max_date = df['date'].min(), df['date'].max()
+    min_amt = float(df[['money_in', 'money_out']].min().min())
+    max_amt = float(df[['money_in', 'money_out']].max().max())
+
+    # First and last dates with a non-zero money_in or money_out
+    active = df[(df['money_in'] != 0) | (df['money_out'] != 0)]
+    transaction_start_date = active['date'].iloc[0]
+    transaction_end_date = active['date'].iloc[-1]
+
 # Set the date range for the slicer
-min_date, max_date = df['date'].min(), df['date'].max()
 date_range = st.sidebar.date_input("Date Range", [min_date, max_date], min_value=min_date, max_value=max_date)
+if len(date_range) != 2:
+    st.stop()
 
 # Amount range slicer
-min_amt = float(df[['money_in', 'money_out']].min().min())
-max_amt = float(df[['money_in', 'money_out']].max().max())
 amount_range = st.sidebar.slider("Amount Range", min_amt, max_amt, (min_amt, max_amt), step=100.0)
+amount_filtered = amount_range[0] != min_amt or amount_range[1] != max_amt
 
 # Description filter
 text_query = st.sidebar.text_input("Search Description", placeholder="e.g. POS, ATM")
-
-# --- Determine Start and End Period for Transaction ---
-# Find the first non-zero money_in or money_out date (Transaction Start Period)
-first_non_zero = df[(df['money_in'] != 0) | (df['money_out'] != 0)].iloc[0]
-
-# Find the last non-zero money_in or money_out date (Transaction End Period)
-last_non_zero = df[(df['money_in'] != 0) | (df['money_out'] != 0)].iloc[-1]
-
-# Transaction start and end date
-transaction_start_date = first_non_zero['date']
-transaction_end_date = last_non_zero['date']
+subset = amount_filtered or bool(text_query)
 
 # --- Apply Filters for Visualizations ---
-# Filter data based on the user's date range, amount range, and description filter
-filtered_df = df[
-    (df['date'] >= pd.to_datetime(date_range[0])) &
-    (df['date'] <= pd.to_datetime(date_range[1]))
-]
-
-# Visualizations will use this filtered_df based on date range, amount, and text query
-visualized_df = filtered_df.copy()
-
-# Apply amount filter
-if amount_range[0] != min_amt or amount_range[1] != max_amt:
-    visualized_df = visualized_df[
-        (visualized_df['money_in'].between(amount_range[0], amount_range[1])) |
-        (visualized_df['money_out'].between(amount_range[0], amount_range[1]))
-    ]
-
-# Apply description filter
-if text_query:
-    visualized_df = visualized_df[visualized_df['description'].str.contains(text_query, case=False, na=False)]
+if store is not None:
+    # Filters are pushed down into the dataset scan; charts and the table use its result
+    visualized_df = load_store_rows(dataset_dir, accounts, date_range[0], date_range[1],
+                                    tuple(amount_range) if amount_filtered else None, text_query)
+    daily_spend = daily_totals(visualized_df)[['date', 'money_out']]
+    balance = visualized_df['running_balance']
+    table_df = visualized_df
+else:
+    # Rows are sorted by date, so the date range is a binary search rather than a scan
+    rows = date_slice(df['date'].to_numpy(), date_range[0], date_range[1])
+    visualized_df = df.iloc[rows]
+
+    # Apply amount filter
+    if amount_filtered:
+        visualized_df = visualized_df[
+            (visualized_df['money_in'].between(amount_range[0], amount_range[1])) |
+            (visualized_df['money_out'].between(amount_range[0], amount_range[1]))
+        ]
+
+    # Apply description filter
+    if text_query:
+        visualized_df = visualized_df[visualized_df['description'].str.contains(text_query, case=False, na=False)]
+
+    # Daily spend is precomputed per day unless amount/text filters pick out rows
+    if subset:
+        daily_spend = daily_totals(visualized_df)[['date', 'money_out']]
+    else:
+        in_range = date_slice(daily['date'].to_numpy(), date_range[0], date_range[1])
+        daily_spend = daily.iloc[in_range][['date', 'money_out']]
+    balance = running_balance(visualized_df, df, rows, subset)
+
+    # An uploaded file is small enough to list in full, regardless of the slicers
+    table_df = df
 
 # --- KPIs --- (Reduced columns for compact display)
 st.markdown("### 📈 Key Performance Indicators")
@@ -102,20 +149,19 @@ st.divider()
 st.markdown("### 📊 Transaction Visualizations")
 
 # Bar Chart: Daily Spend
-daily_spend = visualized_df.groupby(visualized_df['date'].dt.date)['money_out'].sum().reset_index()
 fig_bar = px.bar(daily_spend, x='date', y='money_out', title="💸 Daily Spend", labels={'money_out': 'Money Out ($)'})
 st.plotly_chart(fig_bar, use_container_width=True)
 
 # Line Chart: Running Balance
-sorted_df = visualized_df.sort_values(by='date')
-sorted_df['net'] = sorted_df['money_in'] - sorted_df['money_out']
-sorted_df['running_balance'] = sorted_df['net'].cumsum()
-fig_line = px.line(sorted_df, x='date', y='running_balance', title="📈 Running Balance Over Time")
+balance_df = pd.DataFrame({
+    'date': visualized_df['date'],
+    'running_balance': balance,
+})
+fig_line = px.line(balance_df, x='date', y='running_balance', title="📈 Running Balance Over Time")
 st.plotly_chart(fig_line, use_container_width=True)
 
 # Pie Chart: Category Breakdown (optional)
 st.markdown("### 🧁 Transaction Categories (Optional)")
-visualized_df['category'] = visualized_df['description'].str.extract(r'(POS|ATM|Loan|Transfer|Bill)', expand=False).fillna('Other')
 cat_data = visualized_df['category'].value_counts().reset_index()
 cat_data.columns = ['Category', 'Count']
 fig_pie = px.pie(cat_data, names='Category', values='Count', title="Transaction Category Distribution", hole=0.4)
@@ -123,11 +169,18 @@ st.plotly_chart(fig_pie, use_container_width=True)
 
 st.divider()
 
-# --- Transaction Table (All Data, No Slice) ---
+# --- Transaction Table ---
 st.markdown("### 📋 Transactions Table")
-# Show all rows regardless of slicer filters (table is not affected by the slicer)
-st.dataframe(df, use_container_width=True)
+unreconciled = int((table_df['reconciliation'] == 'unreconciled').sum())
+if unreconciled:
+    st.warning(f"{unreconciled} transaction(s) do not reconcile with the statement balance; "
+               "check them against the redacted pages.")
+# One page at a time so only the visible rows are sent to the browser
+table_columns = ['date', 'description', 'money_out', 'money_in', 'borrowings', 'reconciliation']
+pages = page_count(len(table_df), TABLE_PAGE_SIZE)
+page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1)
+st.dataframe(page_rows(table_df[table_columns], page, TABLE_PAGE_SIZE), use_container_width=True)
 
 # --- Export Filtered Data ---
-csv = visualized_df.to_csv(index=False).encode()
+csv = visualized_df[table_columns].to_csv(index=False).encode()
 st.download_button("📥 Download Filtered CSV", csv, "filtered_transactions.csv", "text/csv")
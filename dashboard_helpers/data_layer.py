@@ -0,0 +1,240 @@
+# data_layer.py
+
+"""
+Loading, cleaning and lookup helpers behind the Streamlit dashboard.
+
+Everything here is plain pandas/NumPy/Arrow so it can be cached by the dashboard
+and reused elsewhere.
+
+The dashboard normally reads the Parquet dataset the extractor writes
+(`<output>/transactions`, see extractor/store.py). Date, amount, account and
+description filters are pushed down into the dataset scan - month partitions
+outside the range are never opened and only matching rows are materialized - so
+many accounts can be browsed without loading them all into memory.
+
+An uploaded CSV is still supported: it is loaded whole, sorted by date so every
+date filter becomes two binary searches, and its daily totals and running
+balance are computed once per file.
+"""
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+NON_TRANSACTION_KEYWORDS = ['opening balance', 'closing balance', 'statement balance']
+CATEGORY_PATTERN = r'(POS|ATM|Loan|Transfer|Bill)'
+
+
+def load_transactions(data: bytes) -> pd.DataFrame:
+    """
+    Parse and clean a transactions CSV.
+
+    Args:
+        data: Raw bytes of the CSV file.
+
+    Returns:
+        Transactions sorted by date (stable, so same-day rows keep statement order),
+        with `net`, `running_balance` and `category` columns added. CSVs exported
+        before reconciliation get an "unchecked" `reconciliation` column.
+    """
+    df = pd.read_csv(io.BytesIO(data))
+    df.fillna(0, inplace=True)
+    # Amounts were already put on the right side by the extractor's balance reconciliation
+    if 'reconciliation' not in df:
+        df['reconciliation'] = 'unchecked'
+
+    # Accept both 1/4/2023 and 01-04-2023 style dates
+    df['date'] = df['date'].astype(str).str.replace('/', '-', regex=False)
+    df['date'] = pd.to_datetime(df['date'], dayfirst=True, errors='coerce')
+    df['description'] = df['description'].replace(0, "").astype(str)
+
+    df = df[~df['description'].str.lower().isin(NON_TRANSACTION_KEYWORDS)]
+    df = df.sort_values('date', kind='stable').reset_index(drop=True)
+
+    df['net'] = df['money_in'] - df['money_out']
+    df['running_balance'] = df['net'].cumsum()
+    df['category'] = df['description'].str.extract(CATEGORY_PATTERN, expand=False).fillna('Other')
+    return df
+
+
+def daily_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-day inflow, outflow and transaction count, sorted by date.
+    """
+    daily = df.groupby(df['date'].dt.normalize()).agg(
+        money_in=('money_in', 'sum'),
+        money_out=('money_out', 'sum'),
+        count=('date', 'size'),
+    ).reset_index()
+    daily['net'] = daily['money_in'] - daily['money_out']
+    return daily
+
+
+def date_slice(dates: np.ndarray, start, end) -> slice:
+    """
+    Positions of the rows dated within [start, end], found by binary search.
+
+    Args:
+        dates: Sorted datetime64 values (a date-sorted frame's `date` column).
+        start, end: Inclusive bounds; anything `pd.Timestamp` accepts.
+
+    Returns:
+        A slice usable with `DataFrame.iloc`.
+    """
+    lo = np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), side='left')
+    # Include the whole end day
+    hi = np.searchsorted(dates, np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1)), side='left')
+    return slice(int(lo), int(hi))
+
+
+def running_balance(view: pd.DataFrame, df: pd.DataFrame, rows: slice, subset: bool) -> pd.Series:
+    """
+    Running balance over the rows shown in the charts.
+
+    For a pure date range this reuses the precomputed cumulative sum, offset to
+    start at the range; otherwise (amount or text filters) the visible rows are
+    re-accumulated.
+    """
+    if subset:
+        return view['net'].cumsum()
+    offset = df['running_balance'].iat[rows.start - 1] if rows.start > 0 else 0.0
+    return view['running_balance'] - offset
+
+
+def page_count(n_rows: int, page_size: int) -> int:
+    return max(1, -(-n_rows // page_size))
+
+
+def page_rows(df: pd.DataFrame, page: int, page_size: int) -> pd.DataFrame:
+    """
+    One page (1-based) of a frame for display.
+    """
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size]
+
+
+# --- Pipeline store ---
+
+AMOUNT_FIELDS = ['money_out', 'money_in', 'borrowings']
+STORE_COLUMNS = ['masked_account_number', 'date', 'description'] + AMOUNT_FIELDS
+# Written by the extractor since balance reconciliation; absent from older statements
+RECONCILIATION_COLUMN = 'reconciliation'
+
+
+def open_store(dataset_dir: str):
+    """
+    The extractor's Parquet transactions dataset, or None if there is none yet.
+    """
+    if not os.path.isdir(dataset_dir):
+        return None
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning="hive")
+    return dataset if dataset.files else None
+
+
+def store_accounts(dataset) -> list:
+    """
+    Masked account numbers present in the store.
+    """
+    column = dataset.to_table(columns=['masked_account_number'])['masked_account_number']
+    return sorted(a for a in pc.unique(column).to_pylist() if a)
+
+
+def store_filter(start=None, end=None, min_amount=None, max_amount=None, text=None, accounts=None):
+    """
+    Build the scan filter for the dashboard's widgets.
+
+    Args:
+        start, end: Inclusive date bounds.
+        min_amount, max_amount: Keep rows whose money_in or money_out falls in the range.
+        text: Case-insensitive substring of the description.
+        accounts: Masked account numbers to include; all when empty.
+
+    Returns:
+        pyarrow.compute.Expression
+    """
+    description = ds.field('description')
+    expr = ~pc.utf8_lower(description).isin(NON_TRANSACTION_KEYWORDS)
+
+    if start is not None:
+        start = pd.Timestamp(start)
+        # The month partition lets the scan skip whole directories
+        expr &= (ds.field('month') >= start.strftime('%Y-%m')) & (ds.field('date') >= pa.scalar(start.date()))
+    if end is not None:
+        end = pd.Timestamp(end)
+        expr &= (ds.field('month') <= end.strftime('%Y-%m')) & (ds.field('date') <= pa.scalar(end.date()))
+    if min_amount is not None and max_amount is not None:
+        expr &= (
+            ((ds.field('money_in') >= min_amount) & (ds.field('money_in') <= max_amount))
+            | ((ds.field('money_out') >= min_amount) & (ds.field('money_out') <= max_amount))
+        )
+    if text:
+        expr &= pc.match_substring(description, text, ignore_case=True)
+    if accounts:
+        expr &= ds.field('masked_account_number').isin(list(accounts))
+    return expr
+
+
+def store_bounds(dataset, accounts=None) -> dict:
+    """
+    Date and amount ranges for the filter widgets, plus the first and last dates
+    with money moving. Only the date and amount columns are scanned, batch by
+    batch, so the store is never held in memory at once.
+    """
+    bounds = {}
+
+    def widen(key_min, key_max, values):
+        stats = pc.min_max(values)
+        lo, hi = stats['min'].as_py(), stats['max'].as_py()
+        if lo is not None:
+            bounds[key_min] = lo if key_min not in bounds else min(bounds[key_min], lo)
+            bounds[key_max] = hi if key_max not in bounds else max(bounds[key_max], hi)
+
+    scanner = dataset.scanner(columns=['date', 'money_in', 'money_out'], filter=store_filter(accounts=accounts))
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        money_in = pc.fill_null(batch['money_in'], 0.0)
+        money_out = pc.fill_null(batch['money_out'], 0.0)
+        widen('min_date', 'max_date', batch['date'])
+        widen('min_amount', 'max_amount', pa.concat_arrays([money_in, money_out]))
+        active = pc.or_(pc.not_equal(money_in, 0.0), pc.not_equal(money_out, 0.0))
+        widen('first_active', 'last_active', pc.filter(batch['date'], active))
+
+    if not bounds:
+        return {}
+    bounds.setdefault('first_active', bounds['min_date'])
+    bounds.setdefault('last_active', bounds['max_date'])
+    return {
+        key: float(value) if key.endswith('amount') else pd.Timestamp(value)
+        for key, value in bounds.items()
+    }
+
+
+def query_store(dataset, expr) -> pd.DataFrame:
+    """
+    Materialize only the rows matching `expr`, in statement order.
+
+    Returns:
+        Transactions with the same columns as `load_transactions` produces, with
+        the running balance accumulated over the returned rows.
+    """
+    columns = STORE_COLUMNS + ([RECONCILIATION_COLUMN] if RECONCILIATION_COLUMN in dataset.schema.names else [])
+    table = dataset.to_table(columns=columns + ['statement_id', 'row'], filter=expr)
+    table = table.sort_by([('date', 'ascending'), ('statement_id', 'ascending'), ('row', 'ascending')])
+
+    df = table.select(columns).to_pandas()
+    missing = pd.Series(index=df.index, dtype=object)
+    df[RECONCILIATION_COLUMN] = df.get(RECONCILIATION_COLUMN, missing).fillna('unchecked')
+    df['date'] = pd.to_datetime(df['date'])
+    df[AMOUNT_FIELDS] = df[AMOUNT_FIELDS].fillna(0.0)
+    df['description'] = df['description'].fillna("")
+
+    df['net'] = df['money_in'] - df['money_out']
+    df['running_balance'] = df['net'].cumsum()
+    df['category'] = df['description'].str.extract(CATEGORY_PATTERN, expand=False).fillna('Other')
+    return df
@@ -1,36 +1,648 @@
+# __main__.py
+
+"""
+Command line entry point of the extraction pipeline.
+
+    python -m extractor run --pdf statement.pdf --output data       # everything, in one pass
+    python -m extractor ocr --pdf statement.pdf --output work       # render, deskew and OCR only
+    python -m extractor parse --input work --output data            # parse stored OCR output
+    python -m extractor redact --input work --output data           # redact stored page images
+
+`ocr` stores its intermediates as `<output>/ocr/page_N.ocr` and
+`<output>/processed/page_N.jpg`; `parse` and `redact` read them back, so a
+parser or redaction change can be re-run without touching PaddleOCR. Without a
+command, `run` is assumed. The heavy dependencies (PaddleOCR, OpenCV, pdf2image,
+pyarrow) are imported by the stages that use them, so `--help` and `parse` start
+in a fraction of a second.
+"""
+
 import argparse
+import csv
+import json
+import logging
 import os
-from scripts.preprocess import pdf_to_images
-from extractor.ocr import ocr_extractor
-from extractor.parse import parser
-from extractor.redact import redact_sensitive_info
+import re
+import sys
+from PIL import Image
+from scripts.preprocess import render_page, deskew_image_fast, pdf_page_count, parse_page_range, RENDER_DPI
+from extractor import telemetry
+from extractor.cache import OCRCache
+from extractor.layout import LAYOUT_MODES, PARSE_ONLY_LAYOUTS
+from extractor.ocr import ocr_image, OCRWorkerPool, OCR_SETTINGS, ADAPTIVE_SETTINGS, LAYOUT_WINDOW
+from extractor.ocrpage import as_page, load_page
+from extractor.pii import scan_page
+from extractor.parse import extract_masked_account, parse_page, statement_period, has_transactions
+from extractor.pipeline import Pipeline, Stage, parse_stage_workers
+from extractor.reconcile import reconcile
+from extractor.redact import redact_in_place, redacted_path, save_image, RedactionWriter, OUTPUT_EXTENSIONS
+from extractor.store import save_statement, export_period_csv, statement_id, TRANSACTION_FIELDS, OUTPUT_FORMATS
+from extractor.textlayer import text_layer_pages
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ("run", "ocr", "parse", "redact")
+
+# Threads per pipeline stage; rendering, deskewing and encoding release the GIL
+STAGE_WORKERS = {"render": 2, "deskew": 2, "redact": 2}
+# Pages waiting in front of each stage
+QUEUE_SIZE = 4
+
+# Stored intermediates, relative to the `ocr` command's output directory
+OCR_DIR = "ocr"
+IMAGES_DIR = "processed"
+# Written next to the stored OCR pages; names the source PDF for the statement id
+SOURCE_FILE = "source.json"
+# page_3.ocr, page_3_paddleocr.json, page_3.jpg, ...
+_PAGE_FILE = re.compile(r"page_(\d+)(?:_paddleocr)?\.(ocr|json|jpe?g|png|webp)$", re.IGNORECASE)
+
+
+def select_pages(pdf_path, spec, native):
+    """
+    Resolve a page selection to the 1-based page numbers the pipeline will render.
+
+    Besides the ranges understood by `parse_page_range`, "auto" classifies pages by
+    their text layer: it keeps pages holding transactions plus the first page with
+    the account number, and keeps every scanned page since those can only be
+    classified after OCR.
+
+    Raises:
+        ValueError: If the selection leaves no page to process.
+    """
+    page_count = pdf_page_count(pdf_path)
+    if spec != "auto":
+        selected = parse_page_range(spec, page_count)
+    else:
+        account_page = next((p for p in sorted(native) if extract_masked_account(native[p])), None)
+        selected = [
+            p for p in range(1, page_count + 1)
+            if p not in native or p == account_page or has_transactions(native[p])
+        ]
+
+    if not selected:
+        raise ValueError(f'page selection "{spec}" matches none of the {page_count} page(s) in {pdf_path}')
+    return selected
+
+
+def stored_pages(directory, extensions):
+    """
+    Find stored per-page files in a directory.
+
+    Args:
+        directory (str): Directory holding `page_N.<ext>` files (PaddleOCR's
+            `page_N_paddleocr.json` names are understood too).
+        extensions (Tuple[str]): Accepted extensions, most preferred first.
+
+    Returns:
+        Dict[int, str]: Path per page number, in page order.
+    """
+    found = {}
+    for name in os.listdir(directory):
+        match = _PAGE_FILE.match(name)
+        if not match or match.group(2).lower() not in extensions:
+            continue
+        page_number, rank = int(match.group(1)), extensions.index(match.group(2).lower())
+        if page_number not in found or rank < found[page_number][0]:
+            found[page_number] = (rank, os.path.join(directory, name))
+    return {page_number: found[page_number][1] for page_number in sorted(found)}
+
+
+def _statement(results):
+    # `results` are (page_number, page, transactions, matches) tuples in page order
+    transactions = [t for _, _, page_transactions, _ in results for t in page_transactions]
+    start_date, end_date = statement_period(transactions)
+    return {
+        # From the first page that carries one, as `parser` does
+        "masked_account_number": next(filter(None, (extract_masked_account(page, matches)
+                                                     for _, page, _, matches in results)), None),
+        "start_date": start_date,
+        "end_date": end_date,
+        "transactions": transactions
+    }
+
+
+def main(pdf_path, output_dir, workers=1, pool=None, cache=None, text_layer=True, pages="1-2",
+         save_processed=False, fmt="jpeg", quality=95, outputs=("parquet",), dataset_dir=None, adaptive=None,
+         layout=None, stage_workers=None, queue_size=QUEUE_SIZE, index_dir=None):
+    with telemetry.labels(document=statement_id(pdf_path)), telemetry.stage("document"):
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Render, deskew, OCR, parse and redact overlap across pages; see `stream_pages`
+        results = list(stream_pages(pdf_path, output_dir, workers, pool, cache, text_layer, pages, save_processed,
+                                    fmt, quality, adaptive, layout, stage_workers, queue_size))
+        parsed_data = _statement(results)
+
+        save_statement(parsed_data, output_dir, pdf_path, outputs, dataset_dir, index_dir)
+
+        logger.info("Pipeline complete. Output saved in: %s", output_dir)
+        return parsed_data
+
+
+def _ocr_stages(pdf_path, native, save_dir, pool, cache, adaptive, layout, counts):
+    # Render -> deskew -> OCR, shared by `stream_pages` and `ocr_pages`
+    if pool is not None:
+        ocr_threads = counts.get("ocr") or pool.window
+    elif layout:
+        ocr_threads = counts.get("ocr") or LAYOUT_WINDOW
+    else:
+        ocr_threads = 1
+
+    def render(page_number):
+        logger.info("Processing page %d...", page_number)
+        return {"page_number": page_number, "image": render_page(pdf_path, page_number),
+                "ocr": native.get(page_number)}
+
+    def deskew(item):
+        page_number = item["page_number"]
+        if item["ocr"] is None:
+            with telemetry.stage("deskew", page=page_number):
+                item["image"] = deskew_image_fast(item["image"])
+        if save_dir:
+            output_path = os.path.join(save_dir, f"page_{page_number}.jpg")
+            with telemetry.stage("save_processed", page=page_number):
+                item["image"].save(output_path, format="JPEG")
+            logger.info("Saved: %s", output_path)
+        return item
+
+    def ocr(item):
+        if item["ocr"] is None:
+            item["ocr"] = ocr_image(item["image"], pool, cache, adaptive, layout, key=item["page_number"])
+        logger.info("Detected %d text elements on page %d.", len(item["ocr"]), item["page_number"])
+        return item
+
+    return [
+        Stage("render", render, counts["render"]),
+        Stage("deskew", deskew, counts["deskew"]),
+        Stage("ocr", ocr, ocr_threads),
+    ]
+
+
+def _page_parser():
+    # PII scan, parse and reconcile of one page; column headers and the running
+    # balance carry over from the previous page, so pages must come in order
+    columns = None
+    balance = None
+    account = None
+
+    def parse(item):
+        nonlocal columns, balance, account
+        page_number, page = item["page_number"], item["ocr"]
+        with telemetry.stage("pii_scan", page=page_number):
+            item["matches"] = scan_page(page)
+        with telemetry.stage("parse", page=page_number):
+            transactions, columns = parse_page(page, columns)
+        # Another account's page starts its own running balance
+        page_account = extract_masked_account(page, item["matches"])
+        if page_account and account and page_account != account:
+            balance = None
+        account = page_account or account
+        with telemetry.stage("reconcile", page=page_number):
+            item["transactions"], balance = reconcile(transactions, balance)
+        telemetry.count("transactions", len(transactions))
+        for status in ("corrected", "unreconciled"):
+            rows = sum(t["reconciliation"] == status for t in item["transactions"])
+            if rows:
+                telemetry.count(f"{status}_transactions", rows)
+                logger.info("%d %s transaction(s) on page %d.", rows, status, page_number)
+        return item
+
+    return parse
+
+
+def stream_pages(pdf_path, output_dir, workers=1, pool=None, cache=None, text_layer=True, pages="all",
+                 save_processed=False, fmt="jpeg", quality=95, adaptive=None, layout=None, stage_workers=None,
+                 queue_size=QUEUE_SIZE):
+    """
+    Run render -> deskew -> OCR -> parse -> redact as overlapping stages.
+
+    Each stage runs on its own threads (see extractor/pipeline.py) with bounded
+    queues between them, so poppler, OpenCV, PaddleOCR and the image encoder all
+    work on different pages at once and a document takes about as long as its
+    slowest stage. A page image is dropped as soon as its redacted copy is
+    encoded, so memory stays bounded by the queues regardless of document
+    length. Pages with a usable embedded text layer take their boxes from the
+    PDF and skip deskew and OCR. With `adaptive` (see `ocr_page_adaptive`), OCR
+    reads a downscaled page and re-reads only its low-confidence lines at full
+    resolution. With `layout`, only the detected text lines are recognized,
+    batched together across pages.
+
+    Args:
+        stage_workers (dict, optional): Threads per stage, overriding `STAGE_WORKERS`.
+            "ocr" defaults to one thread per page the OCR pool keeps in flight,
+            `LAYOUT_WINDOW` with `layout`, and is always 1 for the in-process
+            whole-page engine. Parsing is always one thread, in page order.
+        queue_size (int): Pages queued in front of each stage.
+
+    Yields:
+        Tuple[int, list, list, list]: Page number, OCR output, parsed transactions and
+        PII matches for the page, in page order.
+    """
+    native = text_layer_pages(pdf_path) if text_layer else {}
+    selected = select_pages(pdf_path, pages, native)
+    save_dir = os.path.join(output_dir, IMAGES_DIR) if save_processed else None
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+
+    own_pool = None
+    if pool is None and workers > 1:
+        pool = own_pool = OCRWorkerPool(workers)
+    counts = {**STAGE_WORKERS, **(stage_workers or {})}
+
+    def redact(item):
+        page_number, image = item["page_number"], item.pop("image")
+        with telemetry.stage("redact", page=page_number):
+            redact_in_place(image, item["ocr"], item["matches"])
+        output_path = redacted_path(output_dir, page_number, fmt)
+        with telemetry.stage("encode", page=page_number):
+            save_image(image, output_path, fmt, quality)
+        logger.info("Saved redacted page to: %s", output_path)
+        return item
+
+    pipeline = Pipeline(_ocr_stages(pdf_path, native, save_dir, pool, cache, adaptive, layout, counts) + [
+        Stage("parse", _page_parser(), ordered=True),
+        Stage("redact", redact, counts["redact"]),
+    ], queue_size)
+
+    try:
+        for item in pipeline.run(selected):
+            yield item["page_number"], item["ocr"], item["transactions"], item["matches"]
+    finally:
+        if own_pool is not None:
+            own_pool.close()
+
+
+def ocr_pages(pdf_path, output_dir, workers=1, pool=None, cache=None, text_layer=True, pages="all", adaptive=None,
+              layout=None, stage_workers=None, queue_size=QUEUE_SIZE):
+    """
+    Render, deskew and OCR a statement and store the results for `parse_stored` and `redact_stored`.
+
+    Runs the first three stages of `stream_pages` and writes each page's OCR
+    output to `<output_dir>/ocr/page_N.ocr` and its deskewed image to
+    `<output_dir>/processed/page_N.jpg`, plus `ocr/source.json` naming the PDF.
+
+    Returns:
+        List[int]: The page numbers stored.
+    """
+    ocr_dir = os.path.join(output_dir, OCR_DIR)
+    images_dir = os.path.join(output_dir, IMAGES_DIR)
+    os.makedirs(ocr_dir, exist_ok=True)
+    os.makedirs(images_dir, exist_ok=True)
+
+    with telemetry.labels(document=statement_id(pdf_path)), telemetry.stage("document"):
+        native = text_layer_pages(pdf_path) if text_layer else {}
+        selected = select_pages(pdf_path, pages, native)
+
+        own_pool = None
+        if pool is None and workers > 1:
+            pool = own_pool = OCRWorkerPool(workers)
+        counts = {**STAGE_WORKERS, **(stage_workers or {})}
 
-def main(pdf_path, output_dir):
+        def store(item):
+            page_number = item["page_number"]
+            output_path = os.path.join(ocr_dir, f"page_{page_number}.ocr")
+            as_page(item["ocr"]).save(output_path)
+            logger.info("Saved OCR output to: %s", output_path)
+            return page_number
+
+        pipeline = Pipeline(_ocr_stages(pdf_path, native, images_dir, pool, cache, adaptive, layout, counts) + [
+            Stage("store", store),
+        ], queue_size)
+
+        try:
+            stored = list(pipeline.run(selected))
+        finally:
+            if own_pool is not None:
+                own_pool.close()
+
+    with open(os.path.join(ocr_dir, SOURCE_FILE), "w", encoding="utf-8") as f:
+        json.dump({"pdf": os.path.abspath(pdf_path), "pages": stored, "layout": layout}, f, indent=2)
+    logger.info("OCR complete. Intermediates saved in: %s", output_dir)
+    return stored
+
+
+def _source(ocr_dir):
+    # What `ocr_pages` recorded about the stored pages, or {} when unknown
+    try:
+        with open(os.path.join(ocr_dir, SOURCE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _source_pdf(ocr_dir):
+    # The PDF the stored pages came from, or the directory itself when unknown
+    return _source(ocr_dir).get("pdf") or os.path.abspath(ocr_dir)
+
+
+def parse_stored(ocr_dir, output_dir, pdf_path=None, outputs=("parquet",), dataset_dir=None, index_dir=None):
+    """
+    Parse stored OCR output (`.ocr` files or PaddleOCR JSON) into a statement.
+
+    Pages are parsed in order with the same PII scan, parser and reconciliation
+    as the full pipeline; nothing is rendered or recognized, so neither
+    PaddleOCR nor OpenCV is loaded.
+
+    Args:
+        ocr_dir (str): Directory holding `page_N.ocr` or `page_N_paddleocr.json` files.
+        output_dir (str): Directory to write the transaction outputs to.
+        pdf_path (str, optional): Source PDF, for the statement id; read from
+            `source.json` when the pages were stored by `ocr_pages`.
+
+    Returns:
+        dict: The parsed statement, as returned by `main`.
+    """
+    pdf_path = pdf_path or _source_pdf(ocr_dir)
     os.makedirs(output_dir, exist_ok=True)
 
-    print("Converting PDF to images...")
-    images = pdf_to_images(pdf_path)
+    with telemetry.labels(document=statement_id(pdf_path)), telemetry.stage("document"):
+        parse = _page_parser()
+        results = []
+        for page_number, path in stored_pages(ocr_dir, ("ocr", "json")).items():
+            item = parse({"page_number": page_number, "ocr": load_page(path)})
+            results.append((page_number, item["ocr"], item["transactions"], item["matches"]))
+            logger.info("Parsed %d transactions from page %d.", len(item["transactions"]), page_number)
+        statement = _statement(results)
+
+        save_statement(statement, output_dir, pdf_path, outputs, dataset_dir, index_dir)
 
-    print("Running OCR on images...")
-    page_ocr = ocr_extractor(images)
+    logger.info("Parsing complete. Output saved in: %s", output_dir)
+    return statement
+
+
+def redact_stored(ocr_dir, images_dir, output_dir, fmt="jpeg", quality=95, workers=STAGE_WORKERS["redact"]):
+    """
+    Redact stored page images using their stored OCR output.
+
+    Args:
+        ocr_dir (str): Directory holding `page_N.ocr` or `page_N_paddleocr.json` files.
+        images_dir (str): Directory holding the matching `page_N.jpg` images.
+        output_dir (str): Directory to write the redacted pages to.
+        workers (int): Encoder threads.
+
+    Returns:
+        List[str]: Paths of the redacted pages, in page order.
+
+    Raises:
+        ValueError: If the pages were read with a parse-only layout, which skips footer PII.
+    """
+    layout = _source(ocr_dir).get("layout")
+    if layout in PARSE_ONLY_LAYOUTS:
+        raise ValueError(f"{ocr_dir} was read with --layout {layout}, which skips footer PII; "
+                         "run ocr again without it before redacting")
+    os.makedirs(output_dir, exist_ok=True)
+
+    images = stored_pages(images_dir, ("png", "jpg", "jpeg", "webp"))
+    written = []
+    with telemetry.labels(document=statement_id(_source_pdf(ocr_dir))), telemetry.stage("document"), \
+            RedactionWriter(output_dir, fmt, quality, workers) as writer:
+        for page_number, path in stored_pages(ocr_dir, ("ocr", "json")).items():
+            if page_number not in images:
+                logger.warning("No stored image for page %d in %s; skipped.", page_number, images_dir)
+                continue
+            with Image.open(images[page_number]) as img:
+                image = img.convert("RGB")
+            written.append(writer.write(image, load_page(path), page_number))
+
+    logger.info("Redaction complete. Output saved in: %s", output_dir)
+    return written
+
+
+def main_stream(pdf_path, output_dir, workers=1, pool=None, cache=None, text_layer=True, pages="all",
+                save_processed=False, fmt="jpeg", quality=95, outputs=("parquet",), dataset_dir=None, adaptive=None,
+                layout=None, stage_workers=None, queue_size=QUEUE_SIZE, index_dir=None):
+    """
+    Streaming variant of `main` that writes redacted pages and transactions incrementally.
+
+    With the "csv" output, transactions are appended to `transactions.csv` as each
+    page completes; the Parquet dataset and the other exports are written once the
+    whole document has been read and its account and period are known.
+    """
+    os.makedirs(output_dir, exist_ok=True)
 
-    print("Parsing account info and transactions...")
-    parsed_data = parser(page_ocr)
+    masked_account = None
+    transactions = []
 
-    print("Redacting sensitive information...")
-    redact_sensitive_info(images, page_ocr, output_dir)
+    f = None
+    if "csv" in outputs:
+        f = open(os.path.join(output_dir, "transactions.csv"), "w", newline="", encoding="utf-8")
+        writer = csv.DictWriter(f, fieldnames=TRANSACTION_FIELDS)
+        writer.writeheader()
+
+    try:
+        with telemetry.labels(document=statement_id(pdf_path)), telemetry.stage("document"):
+            pages_done = stream_pages(pdf_path, output_dir, workers, pool, cache, text_layer, pages, save_processed,
+                                      fmt, quality, adaptive, layout, stage_workers, queue_size)
+            for page_number, page, page_transactions, matches in pages_done:
+                if masked_account is None:
+                    masked_account = extract_masked_account(page, matches)
+
+                if f is not None:
+                    writer.writerows(page_transactions)
+                    f.flush()
+                transactions.extend(page_transactions)
+                logger.info("Parsed %d transactions from page %d.", len(page_transactions), page_number)
+    finally:
+        if f is not None:
+            f.close()
+
+    start_date, end_date = statement_period(transactions)
+    statement = {
+        "masked_account_number": masked_account,
+        "start_date": start_date,
+        "end_date": end_date,
+        "transactions": transactions
+    }
+
+    # transactions.csv is already on disk; the rest needs the whole statement
+    with telemetry.labels(document=statement_id(pdf_path)):
+        save_statement(statement, output_dir, pdf_path, tuple(o for o in outputs if o != "csv"), dataset_dir,
+                       index_dir)
+    if "csv" in outputs:
+        export_period_csv(statement, output_dir)
+
+    logger.info("Pipeline complete. Output saved in: %s", output_dir)
+    return statement
+
+
+def _add_ocr_arguments(arg_parser):
+    arg_parser.add_argument("--pdf", required=True, help="Path to the input PDF file")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="Number of OCR worker processes, each with its own warm engine")
+    arg_parser.add_argument("--force-ocr", action="store_true",
+                            help="OCR every page even when the PDF has an embedded text layer")
+    arg_parser.add_argument("--reuse-ocr", action="store_true",
+                            help="Serve OCR from the page cache when the same page has been seen before")
+    arg_parser.add_argument("--invalidate", action="store_true",
+                            help="Ignore cached OCR results and overwrite them with fresh ones")
+    arg_parser.add_argument("--ocr-dpi", type=int, default=RENDER_DPI,
+                            help=f"Resolution for the first OCR pass; below {RENDER_DPI}, only low-confidence lines "
+                                 f"are re-read at {RENDER_DPI} DPI (e.g. 150)")
+    arg_parser.add_argument("--min-confidence", type=float, default=ADAPTIVE_SETTINGS["min_confidence"],
+                            help="With --ocr-dpi, lines recognized below this confidence are re-read")
+    arg_parser.add_argument("--layout", default=None, choices=LAYOUT_MODES,
+                            help='Detect text lines first and recognize only those: "text" for every line, '
+                                 '"table" for the header and transaction tables only (ocr for parse only, since '
+                                 'footer PII is not read)')
+    arg_parser.add_argument("--stage-workers", default=None,
+                            help='Threads per pipeline stage, e.g. "render=3,deskew=2,ocr=4,redact=2" '
+                                 f'(default: {",".join(f"{k}={v}" for k, v in STAGE_WORKERS.items())})')
+    arg_parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                            help="Pages queued in front of each pipeline stage")
+    arg_parser.add_argument("--cache-dir", default=".ocr_cache", help="Directory for the OCR page cache")
+    arg_parser.add_argument("--cache-size-mb", type=int, default=512,
+                            help="Maximum size of the OCR page cache before old entries are evicted")
+
+
+def _add_dataset_arguments(arg_parser):
+    arg_parser.add_argument("--outputs", default="parquet",
+                            help=f'Comma-separated transaction outputs from {", ".join(OUTPUT_FORMATS)} '
+                                 '(default: "parquet")')
+    arg_parser.add_argument("--dataset", default=None,
+                            help="Parquet dataset directory to append to (default: <output>/transactions)")
+    arg_parser.add_argument("--index", default=None,
+                            help='Transaction index to merge into with the "index" output (default: <output>/index)')
+
+
+def _add_image_arguments(arg_parser):
+    arg_parser.add_argument("--format", default="jpeg", choices=sorted(OUTPUT_EXTENSIONS),
+                            help="Image format for the redacted pages")
+    arg_parser.add_argument("--quality", type=int, default=95, help="Encoder quality for jpeg/webp output")
+
+
+def _add_stored_arguments(arg_parser):
+    arg_parser.add_argument("--input", required=True,
+                            help=f"Output directory of the ocr command, holding {OCR_DIR}/ and {IMAGES_DIR}/")
+    arg_parser.add_argument("--ocr-dir", default=None,
+                            help=f"Directory with the stored OCR pages (default: <input>/{OCR_DIR})")
+
+
+def _ocr_options(args, arg_parser, stages):
+    adaptive = None
+    if args.ocr_dpi < RENDER_DPI:
+        adaptive = {"scale": args.ocr_dpi / RENDER_DPI, "min_confidence": args.min_confidence}
+
+    if adaptive and args.layout:
+        arg_parser.error("--ocr-dpi and --layout cannot be combined")
+
+    # Adaptive and layout results differ from whole-page ones, so they are cached apart
+    settings = dict(OCR_SETTINGS)
+    if adaptive:
+        settings["adaptive"] = adaptive
+    if args.layout:
+        settings["layout"] = args.layout
+    cache = None
+    if args.reuse_ocr or args.invalidate:
+        cache = OCRCache(args.cache_dir, args.cache_size_mb * 1024 * 1024, settings, refresh=args.invalidate)
+
+    options = {
+        "cache": cache,
+        "text_layer": not args.force_ocr,
+        "adaptive": adaptive,
+        "layout": args.layout,
+        "queue_size": args.queue_size,
+    }
+    if args.stage_workers:
+        try:
+            options["stage_workers"] = parse_stage_workers(args.stage_workers)
+        except ValueError as e:
+            arg_parser.error(str(e))
+        unknown = set(options["stage_workers"]) - set(stages)
+        if unknown:
+            arg_parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+    if args.pages:
+        _check_pages(args.pages, arg_parser)
+        options["pages"] = args.pages
+    return options
+
+
+def _check_pages(spec, arg_parser):
+    # Reject a malformed --pages before any PDF is opened; the page count is not needed for that
+    if spec != "auto":
+        try:
+            parse_page_range(spec, 0)
+        except ValueError as e:
+            arg_parser.error(str(e))
+
+
+def _outputs(args, arg_parser):
+    outputs = tuple(o.strip() for o in args.outputs.split(",") if o.strip())
+    unknown = set(outputs) - set(OUTPUT_FORMATS)
+    if unknown:
+        arg_parser.error(f"unknown output(s): {', '.join(sorted(unknown))}")
+    return outputs
 
-    print("Pipeline complete. Output saved in:", output_dir)
-    return parsed_data
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Peepalytics Full Redaction Pipeline CLI")
-    parser.add_argument("--pdf", required=True, help="Path to the input PDF file")
-    parser.add_argument("--output", required=True, help="Directory to save output files")
+    arg_parser = argparse.ArgumentParser(description="Peepalytics Full Redaction Pipeline CLI")
+    commands = arg_parser.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+
+    run_parser = commands.add_parser("run", help="Render, OCR, parse and redact a statement (the default)")
+    _add_ocr_arguments(run_parser)
+    run_parser.add_argument("--output", required=True, help="Directory to save output files")
+    run_parser.add_argument("--stream", action="store_true",
+                            help="Process every page one at a time and write outputs incrementally")
+    run_parser.add_argument("--pages", default=None,
+                            help='Pages to process, e.g. "1-2", "3,5-7", "all" or "auto" to pick pages by content '
+                                 '(default: "1-2", or "all" with --stream)')
+    run_parser.add_argument("--save-processed", action="store_true",
+                            help=f"Also write the deskewed page images to <output>/{IMAGES_DIR}")
+    _add_image_arguments(run_parser)
+    _add_dataset_arguments(run_parser)
+
+    ocr_parser = commands.add_parser("ocr", help="Render, deskew and OCR a statement and store the results")
+    _add_ocr_arguments(ocr_parser)
+    ocr_parser.add_argument("--output", required=True,
+                            help=f"Directory to store {OCR_DIR}/page_N.ocr and {IMAGES_DIR}/page_N.jpg in")
+    ocr_parser.add_argument("--pages", default=None,
+                            help='Pages to process, e.g. "1-2", "3,5-7", "all" or "auto" (default: "all")')
 
-    args = parser.parse_args()
-    main(args.pdf, args.output)
+    parse_parser = commands.add_parser("parse", help="Parse stored OCR output into transactions")
+    _add_stored_arguments(parse_parser)
+    parse_parser.add_argument("--output", required=True, help="Directory to save the transaction outputs")
+    parse_parser.add_argument("--pdf", default=None,
+                              help=f"Source PDF, for the statement id (default: from <ocr-dir>/{SOURCE_FILE})")
+    _add_dataset_arguments(parse_parser)
 
+    redact_parser = commands.add_parser("redact", help="Redact stored page images using stored OCR output")
+    _add_stored_arguments(redact_parser)
+    redact_parser.add_argument("--images-dir", default=None,
+                               help=f"Directory with the stored page images (default: <input>/{IMAGES_DIR})")
+    redact_parser.add_argument("--output", required=True, help="Directory to save the redacted pages")
+    _add_image_arguments(redact_parser)
 
+    for command in COMMANDS:
+        telemetry.add_arguments(commands.choices[command])
 
+    # `python -m extractor --pdf ... --output ...` still means `run`
+    argv = sys.argv[1:]
+    if argv and argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv = ["run"] + argv
+    args = arg_parser.parse_args(argv)
+    if args.command is None:
+        arg_parser.print_help()
+        sys.exit(2)
+    telemetry.configure(args.log_level, args.metrics_jsonl, args.metrics_port)
 
+    try:
+        if args.command == "run":
+            if args.layout in PARSE_ONLY_LAYOUTS:
+                run_parser.error(f"--layout {args.layout} skips footer PII, which would stay unredacted; "
+                                 "use it with ocr and parse instead")
+            options = _ocr_options(args, run_parser, set(STAGE_WORKERS) | {"ocr"})
+            options.update(save_processed=args.save_processed, fmt=args.format, quality=args.quality,
+                           outputs=_outputs(args, run_parser), dataset_dir=args.dataset, index_dir=args.index)
+            if args.stream:
+                main_stream(args.pdf, args.output, args.workers, **options)
+            else:
+                main(args.pdf, args.output, args.workers, **options)
+        elif args.command == "ocr":
+            options = _ocr_options(args, ocr_parser, {"render", "deskew", "ocr"})
+            ocr_pages(args.pdf, args.output, args.workers, **options)
+        elif args.command == "parse":
+            parse_stored(args.ocr_dir or os.path.join(args.input, OCR_DIR), args.output, args.pdf,
+                         _outputs(args, parse_parser), args.dataset, args.index)
+        else:
+            redact_stored(args.ocr_dir or os.path.join(args.input, OCR_DIR),
+                          args.images_dir or os.path.join(args.input, IMAGES_DIR), args.output, args.format,
+                          args.quality)
+    finally:
+        telemetry.clear_sinks()
@@ -0,0 +1,313 @@
+# batch.py
+
+"""
+Batch extraction over many statements.
+
+Takes a directory, a glob pattern or a manifest file (one PDF path per line),
+and runs each statement through the streaming pipeline on a pool of worker
+processes, each holding its own warm OCR engine.
+
+    python -m extractor.batch --input "intake/*.pdf" --output out --jobs 8
+
+Documents are scheduled largest first by file size, so a long statement picked
+up last does not hold the whole batch up. Each statement writes into its own
+folder under the output directory, and a `_SUCCESS.json` marker is written once
+it is complete. Re-running the same command after a crash skips statements
+whose marker matches the input file, unless `--force` is given.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+
+from scripts.preprocess import parse_page_range, RENDER_DPI
+from extractor import telemetry
+from extractor.__main__ import main_stream, QUEUE_SIZE
+from extractor.cache import OCRCache
+from extractor.layout import LAYOUT_MODES, PARSE_ONLY_LAYOUTS
+from extractor.ocr import OCR_SETTINGS, ADAPTIVE_SETTINGS, get_ocr_engine
+from extractor.pipeline import parse_stage_workers
+from extractor.redact import OUTPUT_EXTENSIONS
+from extractor.store import OUTPUT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+DONE_MARKER = "_SUCCESS.json"
+REPORT_FILE = "batch_report.json"
+
+
+def collect_inputs(source):
+    """
+    Expand a batch source into a sorted list of PDF paths.
+
+    Args:
+        source (str): A directory (its *.pdf files), a glob pattern, a single PDF,
+            or a manifest file listing one PDF per line. Blank lines and lines
+            starting with "#" are ignored; relative paths are resolved against
+            the manifest's folder.
+
+    Returns:
+        List[str]: Paths of the PDFs to process.
+    """
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "*.pdf")) + glob.glob(os.path.join(source, "*.PDF"))
+    elif os.path.isfile(source) and not source.lower().endswith(".pdf"):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, encoding="utf-8") as f:
+            lines = [line.strip() for line in f]
+        paths = [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+    elif os.path.isfile(source):
+        paths = [source]
+    else:
+        paths = glob.glob(source, recursive=True)
+
+    return sorted(set(os.path.normpath(p) for p in paths))
+
+
+def document_dirs(pdf_paths, output_dir):
+    """
+    Give every statement its own output folder.
+
+    Folders are named after the PDF; statements that share a file name get a
+    short hash of their full path appended so they cannot overwrite each other.
+
+    Returns:
+        Dict[str, str]: Output folder for each PDF path.
+    """
+    by_stem = defaultdict(list)
+    for path in pdf_paths:
+        by_stem[os.path.splitext(os.path.basename(path))[0]].append(path)
+
+    dirs = {}
+    for stem, paths in by_stem.items():
+        for path in paths:
+            name = stem
+            if len(paths) > 1:
+                name += "-" + hashlib.blake2b(os.path.abspath(path).encode(), digest_size=4).hexdigest()
+            dirs[path] = os.path.join(output_dir, name)
+    return dirs
+
+
+def _source_stamp(pdf_path):
+    stat = os.stat(pdf_path)
+    return {"source": os.path.abspath(pdf_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def is_done(pdf_path, doc_dir):
+    """
+    True if `doc_dir` holds a completed run of this exact input file.
+    """
+    try:
+        with open(os.path.join(doc_dir, DONE_MARKER), encoding="utf-8") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    stamp = _source_stamp(pdf_path)
+    return all(marker.get(k) == v for k, v in stamp.items())
+
+
+def _write_json(path, data):
+    # Write then rename, so a crash never leaves a half-written marker behind
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _init_batch_worker(cpu_threads, log_level="info", metrics_jsonl=None):
+    # Spawned workers start with no logging or sinks; every worker appends to the same metrics file
+    telemetry.configure(log_level, metrics_jsonl)
+    get_ocr_engine(cpu_threads)
+
+
+def _run_document(task):
+    pdf_path, doc_dir, options = task
+    options = dict(options)
+    cache_options = options.pop("cache", None)
+    if cache_options:
+        options["cache"] = OCRCache(**cache_options)
+
+    start = time.time()
+    try:
+        result = main_stream(pdf_path, doc_dir, **options)
+    except Exception as e:
+        logger.exception("Failed to process %s", pdf_path)
+        return {"pdf": pdf_path, "output": doc_dir, "status": "failed", "error": f"{type(e).__name__}: {e}",
+                "seconds": time.time() - start}
+
+    summary = {
+        "pdf": pdf_path,
+        "output": doc_dir,
+        "status": "done",
+        "transactions": len(result["transactions"]),
+        "masked_account_number": result["masked_account_number"],
+        "start_date": result["start_date"],
+        "end_date": result["end_date"],
+        "seconds": time.time() - start,
+    }
+    _write_json(os.path.join(doc_dir, DONE_MARKER), {**_source_stamp(pdf_path), **summary})
+    return summary
+
+
+def run_batch(source, output_dir, jobs=None, ocr_threads=None, force=False, log_level="info", metrics_jsonl=None,
+              **options):
+    """
+    Process every statement in `source` across a pool of worker processes.
+
+    Args:
+        source (str): Directory, glob pattern or manifest file (see `collect_inputs`).
+        output_dir (str): Root folder; each statement writes to its own subfolder.
+        jobs (int, optional): Number of worker processes; defaults to the CPU count.
+        ocr_threads (int, optional): Math-library threads per OCR engine; defaults to
+            an even share of the CPUs so the workers do not oversubscribe them.
+        force (bool): Reprocess statements that already have a completion marker.
+        log_level (str): Logging level inside the worker processes.
+        metrics_jsonl (str, optional): JSON lines file every worker appends its
+            stage timings and counters to.
+        **options: Passed to `main_stream` for every statement (pages, fmt, quality,
+            text_layer, save_processed, outputs, adaptive, layout, stage_workers,
+            queue_size). Parquet output from every statement is appended to one
+            dataset, `<output_dir>/transactions` unless `dataset_dir` is given.
+            With the "index" output, every statement also goes into one index,
+            `<output_dir>/index` unless `index_dir` is given. `cache` takes
+            `OCRCache` keyword arguments rather than a cache object, since each
+            worker opens its own handle.
+
+    Returns:
+        List[dict]: One summary per statement with its status ("done", "skipped"
+        or "failed"), output folder and timing.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    options.setdefault("dataset_dir", os.path.join(output_dir, "transactions"))
+    options.setdefault("index_dir", os.path.join(output_dir, "index"))
+    jobs = jobs or os.cpu_count() or 1
+    ocr_threads = ocr_threads or max(1, (os.cpu_count() or 1) // jobs)
+
+    pdf_paths = collect_inputs(source)
+    dirs = document_dirs(pdf_paths, output_dir)
+
+    report = []
+    pending = []
+    for path in pdf_paths:
+        if not force and is_done(path, dirs[path]):
+            report.append({"pdf": path, "output": dirs[path], "status": "skipped"})
+        else:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0  # unreadable; the worker reports the real error
+            pending.append((size, path))
+
+    telemetry.count("documents", len(report), status="skipped")
+    logger.info("Batch: %d statement(s), %d already done, %d to process.", len(pdf_paths), len(report), len(pending))
+
+    # Longest-processing-time first: big statements start early, small ones fill the gaps.
+    # File size stands in for page count so scheduling never opens a PDF in the parent.
+    pending.sort(key=lambda item: item[0], reverse=True)
+    tasks = [(path, dirs[path], options) for _, path in pending]
+
+    if tasks:
+        start = time.time()
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(min(jobs, len(tasks)), initializer=_init_batch_worker,
+                      initargs=(ocr_threads, log_level, metrics_jsonl)) as pool:
+            for i, summary in enumerate(pool.imap_unordered(_run_document, tasks, chunksize=1), 1):
+                report.append(summary)
+                telemetry.count("documents", status=summary["status"])
+                logger.info("[%d/%d] %s: %s (%.1fs)", i, len(tasks), summary["status"], summary["pdf"],
+                            summary["seconds"])
+        logger.info("Batch finished in %.1fs.", time.time() - start)
+
+    _write_json(os.path.join(output_dir, REPORT_FILE), report)
+    return report
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Peepalytics batch extraction over many statements")
+    arg_parser.add_argument("--input", required=True,
+                            help="Directory of PDFs, glob pattern (quote it) or manifest file with one PDF per line")
+    arg_parser.add_argument("--output", required=True, help="Root directory; each statement gets its own folder")
+    arg_parser.add_argument("--jobs", type=int, default=None,
+                            help="Number of worker processes (default: one per CPU)")
+    arg_parser.add_argument("--ocr-threads", type=int, default=None,
+                            help="Math-library threads per OCR engine (default: CPUs divided by jobs)")
+    arg_parser.add_argument("--force", action="store_true",
+                            help="Reprocess statements that already completed in a previous run")
+    arg_parser.add_argument("--pages", default="all", help='Pages to process in every statement, e.g. "all" or "auto"')
+    arg_parser.add_argument("--format", default="jpeg", choices=sorted(OUTPUT_EXTENSIONS),
+                            help="Image format for the redacted pages")
+    arg_parser.add_argument("--quality", type=int, default=95, help="Encoder quality for jpeg/webp output")
+    arg_parser.add_argument("--outputs", default="parquet",
+                            help=f'Comma-separated transaction outputs from {", ".join(OUTPUT_FORMATS)} '
+                                 '(default: "parquet")')
+    arg_parser.add_argument("--force-ocr", action="store_true",
+                            help="OCR every page even when the PDF has an embedded text layer")
+    arg_parser.add_argument("--reuse-ocr", action="store_true",
+                            help="Serve OCR from the shared page cache when the same page has been seen before")
+    arg_parser.add_argument("--ocr-dpi", type=int, default=RENDER_DPI,
+                            help=f"Resolution for the first OCR pass; below {RENDER_DPI}, only low-confidence lines "
+                                 f"are re-read at {RENDER_DPI} DPI (e.g. 150)")
+    arg_parser.add_argument("--min-confidence", type=float, default=ADAPTIVE_SETTINGS["min_confidence"],
+                            help="With --ocr-dpi, lines recognized below this confidence are re-read")
+    # Every statement is redacted, so the parse-only layouts are not offered
+    arg_parser.add_argument("--layout", default=None,
+                            choices=[mode for mode in LAYOUT_MODES if mode not in PARSE_ONLY_LAYOUTS],
+                            help="Detect text lines first and recognize only those")
+    arg_parser.add_argument("--stage-workers", default=None,
+                            help='Threads per pipeline stage in every statement, e.g. "render=2,redact=2"')
+    arg_parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                            help="Pages queued in front of each pipeline stage")
+    arg_parser.add_argument("--cache-dir", default=".ocr_cache", help="Directory for the OCR page cache")
+
+    telemetry.add_arguments(arg_parser)
+
+    args = arg_parser.parse_args()
+    outputs = tuple(o.strip() for o in args.outputs.split(",") if o.strip())
+    unknown = set(outputs) - set(OUTPUT_FORMATS)
+    if unknown:
+        arg_parser.error(f"unknown output(s): {', '.join(sorted(unknown))}")
+    if args.pages != "auto":
+        try:
+            parse_page_range(args.pages, 0)
+        except ValueError as e:
+            arg_parser.error(str(e))
+    # Workers write the per-stage metrics; the parent only serves Prometheus totals if asked
+    telemetry.configure(args.log_level, metrics_port=args.metrics_port)
+
+    options = {
+        "pages": args.pages,
+        "fmt": args.format,
+        "quality": args.quality,
+        "text_layer": not args.force_ocr,
+        "outputs": outputs,
+        "queue_size": args.queue_size,
+    }
+    if args.stage_workers:
+        try:
+            options["stage_workers"] = parse_stage_workers(args.stage_workers)
+        except ValueError as e:
+            arg_parser.error(str(e))
+    if args.ocr_dpi < RENDER_DPI:
+        options["adaptive"] = {"scale": args.ocr_dpi / RENDER_DPI, "min_confidence": args.min_confidence}
+    if args.layout:
+        if "adaptive" in options:
+            arg_parser.error("--ocr-dpi and --layout cannot be combined")
+        options["layout"] = args.layout
+    if args.reuse_ocr:
+        settings = dict(OCR_SETTINGS)
+        for name in ("adaptive", "layout"):
+            if name in options:
+                settings[name] = options[name]
+        options["cache"] = {"cache_dir": args.cache_dir, "settings": settings}
+
+    report = run_batch(args.input, args.output, args.jobs, args.ocr_threads, args.force, args.log_level,
+                       args.metrics_jsonl, **options)
+    failed = [r for r in report if r["status"] == "failed"]
+    if failed:
+        logger.warning("%d statement(s) failed; see %s", len(failed), os.path.join(args.output, REPORT_FILE))
@@ -0,0 +1,133 @@
+# cache.py
+
+"""
+Content-addressed on-disk cache for page OCR results.
+
+Entries are keyed by a hash of the preprocessed page pixels together with the
+OCR settings, so re-running a statement (or re-parsing after a parser fix)
+skips recognition for every page that has been seen before. Pages are stored in
+the compact `.ocr` format (see extractor/ocrpage.py), so a hit is one small
+read with nothing to parse.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from extractor.ocrpage import OCRPage, as_page
+
+
+class OCRCache:
+    """
+    Directory of OCR results with size-based LRU eviction.
+
+    Recency is tracked through file modification times, which are refreshed on
+    every hit; when the cache grows past `max_bytes` the least recently used
+    entries are removed until it is back under the low-water mark.
+
+    Args:
+        cache_dir (str): Directory holding the cache entries.
+        max_bytes (int): Upper bound on the total size of cached entries.
+        settings (dict): OCR settings folded into every key.
+        refresh (bool): Ignore existing entries and overwrite them with fresh results.
+    """
+
+    def __init__(self, cache_dir=".ocr_cache", max_bytes=512 * 1024 * 1024, settings=None, refresh=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self._settings = json.dumps(settings or {}, sort_keys=True).encode("utf-8")
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def key(self, img):
+        """
+        Hash a PIL page image and the OCR settings into a cache key.
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(self._settings)
+        h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode("utf-8"))
+        h.update(img.tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.ocr")
+
+    def get(self, key):
+        """
+        Return the cached OCR result for `key`, or None on a miss.
+        """
+        if self.refresh:
+            return None
+
+        path = self._path(key)
+        try:
+            result = OCRPage.load(path)
+        except (OSError, ValueError):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        Store an OCR result, evicting old entries if the cache is over budget.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        as_page(result).save(tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                # .json entries are left over from the earlier format and only wait to be evicted
+                if name.endswith((".ocr", ".json")):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        # Re-scan so entries written by other processes are accounted for
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        self._size = total
+
+    def clear(self):
+        """
+        Remove every cached entry.
+        """
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._size = 0
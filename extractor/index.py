@@ -0,0 +1,350 @@
+# index.py
+
+"""
+Persistent per-account transaction index.
+
+The statement dataset (see store.py) keeps one set of files per statement, so
+statements with overlapping periods - or the same month ingested twice from
+different files - repeat the same transactions. The index merges every
+statement of an account into one copy of its history:
+
+    <index>/account=%2A%2A%2A%2A567/month=2023-04/part-0.parquet
+
+A transaction is identified by its account, date, signed amount in cents and a
+hash of its normalized description, plus an occurrence number that tells apart
+identical transactions on the same day (two equal card payments). Upserting a
+statement rewrites only the months it touches: rows already present under the
+same key are replaced by the newer statement's copy, and rows an earlier run of
+the same statement produced but no longer does are dropped. Files are sorted by
+date, so a range lookup for one account opens only that account's directory and
+the months in range:
+
+    upsert(index_dir, statement, statement_id(pdf_path))
+    read_index(index_dir, account="****567", start="01-01-2023", end="31-12-2023")
+
+Writers of the same account take turns through a lock file, so concurrent batch
+workers can share an index. The directory layout matches the statement dataset
+(hive partitions with `month`, the same transaction columns), so the dashboard
+can read either.
+
+    python -m extractor.index data/index --ingest data/transactions       # backfill from the dataset
+    python -m extractor.index data/index --account "****567" --start 01-01-2023 --output history.csv
+"""
+
+import argparse
+import csv
+import datetime
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import quote
+
+import numpy as np
+
+from extractor import telemetry
+from extractor.store import (DATE_FORMAT, PARTITION_COLUMN, TRANSACTION_FIELDS, read_transactions,
+                             transaction_schema, transactions_table)
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_COLUMN = "account"
+# Partition value for statements whose account number was not found
+UNKNOWN_ACCOUNT = "unknown"
+# Columns that identify a transaction within an account
+INDEX_KEY = ("date", "amount_cents", "description_hash", "occurrence")
+INDEX_FILE = "part-0.parquet"
+
+# Seconds a writer waits for another writer of the same account before giving up
+LOCK_TIMEOUT = 120
+_LOCK_POLL = 0.05
+
+
+@lru_cache(maxsize=None)
+def index_schema():
+    """
+    Arrow schema of the index files: the dataset's transaction columns plus the
+    key columns, without the partition columns.
+    """
+    import pyarrow as pa
+
+    fields = [f for f in transaction_schema() if f.name != PARTITION_COLUMN]
+    return pa.schema(fields + [
+        ("amount_cents", pa.int64()),
+        ("description_hash", pa.int64()),
+        ("occurrence", pa.int32()),
+    ])
+
+
+def _partitioning(with_account):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fields = ([(ACCOUNT_COLUMN, pa.string())] if with_account else []) + [(PARTITION_COLUMN, pa.string())]
+    return ds.partitioning(pa.schema(fields), flavor="hive")
+
+
+def description_hash(description):
+    """
+    Signed 64-bit hash of a description, ignoring case and runs of whitespace.
+    """
+    normalized = " ".join((description or "").lower().split())
+    return int.from_bytes(hashlib.blake2b(normalized.encode(), digest_size=8).digest(), "little", signed=True)
+
+
+def account_dir(index_dir, account):
+    """
+    Directory holding one account's partitions; the account is URI-encoded as hive partition values are.
+    """
+    return os.path.join(index_dir, f"{ACCOUNT_COLUMN}={quote(account or UNKNOWN_ACCOUNT, safe='')}")
+
+
+def _as_date(value):
+    if value is None or isinstance(value, datetime.date):
+        return value.date() if isinstance(value, datetime.datetime) else value
+    return datetime.datetime.strptime(value, DATE_FORMAT).date()
+
+
+def key_columns(table):
+    """
+    Add the key columns to a table shaped like `transactions_table` output.
+
+    Rows without a date cannot be placed in a month or matched against other
+    statements, so they are dropped. Occurrences are counted per statement.
+
+    Returns:
+        pyarrow.Table
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    table = table.filter(pc.is_valid(table["date"]))
+    money_in = np.nan_to_num(table["money_in"].to_numpy(zero_copy_only=False).astype(np.float64))
+    money_out = np.nan_to_num(table["money_out"].to_numpy(zero_copy_only=False).astype(np.float64))
+    cents = np.rint((money_in - money_out) * 100).astype(np.int64)
+    hashes = np.fromiter((description_hash(d) for d in table["description"].to_pylist()),
+                         dtype=np.int64, count=table.num_rows)
+
+    seen = {}
+    occurrence = np.empty(table.num_rows, dtype=np.int32)
+    keys = zip(table["statement_id"].to_pylist(), table["date"].to_pylist(), cents.tolist(), hashes.tolist())
+    for i, key in enumerate(keys):
+        occurrence[i] = seen.get(key, 0)
+        seen[key] = occurrence[i] + 1
+
+    return (table.append_column("amount_cents", pa.array(cents))
+            .append_column("description_hash", pa.array(hashes))
+            .append_column("occurrence", pa.array(occurrence)))
+
+
+@contextmanager
+def _locked(directory, timeout=LOCK_TIMEOUT):
+    # A lock file created exclusively; dot-prefixed, so dataset readers skip it
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, ".lock")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{directory} is locked by another writer; remove {path} if none is running")
+            time.sleep(_LOCK_POLL)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def _merge(old, new):
+    # Later rows win: a key seen in `new` replaces the `old` row under it
+    import pyarrow as pa
+
+    merged = pa.concat_tables([old, new]) if old is not None else new
+    merged = merged.append_column("_order", pa.array(np.arange(merged.num_rows)))
+    latest = merged.group_by(list(INDEX_KEY), use_threads=False).aggregate([("_order", "max")])
+    merged = merged.take(np.sort(latest["_order_max"].to_numpy())).drop_columns(["_order"])
+    return merged.sort_by([("date", "ascending"), ("statement_id", "ascending"), ("row", "ascending")])
+
+
+def _write(path, table):
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    pq.write_table(table, temporary)
+    os.replace(temporary, path)
+
+
+def upsert_table(index_dir, table):
+    """
+    Merge transactions into the index.
+
+    Args:
+        index_dir (str): Root folder of the index.
+        table (pyarrow.Table): Rows shaped like `transactions_table` output, from
+            one or more statements; where statements overlap, the later rows win.
+
+    Returns:
+        dict: {"rows": rows upserted, "duplicates": rows that replaced a copy from
+        another statement, "months": partitions rewritten}
+    """
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    table = key_columns(table)
+    summary = {"rows": table.num_rows, "duplicates": 0, "months": 0}
+    account_numbers = table["masked_account_number"]
+
+    with telemetry.stage("index"):
+        for account in pc.unique(account_numbers).to_pylist():
+            rows = table.filter(pc.is_null(account_numbers) if account is None else pc.equal(account_numbers, account))
+            statements = pc.unique(rows["statement_id"])
+            directory = account_dir(index_dir, account)
+
+            with _locked(directory):
+                months = set(pc.unique(rows[PARTITION_COLUMN]).to_pylist())
+                existing = {name.split("=", 1)[1] for name in os.listdir(directory)
+                            if name.startswith(f"{PARTITION_COLUMN}=")}
+                for month in sorted(months | existing):
+                    path = os.path.join(directory, f"{PARTITION_COLUMN}={month}", INDEX_FILE)
+                    old = pq.read_table(path, schema=index_schema()) if os.path.exists(path) else None
+                    if old is not None:
+                        # Rows of these statements are replaced wholesale, so rows a re-run no longer finds go
+                        stale = pc.is_in(old["statement_id"], value_set=statements)
+                        if month not in months and not pc.any(stale).as_py():
+                            continue
+                        old = old.filter(pc.invert(stale))
+                    new = rows.filter(pc.equal(rows[PARTITION_COLUMN], month)).drop_columns([PARTITION_COLUMN])
+                    merged = _merge(old, new.select(index_schema().names))
+                    summary["duplicates"] += (old.num_rows if old is not None else 0) + new.num_rows - merged.num_rows
+                    summary["months"] += 1
+                    _write(path, merged)
+
+    logger.info("Indexed %d transactions (%d duplicates of other statements) in %s", summary["rows"],
+                summary["duplicates"], index_dir)
+    return summary
+
+
+def upsert(index_dir, statement, statement_key):
+    """
+    Merge one parsed statement into the index; see `upsert_table`.
+
+    Args:
+        index_dir (str): Root folder of the index, shared between statements.
+        statement (dict): Output of `parser` / `main_stream`.
+        statement_key (str): Identifier of the statement, see `statement_id`.
+    """
+    return upsert_table(index_dir, transactions_table(statement, statement_key))
+
+
+def ingest_dataset(index_dir, dataset_dir):
+    """
+    Build or extend the index from a statement dataset written by `write_parquet`,
+    without re-parsing anything. Statements are merged in period order.
+
+    Returns:
+        dict: Totals as returned by `upsert_table`.
+    """
+    table = read_transactions(dataset_dir)
+    table = table.sort_by([("period_start", "ascending"), ("statement_id", "ascending"), ("row", "ascending")])
+    return upsert_table(index_dir, table)
+
+
+def read_index(index_dir, account=None, start=None, end=None, columns=None):
+    """
+    Look up transactions by account and date range.
+
+    Args:
+        index_dir (str): Root folder of the index.
+        account (str, optional): Masked account number; only its directory is
+            opened. All accounts by default.
+        start, end (datetime.date | str, optional): Inclusive bounds, as dates or
+            "%d-%m-%Y" strings.
+        columns (list, optional): Columns to read; all by default.
+
+    Returns:
+        pyarrow.Table: Matching rows, in date order within each account.
+    """
+    import pyarrow.dataset as ds
+
+    root = index_dir if account is None else account_dir(index_dir, account)
+    if not os.path.isdir(root):
+        return index_schema().empty_table().select(columns or index_schema().names)
+    dataset = ds.dataset(root, format="parquet", partitioning=_partitioning(account is None))
+
+    expr = None
+    for bound, op in ((_as_date(start), "ge"), (_as_date(end), "le")):
+        if bound is None:
+            continue
+        # The month partition lets the scan skip whole directories
+        month, date = ds.field(PARTITION_COLUMN), ds.field("date")
+        part = ((month >= f"{bound:%Y-%m}") & (date >= bound) if op == "ge"
+                else (month <= f"{bound:%Y-%m}") & (date <= bound))
+        expr = part if expr is None else expr & part
+
+    table = dataset.to_table(columns=columns, filter=expr)
+    if "date" in table.column_names:
+        table = table.sort_by([("masked_account_number", "ascending"), ("date", "ascending")]
+                              if "masked_account_number" in table.column_names else [("date", "ascending")])
+    return table
+
+
+def accounts(index_dir):
+    """
+    Masked account numbers in the index.
+    """
+    import pyarrow.dataset as ds
+
+    if not os.path.isdir(index_dir):
+        return []
+    dataset = ds.dataset(index_dir, format="parquet", partitioning=_partitioning(True))
+    return sorted(a for a in dataset.to_table(columns=["masked_account_number"])["masked_account_number"]
+                  .unique().to_pylist() if a)
+
+
+def export_csv(table, path):
+    """
+    Write index rows as a transactions CSV, with the account on every row.
+    """
+    fields = ["masked_account_number"] + TRANSACTION_FIELDS
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for row in table.select(fields).to_pylist():
+            row["date"] = row["date"].strftime(DATE_FORMAT) if row["date"] else None
+            writer.writerow(row)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Build and query the per-account transaction index")
+    arg_parser.add_argument("index", help="Index directory")
+    arg_parser.add_argument("--ingest", default=None, help="Statement dataset to merge into the index first")
+    arg_parser.add_argument("--account", default=None, help="Masked account number to look up")
+    arg_parser.add_argument("--start", default=None, help="First date to look up, as dd-mm-yyyy")
+    arg_parser.add_argument("--end", default=None, help="Last date to look up, as dd-mm-yyyy")
+    arg_parser.add_argument("--output", default=None, help="Write the looked-up transactions to this CSV")
+
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        start, end = _as_date(args.start), _as_date(args.end)
+    except ValueError as e:
+        arg_parser.error(str(e))
+
+    if args.ingest:
+        ingest_dataset(args.index, args.ingest)
+
+    if args.output:
+        table = read_index(args.index, args.account, start, end)
+        export_csv(table, args.output)
+        print(f"{table.num_rows} transactions written to {args.output}")
+    else:
+        for account in ([args.account] if args.account else accounts(args.index)):
+            dates = read_index(args.index, account, start, end, columns=["date"])["date"].to_pylist()
+            span = f"{min(dates):%d-%m-%Y} to {max(dates):%d-%m-%Y}" if dates else "no transactions"
+            print(f"{account}: {len(dates)} transactions, {span}")
@@ -0,0 +1,202 @@
+# layout.py
+
+"""
+Page layout analysis ahead of text recognition.
+
+Finds the text lines on a rendered page with a few OpenCV passes over a
+downscaled, binarized copy - far cheaper than a neural text detector - and
+decides which of them need to be read:
+
+    "text"   every text line; logos, charts, rules and blank margins are dropped.
+    "table"  only the header band (bank, client and account details) and the
+             transaction table, which is all `parser` needs. Footers and
+             disclaimers are skipped, so PII printed there is not redacted;
+             meant for parse-only runs.
+
+Lines come back as boxes in page coordinates; their crops go to recognition
+only (see `ocr.BatchRecognizer`), which packs lines from many pages into each
+batch. OpenCV is loaded on the first call to `detect_lines`.
+"""
+
+import numpy as np
+
+LAYOUT_MODES = ("text", "table")
+# Modes that skip text which may hold PII; commands that write redacted pages refuse them
+PARSE_ONLY_LAYOUTS = ("table",)
+
+# The page is analysed at this fraction of its rendered size
+LAYOUT_SCALE = 0.5
+# Line heights accepted as text, in rendered pixels (300 DPI: roughly 6 to 40 pt)
+MIN_LINE_HEIGHT = 18
+MAX_LINE_HEIGHT = 140
+# Horizontal gap bridged between glyphs of one line, as a fraction of its height;
+# word spaces are bridged, table column gaps are not
+WORD_GAP_RATIO = 0.6
+# Runs on one row closer than this many line heights are one line, so a label
+# and its value ("Account number: 1234567") are read, and scanned for PII, together
+LINE_GAP_RATIO = 1.0
+# Ink must cover at least this share of a line's bounding box (drops chart strokes)
+MIN_FILL = 0.08
+# Rendered pixels of context kept around each line crop
+LINE_PAD = 4
+
+# Share of the page height, from the top, that holds the account details
+HEADER_BAND = 0.25
+# Blank space, in line heights, that separates one block of text from the next
+BLOCK_GAP = 1.0
+# A block is a table when this many of its rows hold this many separate lines
+TABLE_MIN_ROWS = 3
+TABLE_MIN_CELLS = 3
+
+
+def detect_lines(img, scale=LAYOUT_SCALE):
+    """
+    Find the text lines on a page.
+
+    Args:
+        img (PIL.Image.Image): Rendered (and deskewed) page.
+        scale (float): Fraction of the page size to analyse at.
+
+    Returns:
+        np.ndarray: float32 (n, 4) boxes as [x0, y0, x1, y1] in page pixels,
+        ordered top to bottom, left to right.
+    """
+    import cv2
+
+    gray = np.asarray(img.convert("L"))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale != 1 else gray
+    _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+
+    # Glyphs first: close letters vertically (i, j, accents) into character blobs
+    glyphs = cv2.dilate(binary, np.ones((3, 1), np.uint8))
+    n, _, stats, _ = cv2.connectedComponentsWithStats(glyphs, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    text_heights = heights[(heights >= MIN_LINE_HEIGHT * scale / 2) & (heights <= MAX_LINE_HEIGHT * scale)]
+    if len(text_heights) == 0:
+        return np.zeros((0, 4), dtype=np.float32)
+
+    # Then bridge word gaps, scaled by the page's typical glyph height
+    gap = max(3, int(round(float(np.median(text_heights)) * WORD_GAP_RATIO)))
+    merged = cv2.morphologyEx(glyphs, cv2.MORPH_CLOSE, np.ones((1, gap), np.uint8))
+    n, _, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+
+    x, y, w, h, area = (stats[1:, k].astype(np.float32) for k in (
+        cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT, cv2.CC_STAT_AREA))
+    ink = np.asarray([cv2.countNonZero(binary[int(y[i]):int(y[i] + h[i]), int(x[i]):int(x[i] + w[i])])
+                      for i in range(len(x))], dtype=np.float32)
+    keep = (
+        (h >= MIN_LINE_HEIGHT * scale) & (h <= MAX_LINE_HEIGHT * scale)
+        & (w >= h * 0.5) & (ink >= MIN_FILL * w * h) & (area > 0)
+    )
+
+    boxes = np.stack([x, y, x + w, y + h], axis=1)[keep] / scale
+    boxes += np.float32([-LINE_PAD, -LINE_PAD, LINE_PAD, LINE_PAD])
+    boxes = np.clip(boxes, 0, np.float32([img.width, img.height, img.width, img.height]))
+    boxes = merge_row_runs(boxes)
+    order = np.lexsort((boxes[:, 0], boxes[:, 1]))
+    return boxes[order].astype(np.float32)
+
+
+def merge_row_runs(boxes, ratio=LINE_GAP_RATIO):
+    """
+    Join lines on the same row whose horizontal gap is under `ratio` times their
+    height. Table columns sit further apart than that and stay separate.
+
+    Returns:
+        np.ndarray: The merged boxes, in no particular order.
+    """
+    row_id = _rows(boxes)
+    merged = []
+    for row in np.unique(row_id):
+        line = None
+        for box in sorted(boxes[row_id == row].tolist()):
+            if line is not None and box[0] - line[2] < ratio * min(line[3] - line[1], box[3] - box[1]):
+                line = [line[0], min(line[1], box[1]), max(line[2], box[2]), max(line[3], box[3])]
+                continue
+            if line is not None:
+                merged.append(line)
+            line = box
+        merged.append(line)
+    return np.asarray(merged, dtype=np.float32).reshape(-1, 4)
+
+
+def _rows(boxes):
+    # Group lines whose vertical centers lie within half a median line height
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    centers = (boxes[:, 1] + boxes[:, 3]) / 2
+    threshold = 0.5 * float(np.median(boxes[:, 3] - boxes[:, 1]))
+    by_y = np.argsort(centers, kind="stable")
+    row_id = np.empty(len(boxes), dtype=np.int64)
+    row_id[by_y] = np.concatenate(([0], np.cumsum(np.diff(centers[by_y]) >= threshold)))
+    return row_id
+
+
+def table_spans(boxes):
+    """
+    Vertical extents of the tables on a page.
+
+    Rows of lines are grouped into blocks wherever the blank space between two
+    rows exceeds `BLOCK_GAP` line heights. A block is a table when at least
+    `TABLE_MIN_ROWS` of its rows hold `TABLE_MIN_CELLS` or more separate lines
+    (date, description, amounts, balance); description-only rows inside it are
+    kept with it.
+
+    Returns:
+        List[Tuple[float, float]]: (top, bottom) of every table, top to bottom.
+    """
+    row_id = _rows(boxes)
+    if len(row_id) == 0:
+        return []
+    n_rows = int(row_id.max()) + 1
+    cells = np.bincount(row_id, minlength=n_rows)
+    tops = np.full(n_rows, np.inf, dtype=np.float32)
+    bottoms = np.zeros(n_rows, dtype=np.float32)
+    np.minimum.at(tops, row_id, boxes[:, 1])
+    np.maximum.at(bottoms, row_id, boxes[:, 3])
+
+    line_height = float(np.median(boxes[:, 3] - boxes[:, 1]))
+    # Row ids follow vertical order, so a gap is the next row's top minus the lowest bottom so far
+    gaps = tops[1:] - np.maximum.accumulate(bottoms)[:-1]
+    block = np.concatenate(([0], np.cumsum(gaps > BLOCK_GAP * line_height)))
+
+    spans = []
+    for b in range(int(block[-1]) + 1):
+        rows = block == b
+        if np.count_nonzero(cells[rows] >= TABLE_MIN_CELLS) >= TABLE_MIN_ROWS:
+            spans.append((float(tops[rows].min()), float(bottoms[rows].max())))
+    return spans
+
+
+def select_lines(boxes, page_height, mode="text"):
+    """
+    The lines worth recognizing under a layout mode (see the module docstring).
+
+    Returns:
+        np.ndarray: The kept subset of `boxes`, in the same order.
+    """
+    if mode not in LAYOUT_MODES:
+        raise ValueError(f"unknown layout mode: {mode}")
+    if mode == "text" or len(boxes) == 0:
+        return boxes
+
+    keep = boxes[:, 1] < page_height * HEADER_BAND
+    for top, bottom in table_spans(boxes):
+        keep |= (boxes[:, 3] > top) & (boxes[:, 1] < bottom)
+    return boxes[keep]
+
+
+def page_lines(img, mode="text"):
+    """
+    Detect and select the text lines of a page; see `detect_lines` and `select_lines`.
+    """
+    return select_lines(detect_lines(img), img.height, mode)
+
+
+def line_quads(boxes):
+    """
+    Convert [x0, y0, x1, y1] boxes to OCR-style corner points, clockwise from top-left.
+    """
+    x0, y0, x1, y1 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    return np.stack([np.stack([x0, y0], 1), np.stack([x1, y0], 1),
+                     np.stack([x1, y1], 1), np.stack([x0, y1], 1)], axis=1)
@@ -2,30 +2,466 @@
 
 """
 OCR extraction module using PaddleOCR for processed images.
+
+PaddleOCR (and with it Paddle) is imported only when an engine is first loaded,
+so commands that never run OCR do not pay for it.
 """
 
-from paddleocr import PaddleOCR
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, wait
+from itertools import count
+
+import numpy as np
+from PIL import Image
+
+from extractor import telemetry
+from extractor.layout import page_lines, line_quads
+from extractor.ocrpage import OCRPage
+from extractor.pipeline import Pipeline, Stage
+
+logger = logging.getLogger(__name__)
+
+# Settings every engine is built with; also folded into OCR cache keys
+OCR_SETTINGS = {"use_angle_cls": True, "lang": "en", "det": False, "cls": True}
+
+# Adaptive resolution: recognize the page downscaled (0.5 of a 300 DPI render is 150 DPI),
+# then re-recognize lines below `min_confidence` from the full-resolution page
+ADAPTIVE_SETTINGS = {"scale": 0.5, "min_confidence": 0.9}
+# Pixels of full-resolution context kept around a line crop
+CROP_PAD = 6
+
+# Line crops recognized per engine call, and pages kept in flight while their lines wait for a batch
+RECOGNITION_BATCH = 64
+LAYOUT_WINDOW = 4
+# Seconds `BatchRecognizer.recognize` lets other threads add their crops before sending a partial batch
+RECOGNITION_GRACE = 0.05
+
+# Queued by `BatchRecognizer.flush` to send a partial batch without waiting for it to fill
+_FLUSH = object()
+
+# Engine and line recognizer owned by the current process (the main process or a pool worker)
+_engine = None
+_recognizer = None
+
+
+def load_ocr_engine(cpu_threads=None):
+    """
+    Build the PaddleOCR engine used for page recognition.
+
+    Args:
+        cpu_threads (int, optional): Math-library threads for the engine; defaults to PaddleOCR's own.
+
+    Returns:
+        PaddleOCR: Engine with angle classification enabled.
+    """
+    from paddleocr import PaddleOCR
+
+    kwargs = {"cpu_threads": cpu_threads} if cpu_threads else {}
+    return PaddleOCR(
+        use_angle_cls=OCR_SETTINGS["use_angle_cls"], lang=OCR_SETTINGS["lang"], det=OCR_SETTINGS["det"],
+        rec_batch_num=RECOGNITION_BATCH, **kwargs
+    )
+
+
+def get_ocr_engine(cpu_threads=None):
+    """
+    Return this process's OCR engine, loading the models only on first use.
+    """
+    global _engine
+    if _engine is None:
+        _engine = load_ocr_engine(cpu_threads)
+    return _engine
+
+
+def ocr_page(ocr, img):
+    """
+    Run OCR on a single pre-processed page.
+
+    Args:
+        ocr (PaddleOCR): Engine returned by `load_ocr_engine`.
+        img (PIL.Image.Image | str): Deskewed or cleaned page image, or a path to one.
+
+    Returns:
+        OCRPage: OCR output for the page.
+    """
+    # Run OCR and extract the first result batch; empty pages come back as None
+    return OCRPage.from_list(ocr.ocr(img, cls=OCR_SETTINGS["cls"])[0] or [])
+
+
+def recognize_lines(ocr, crops):
+    """
+    Recognize the text of several line crops in one engine call, skipping detection.
+
+    Returns:
+        List[Tuple[str, float]]: Text and confidence per crop; ("", 0.0) where nothing was read.
+    """
+    if not crops:
+        return []
+    result = ocr.ocr([[np.asarray(crop) for crop in crops]], det=False, cls=OCR_SETTINGS["cls"])[0] or []
+    result = [(text, float(conf)) if text else ("", 0.0) for text, conf in result]
+    return result + [("", 0.0)] * (len(crops) - len(result))
+
+
+def recognize_line(ocr, crop):
+    """
+    Recognize the text of a single line crop; see `recognize_lines`.
+    """
+    return recognize_lines(ocr, [crop])[0]
+
+
+class BatchRecognizer:
+    """
+    Recognizes line crops in large batches shared by every caller in the process.
+
+    Callers submit the crops of a page and get one future per crop back. A single
+    background thread packs queued crops - from consecutive pages, or from
+    documents processed on other threads - into batches of `batch_size`. A
+    partial batch is only sent when a caller is about to wait on it (`flush`) or
+    `max_wait` seconds after its first crop arrived. The number of engine calls
+    then depends on how many lines there are to read, not on how many pages
+    they came from.
+    """
+
+    def __init__(self, ocr=None, batch_size=RECOGNITION_BATCH, max_wait=2.0):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._ocr = ocr
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="recognizer", daemon=True)
+        self._thread.start()
+
+    def submit(self, crops):
+        """
+        Queue line crops for recognition.
+
+        Returns:
+            List[Future]: One future per crop, resolving to (text, confidence).
+        """
+        futures = []
+        for crop in crops:
+            future = Future()
+            self._queue.put((crop, future))
+            futures.append(future)
+        return futures
+
+    def flush(self):
+        """
+        Recognize the crops queued so far without waiting for a full batch.
+        """
+        self._queue.put(_FLUSH)
+
+    def recognize(self, crops, grace=RECOGNITION_GRACE):
+        """
+        Submit crops and wait for their results.
+
+        Callers on other threads get `grace` seconds to add their own crops to
+        the same batch before a partial one is flushed.
+
+        Returns:
+            List[Tuple[str, float]]: (text, confidence) per crop.
+        """
+        futures = self.submit(crops)
+        if futures and not wait(futures[-1:], timeout=grace).done:
+            self.flush()
+        return [future.result() for future in futures]
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = _FLUSH
+            if item is None:
+                self._recognize(batch)
+                return
+            if item is _FLUSH:
+                self._recognize(batch)
+                batch = []
+                continue
+            if not batch:
+                deadline = time.monotonic() + self.max_wait
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._recognize(batch)
+                batch = []
+
+    def _recognize(self, batch):
+        if not batch:
+            return
+        try:
+            if self._ocr is None:
+                self._ocr = get_ocr_engine()
+            with telemetry.stage("recognize_batch"):
+                results = recognize_lines(self._ocr, [crop for crop, _ in batch])
+            telemetry.count("recognized_lines", len(batch))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
 
+def get_recognizer():
+    """
+    Return this process's shared `BatchRecognizer`, starting it on first use.
+    """
+    global _recognizer
+    if _recognizer is None:
+        _recognizer = BatchRecognizer()
+    return _recognizer
+
+
+def _layout_page(img, lines, results):
+    # Keep the lines that produced text, as boxes in page coordinates
+    quads = line_quads(lines).tolist()
+    return OCRPage.from_list([[quad, result] for quad, result in zip(quads, results) if result[0]])
+
+
+def ocr_page_layout(ocr, img, mode="text"):
+    """
+    OCR a page by detecting its text lines (see extractor/layout.py) and
+    recognizing only the selected line crops, `RECOGNITION_BATCH` at a time.
+
+    Args:
+        ocr (PaddleOCR): Engine returned by `load_ocr_engine`.
+        img (PIL.Image.Image | str): Full-resolution page image, or a path to one.
+        mode (str): "text" for every text line, "table" for the header band and tables only.
+
+    Returns:
+        OCRPage: One box per recognized line, in page coordinates.
+    """
+    if isinstance(img, str):
+        img = Image.open(img)
+    with telemetry.stage("layout"):
+        lines = page_lines(img, mode)
+    crops = [img.crop(tuple(box)) for box in lines.tolist()]
+    results = []
+    for start in range(0, len(crops), RECOGNITION_BATCH):
+        results += recognize_lines(ocr, crops[start:start + RECOGNITION_BATCH])
+    return _layout_page(img, lines, results)
+
+
+def _crop_box(box, size, pad=CROP_PAD):
+    xs = [p[0] for p in box]
+    ys = [p[1] for p in box]
+    return (
+        max(0, int(min(xs)) - pad), max(0, int(min(ys)) - pad),
+        min(size[0], int(np.ceil(max(xs))) + pad), min(size[1], int(np.ceil(max(ys))) + pad),
+    )
+
+
+def ocr_page_adaptive(ocr, img, scale=ADAPTIVE_SETTINGS["scale"], min_confidence=ADAPTIVE_SETTINGS["min_confidence"]):
+    """
+    OCR a page at reduced resolution, then re-read only its doubtful lines at full resolution.
+
+    Detection and recognition run on a box-filtered copy of the page with `scale`
+    times the pixels per side, which reads ordinary statement text just as well
+    for a fraction of the work. Lines recognized with confidence below
+    `min_confidence` (typically small digits) are cropped from the full-resolution
+    page and recognized again; the better of the two readings is kept.
+
+    Args:
+        ocr (PaddleOCR): Engine returned by `load_ocr_engine`.
+        img (PIL.Image.Image | str): Full-resolution page image, or a path to one.
+        scale (float): Linear downscale factor for the first pass.
+        min_confidence (float): Lines scoring below this are re-read at full resolution.
+
+    Returns:
+        OCRPage: OCR output for the page, with boxes in full-resolution page coordinates.
+    """
+    if isinstance(img, str):
+        img = Image.open(img)
+    img = img.convert("RGB")
+
+    small = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BOX)
+    with telemetry.stage("ocr_low_res"):
+        result = ocr_page(ocr, small)
+
+    boxes = result.boxes * np.float32([img.width / small.width, img.height / small.height])
+    texts = list(result.texts)
+    confidences = result.confidences.copy()
+    del small
+
+    low = np.flatnonzero(confidences < min_confidence)
+    with telemetry.stage("ocr_refine"):
+        crops = [img.crop(_crop_box(boxes[i].tolist(), img.size)) for i in low.tolist()]
+        for i, (text, conf) in zip(low.tolist(), recognize_lines(ocr, crops)):
+            if text and conf > confidences[i]:
+                texts[i], confidences[i] = text, conf
+    telemetry.count("ocr_refined_lines", len(low))
+    return OCRPage.from_list([[box, (text, conf)] for box, text, conf in zip(boxes.tolist(), texts,
+                                                                            confidences.tolist())])
+
+
+def _init_worker(cpu_threads):
+    get_ocr_engine(cpu_threads)
 
-def ocr_extractor(processed_images):
+
+def _ocr_file(path, adaptive=None, layout=None):
+    if layout:
+        return ocr_page_layout(get_ocr_engine(), path, layout)
+    if adaptive:
+        return ocr_page_adaptive(get_ocr_engine(), path, **adaptive)
+    return ocr_page(get_ocr_engine(), path)
+
+
+class OCRWorkerPool:
+    """
+    Persistent pool of processes that each hold a warm PaddleOCR engine.
+
+    Pages are spilled to a scratch directory and handed to workers by file path,
+    so no image data is pickled across the process boundary. `ocr` blocks until
+    its page is done and is safe to call from several threads at once.
+    """
+
+    def __init__(self, workers, window=None):
+        self.workers = workers
+        # Pages in flight; `stream_pages` runs this many OCR threads against the pool
+        self.window = window or workers * 2
+        self._scratch = tempfile.mkdtemp(prefix="peepalytics_ocr_")
+        cpu_threads = max(1, (os.cpu_count() or 1) // workers)
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            workers, initializer=_init_worker, initargs=(cpu_threads,)
+        )
+        # Shared by every thread submitting to this pool
+        self._counter = count(1)
+
+    def _submit(self, img, adaptive=None, layout=None):
+        path = os.path.join(self._scratch, f"page_{next(self._counter)}.bmp")
+        img.save(path, format="BMP")
+        return path, self._pool.apply_async(_ocr_file, (path, adaptive, layout))
+
+    def ocr(self, img, adaptive=None, layout=None):
+        """
+        OCR one page on a worker and wait for the result; safe to call from several threads.
+        """
+        path, result = self._submit(img, adaptive, layout)
+        try:
+            return result.get()
+        finally:
+            os.remove(path)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        shutil.rmtree(self._scratch, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def ocr_image(img, pool=None, cache=None, adaptive=None, layout=None, key=None):
+    """
+    OCR a single page image and wait for the result.
+
+    Each call serves one page, so a pipeline can run it on several threads at
+    once: with `pool`, each thread keeps one worker busy; with `layout`, the
+    threads' line crops share the process's `BatchRecognizer` batches. The
+    in-process whole-page engine is not thread-safe, so without either it must
+    only be called from one thread at a time.
+
+    Args:
+        img (PIL.Image.Image): Deskewed page image.
+        pool (OCRWorkerPool, optional): Pool to run the page on; in-process when None.
+        cache (OCRCache, optional): Cache of previous results keyed by page pixels.
+        adaptive (dict, optional): Settings for `ocr_page_adaptive`.
+        layout (str, optional): Layout mode for line-level recognition; takes precedence over `adaptive`.
+        key: Page identifier used as the telemetry `page` label.
+
+    Returns:
+        OCRPage: The OCR output for the page.
+    """
+    digest = cache.key(img) if cache is not None else None
+    result = cache.get(digest) if cache is not None else None
+    if result is not None:
+        telemetry.count("ocr_cache_hits")
+        return result
+
+    with telemetry.stage("ocr", page=key):
+        if pool is not None:
+            result = pool.ocr(img, adaptive, layout)
+        elif layout:
+            with telemetry.stage("layout", page=key):
+                lines = page_lines(img, layout)
+            crops = [img.crop(tuple(box)) for box in lines.tolist()]
+            result = _layout_page(img, lines, get_recognizer().recognize(crops))
+        elif adaptive:
+            result = ocr_page_adaptive(get_ocr_engine(), img, **adaptive)
+        else:
+            result = ocr_page(get_ocr_engine(), img)
+    telemetry.count("ocr_pages")
+    if cache is not None:
+        cache.put(digest, result)
+    return result
+
+
+def ocr_extractor(processed_images, workers=1, pool=None, cache=None, known=None, adaptive=None, layout=None):
     """
     Perform OCR on a list of pre-processed images using PaddleOCR.
 
+    Pages go through `ocr_image` on a one-stage `Pipeline`: with a pool, as many
+    pages as the pool's window are in flight at once; with `layout`,
+    `LAYOUT_WINDOW` pages share recognizer batches; otherwise pages are read one
+    after another. `stream_pages` in extractor/__main__.py also overlaps OCR with
+    the other stages.
+
     Args:
         processed_images (List[PIL.Image.Image]): List of deskewed or cleaned images.
+        workers (int): Number of OCR worker processes; 1 runs in-process.
+        pool (OCRWorkerPool, optional): Already-running pool to use instead of starting one.
+        cache (OCRCache, optional): Cache of previous results keyed by page pixels.
+        known (Dict[int, List], optional): Results already available for some 1-based
+            page numbers (e.g. from the PDF text layer); those pages skip OCR.
+        adaptive (dict, optional): Settings for `ocr_page_adaptive`; full resolution when None.
+        layout (str, optional): Layout mode for line-level recognition; see `ocr_image`.
 
     Returns:
         List[List]: A list where each element is the OCR output for a page (list of box-text pairs).
     """
-    # Initialize the OCR engine with angle classification enabled
-    ocr = PaddleOCR(use_angle_cls=True, lang='en', det=False)
+    logger.info("Running OCR on %d pages...", len(processed_images))
+
+    known = known or {}
+    own_pool = None
+    if pool is None and workers > 1:
+        pool = own_pool = OCRWorkerPool(workers)
+
+    if pool is not None:
+        threads = pool.window
+    elif layout:
+        threads = LAYOUT_WINDOW
+    else:
+        threads = 1  # the in-process whole-page engine is not thread-safe
+
+    def ocr(item):
+        idx, img = item
+        result = known.get(idx)
+        if result is None:
+            result = ocr_image(img, pool, cache, adaptive, layout, key=idx)
+        logger.info("Detected %d text elements on page %s.", len(result), idx)
+        return result
 
-    pages_ocr = []
-    for idx, img in enumerate(processed_images, start=1):
-        print(f"Running OCR on page {idx}...")
-        # Run OCR and extract the first result batch
-        result = ocr.ocr(img, cls=True)[0]
-        pages_ocr.append(result)
-        print(f"Detected {len(result)} text elements on page {idx}.")
+    try:
+        pages_ocr = list(Pipeline([Stage("ocr", ocr, threads)]).run(enumerate(processed_images, start=1)))
+    finally:
+        if own_pool is not None:
+            own_pool.close()
 
     return pages_ocr
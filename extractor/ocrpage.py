@@ -0,0 +1,215 @@
+# ocrpage.py
+
+"""
+Compact in-memory and on-disk form of one page of OCR output.
+
+PaddleOCR hands back a page as nested lists, `[[[x, y] x4], (text, conf)]` per
+box. `OCRPage` keeps the same data as three flat arrays and one byte string:
+
+    boxes        float32 (n, 4, 2)   corner points, clockwise from top-left
+    confidences  float32 (n,)
+    offsets      uint32  (n + 1,)    text i is blob[offsets[i]:offsets[i + 1]]
+    blob         UTF-8 bytes of every text, concatenated
+
+Saved pages are those sections behind a fixed header, each aligned to 8 bytes, so
+loading one is a single read (or `mmap`) plus `numpy.frombuffer` views - there
+is nothing to parse:
+
+    page = OCRPage.from_list(ocr_page(engine, img))
+    page.save("page_1.ocr")
+    page = OCRPage.load("page_1.ocr", mmap=True)
+
+The parser, PII scanner and redaction read the arrays directly. For everything
+else a page still behaves like the list it replaces: `len(page)`, `page[i]` and
+iteration give `[box, (text, conf)]` entries.
+
+    python -m extractor.ocrpage data/ocr/*.json     # writes page_1_paddleocr.ocr, ...
+"""
+
+import argparse
+import json
+import mmap as _mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"PPOCR\x00\x01\x00"
+# Magic, box count, text blob length
+_HEADER = struct.Struct("<8sQQ")
+
+
+def _aligned(n):
+    return -(-n // 8) * 8
+
+
+class OCRPage:
+    """
+    One page of OCR output held as NumPy arrays plus a UTF-8 text blob.
+    """
+
+    __slots__ = ("boxes", "confidences", "offsets", "blob", "_texts", "_buffer")
+
+    def __init__(self, boxes, confidences, offsets, blob, buffer=None):
+        self.boxes = boxes
+        self.confidences = confidences
+        self.offsets = offsets
+        self.blob = blob
+        self._texts = None
+        # Keeps a memory map alive for as long as the arrays viewing it
+        self._buffer = buffer
+
+    @classmethod
+    def from_list(cls, page):
+        """
+        Build a page from PaddleOCR's nested-list output (or the same read back from JSON).
+        """
+        if isinstance(page, cls):
+            return page
+        n = len(page)
+        boxes = np.asarray([box for box, _ in page], dtype=np.float32).reshape(n, 4, 2)
+        confidences = np.fromiter((conf for _, (_, conf) in page), dtype=np.float32, count=n)
+
+        encoded = [text.encode("utf-8") for _, (text, _) in page]
+        offsets = np.zeros(n + 1, dtype=np.uint32)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        page_ = cls(boxes, confidences, offsets, b"".join(encoded))
+        page_._texts = [text for _, (text, _) in page]
+        return page_
+
+    def to_list(self):
+        """
+        The page in PaddleOCR's nested-list form, e.g. for JSON export.
+        """
+        return [[box, (text, conf)] for box, text, conf in zip(self.boxes.tolist(), self.texts,
+                                                                 self.confidences.tolist())]
+
+    @property
+    def texts(self):
+        """
+        Every box's text, decoded once on first use.
+        """
+        if self._texts is None:
+            blob, bounds = bytes(self.blob), self.offsets.tolist()
+            self._texts = [blob[a:b].decode("utf-8") for a, b in zip(bounds[:-1], bounds[1:])]
+        return self._texts
+
+    def box(self, i):
+        """
+        Corner points of box `i` as a list of [x, y] pairs.
+        """
+        return self.boxes[i].tolist()
+
+    def __len__(self):
+        return len(self.confidences)
+
+    def __getitem__(self, i):
+        return [self.box(i), (self.texts[i], float(self.confidences[i]))]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+        if not isinstance(other, OCRPage):
+            return NotImplemented
+        return (np.array_equal(self.boxes, other.boxes) and np.array_equal(self.confidences, other.confidences)
+                and self.texts == other.texts)
+
+    def __repr__(self):
+        return f"OCRPage({len(self)} boxes)"
+
+    def to_bytes(self):
+        """
+        Serialize to the on-disk layout described in the module docstring.
+        """
+        n, blob = len(self), bytes(self.blob)
+        sections = [
+            np.ascontiguousarray(self.boxes, dtype="<f4").tobytes(),
+            np.ascontiguousarray(self.confidences, dtype="<f4").tobytes(),
+            np.ascontiguousarray(self.offsets, dtype="<u4").tobytes(),
+            blob,
+        ]
+        out = bytearray(_HEADER.pack(MAGIC, n, len(blob)))
+        for section in sections:
+            out += section
+            out += b"\x00" * (_aligned(len(out)) - len(out))
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, buffer, keep=None):
+        """
+        View a serialized page without copying it.
+
+        Args:
+            buffer: Bytes-like object holding one serialized page.
+            keep: Object that owns `buffer` (e.g. an mmap) and must outlive the arrays.
+        """
+        magic, n, blob_len = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("not an OCR page file")
+
+        pos = _HEADER.size
+
+        def take(dtype, count):
+            nonlocal pos
+            array = np.frombuffer(buffer, dtype=dtype, count=count, offset=pos)
+            pos = _aligned(pos + array.nbytes)
+            return array
+
+        boxes = take("<f4", n * 8).reshape(n, 4, 2)
+        confidences = take("<f4", n)
+        offsets = take("<u4", n + 1)
+        blob = memoryview(buffer)[pos:pos + blob_len]
+        return cls(boxes, confidences, offsets, blob, keep)
+
+    def __reduce__(self):
+        # Pickled (e.g. back from an OCR worker) as one flat byte string
+        return OCRPage.from_bytes, (self.to_bytes(),)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """
+        Read a page written by `save`.
+
+        Args:
+            path (str): File to read.
+            mmap (bool): Map the file instead of reading it; the arrays then page
+                in lazily and the file stays open while the page is alive.
+        """
+        with open(path, "rb") as f:
+            if not mmap:
+                return cls.from_bytes(f.read())
+            mapped = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        return cls.from_bytes(mapped, keep=mapped)
+
+
+def as_page(page):
+    """
+    Return `page` as an `OCRPage`, converting nested-list OCR output if needed.
+    """
+    return page if isinstance(page, OCRPage) else OCRPage.from_list(page)
+
+
+def load_page(path, mmap=False):
+    """
+    Load one page of OCR output saved either as an `.ocr` file or as PaddleOCR JSON.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return OCRPage.from_list(json.load(f))
+    return OCRPage.load(path, mmap)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Convert PaddleOCR JSON pages to the compact .ocr format")
+    arg_parser.add_argument("paths", nargs="+", help="JSON files holding one page of OCR output each")
+
+    args = arg_parser.parse_args()
+    for path in args.paths:
+        target = os.path.splitext(path)[0] + ".ocr"
+        load_page(path).save(target)
+        print(f"{path} ({os.path.getsize(path)} bytes) -> {target} ({os.path.getsize(target)} bytes)")
@@ -2,130 +2,311 @@
 
 import re
 from datetime import datetime
-import pandas as pd
+from functools import lru_cache
+import numpy as np
 
+from extractor.ocrpage import as_page
+from extractor.pii import scan_page
+from extractor.reconcile import reconcile
 
-def parser(page_ocr):
+AMOUNT_COLUMNS = ("money_out", "money_in", "borrowings")
+COLUMN_HEADERS = {"money_out": "money out", "money_in": "money in", "borrowings": "borrowings"}
+SKIP_WORDS = {"close", "date", "total", "interest", "charges"}
+
+# Rows split where consecutive box centers are further apart than this
+ROW_GAP_RATIO = 0.5
+ROW_GAP_MIN = 10
+
+_DATE_PREFIX = re.compile(r"^(\d{1,2}\s+[A-Za-z]{3}\s+\d{4})\s*(.*)$")
+
+
+def _try_parse_float(s):
+    try:
+        return float(s.replace(",", "").replace("$", ""))
+    except:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _format_date(text):
+    # Statements repeat the same few dates many times over
+    try:
+        return datetime.strptime(" ".join(text.split()), "%d %b %Y").strftime("%d-%m-%Y")
+    except ValueError:
+        return None
+
+
+def _merge_number_parts(texts, rights):
+    # Re-join amounts that OCR split at the thousands separator ("1" + "234.56")
+    merged, merged_rights = [], []
+    i = 0
+    while i < len(texts):
+        if (i + 1 < len(texts)
+                and re.match(r"^\d{1,3}$", texts[i])
+                and re.match(r"^\d{3}\.\d{2}$", texts[i+1])):
+            merged.append(f"{texts[i]},{texts[i+1]}")
+            merged_rights.append(rights[i+1])
+            i += 2
+        else:
+            merged.append(texts[i])
+            merged_rights.append(rights[i])
+            i += 1
+    return merged, merged_rights
+
+
+def mask_account_number(account_number):
     """
-    Parse OCR results to extract masked account number and transaction details.
+    Mask all but the last digits of an account number.
+    """
+    return (
+        '*' * (len(account_number) - 3) + account_number[-3:]
+        if len(account_number) > 3
+        else '*' * (len(account_number) - 1) + account_number[-1:]
+    )
+
+
+def extract_masked_account(page, matches=None):
+    """
+    Find the account number on a page and mask all but its last digits.
 
     Args:
-        page_ocr (list): OCR output for pages; index 0 for account page, index 1 for transactions.
+        page (list): OCR output for a single page.
+        matches (list, optional): Result of `scan_page` for this page, if already computed.
 
     Returns:
-        dict: {
-            "masked_account_number": str,
-            "start_date": str,
-            "end_date": str,
-            "transactions": list of dicts
-        }
+        str | None: Masked account number, or None if the page has none.
     """
-    def try_parse_float(s):
-        try:
-            return float(s.replace(",", "").replace("$", ""))
-        except:
-            return None
-
-    def merge_number_parts(texts):
-        merged = []
-        i = 0
-        while i < len(texts):
-            if (i + 1 < len(texts)
-                    and re.match(r"^\d{1,3}$", texts[i])
-                    and re.match(r"^\d{3}\.\d{2}$", texts[i+1])):
-                merged.append(f"{texts[i]},{texts[i+1]}")
-                i += 2
-            else:
-                merged.append(texts[i])
-                i += 1
-        return merged
-
-    # Extract masked account number from first page
-    account_number = None
-    for box, (text, _) in page_ocr[0]:
-        txt = text.lower()
-        if "account number" in txt:
-            account_number = ''.join(filter(str.isdigit, txt))
-            break
+    if matches is None:
+        matches = scan_page(page)
+
+    for m in matches:
+        if m["rule"] == "account_number":
+            account_number = ''.join(filter(str.isdigit, m["value"]))
+            if account_number:
+                return mask_account_number(account_number)
+
+    return None
 
-    if account_number:
-        masked_account = (
-            '*' * (len(account_number) - 3) + account_number[-3:]
-            if len(account_number) > 3
-            else '*' * (len(account_number) - 1) + account_number[-1:]
-        )
-    else:
-        masked_account = None
-
-    # Collect words with positions from second page
-    words = []
-    for box, (text, _) in page_ocr[1]:
-        y_center = (box[0][1] + box[2][1]) / 2
-        words.append({"text": text.strip(), "y": y_center, "x": box[0][0]})
-
-    words.sort(key=lambda w: w['y'])
-
-    # Group words into rows
-    grouped_rows = []
-    current_row = []
-    threshold = 10
-    last_y = None
-    for w in words:
-        if last_y is None or abs(w['y'] - last_y) < threshold:
-            current_row.append(w)
-        else:
-            grouped_rows.append(current_row)
-            current_row = [w]
-        last_y = w['y']
-    if current_row:
-        grouped_rows.append(current_row)
 
-    # Parse transactions from rows
+def layout_rows(page):
+    """
+    Cluster a page's OCR boxes into text rows ordered top to bottom, left to right.
+
+    Box geometry is held in NumPy arrays; rows are split wherever the gap between
+    consecutive box centers exceeds half the median box height, and a single
+    lexsort orders words by (row, x).
+
+    Args:
+        page (OCRPage | list): OCR output for a single page.
+
+    Returns:
+        list: One (texts, x_lefts, x_rights) tuple of lists per row.
+    """
+    if not len(page):
+        return []
+
+    page = as_page(page)
+    texts = [text.strip() for text in page.texts]
+    boxes = page.boxes
+
+    x_left = boxes[:, :, 0].min(axis=1)
+    x_right = boxes[:, :, 0].max(axis=1)
+    y_center = (boxes[:, 0, 1] + boxes[:, 2, 1]) / 2
+    threshold = max(ROW_GAP_MIN, ROW_GAP_RATIO * float(np.median(boxes[:, 2, 1] - boxes[:, 0, 1])))
+
+    # Assign row ids from the gaps between consecutive y centers
+    by_y = np.argsort(y_center, kind="stable")
+    row_id = np.empty(len(texts), dtype=np.int64)
+    row_id[by_y] = np.concatenate(([0], np.cumsum(np.diff(y_center[by_y]) >= threshold)))
+
+    order = np.lexsort((x_left, row_id))
+    bounds = [0] + (np.flatnonzero(np.diff(row_id[order])) + 1).tolist() + [len(order)]
+
+    # Reorder once, then slice rows out of plain lists
+    texts = [texts[i] for i in order.tolist()]
+    x_left = x_left[order].tolist()
+    x_right = x_right[order].tolist()
+    return [
+        (texts[start:end], x_left[start:end], x_right[start:end])
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _header_columns(texts, x_lefts, x_rights):
+    # A header row names at least two of the amount columns
+    found = {}
+    for text, left, right in zip(texts, x_lefts, x_rights):
+        label = text.lower().strip(" .:")
+        for column, header in COLUMN_HEADERS.items():
+            if label == header:
+                found[column] = (left, right)
+    if len(found) < 2:
+        return None
+
+    # Amounts are right-aligned under their headers: split columns halfway
+    # between neighbouring header right edges
+    names = sorted(found, key=lambda c: found[c][1])
+    rights = np.array([found[c][1] for c in names])
+    return {
+        "names": names,
+        "bounds": (rights[:-1] + rights[1:]) / 2,
+        "left": min(left for left, _ in found.values()),
+    }
+
+
+def has_transactions(page):
+    """
+    Decide whether a page holds transaction data: a transaction table header or
+    rows that start with a transaction date.
+
+    Args:
+        page (list): OCR (or text-layer) output for a single page.
+
+    Returns:
+        bool: True if `parse_page` could find transactions on the page.
+    """
+    for texts, x_lefts, x_rights in layout_rows(page):
+        if _header_columns(texts, x_lefts, x_rights) is not None:
+            return True
+        match = _DATE_PREFIX.match(texts[0])
+        if match and _format_date(match.group(1)):
+            return True
+    return False
+
+
+def parse_page(page, columns=None):
+    """
+    Parse the transaction rows on a single page of OCR output.
+
+    Amounts are assigned to money_out / money_in / borrowings by their position
+    under the detected column headers. Headers seen on earlier pages can be
+    passed in for continuation pages that do not repeat them.
+
+    Args:
+        page (list): OCR output for a single page.
+        columns (dict, optional): Column layout returned for a previous page.
+
+    Returns:
+        tuple: (transactions, columns) - the parsed transaction dicts and the
+        column layout in effect at the bottom of the page.
+    """
     transactions = []
-    for row in grouped_rows:
-        row = sorted(row, key=lambda w: w['x'])
-        texts = merge_number_parts([w['text'] for w in row])
+    for texts, x_lefts, x_rights in layout_rows(page):
+        header = _header_columns(texts, x_lefts, x_rights)
+        if header is not None:
+            columns = header
+            continue
+
+        # Split a date that OCR merged into the description ("30 Apr 2023 Interest ...")
+        match = _DATE_PREFIX.match(texts[0]) if texts else None
+        formatted_date = _format_date(match.group(1)) if match else None
+        if formatted_date is None:
+            continue
+
+        rest = [match.group(2)] if match.group(2) else []
+        texts, x_rights = _merge_number_parts(rest + texts[1:], [x_rights[0]] * len(rest) + x_rights[1:])
 
         # Skip non-transaction rows
-        if any(t.lower() in ["close", "date", "total", "interest", "charges"] for t in texts):
+        if any(t.lower() in SKIP_WORDS for t in texts):
             continue
 
-        # Extract numeric fields
-        nums = [try_parse_float(t) for t in texts if try_parse_float(t) is not None]
-        if not nums:
+        values = [_try_parse_float(t) for t in texts]
+        is_amount = [v is not None for v in values]
+        if columns is not None:
+            is_amount = [a and r >= columns["left"] for a, r in zip(is_amount, x_rights)]
+        if not any(is_amount):
             continue
 
-        # Assign money_out, money_in, borrowings
-        money_out = money_in = borrowings = None
-        if len(nums) >= 3:
-            money_out, money_in, borrowings = nums[-3:]
+        amounts = dict.fromkeys(AMOUNT_COLUMNS)
+        nums = [v for v, a in zip(values, is_amount) if a]
+        if columns is not None:
+            slots = np.searchsorted(columns["bounds"], [r for r, a in zip(x_rights, is_amount) if a])
+            for value, slot in zip(nums, slots):
+                amounts[columns["names"][slot]] = value
+        # Without headers fall back to the position of the numbers in the row
+        elif len(nums) >= 3:
+            amounts["money_out"], amounts["money_in"], amounts["borrowings"] = nums[-3:]
         elif len(nums) == 2:
-            money_out, borrowings = nums
+            amounts["money_out"], amounts["borrowings"] = nums
         else:
-            borrowings = nums[0]
-
-        # Parse date and description
-        formatted_date = None
-        try:
-            dt = datetime.strptime(texts[0], "%d %b %Y")
-            formatted_date = dt.strftime("%d-%m-%Y")
-            description = " ".join(texts[1:-len(nums)] if len(nums) else texts[1:]).strip()
-        except:
-            description = " ".join(texts).strip()
-
-        if formatted_date:
-            transactions.append({
-                "date": formatted_date,
-                "description": description,
-                "money_out": money_out,
-                "money_in": money_in,
-                "borrowings": borrowings
-            })
+            amounts["borrowings"] = nums[0]
 
-    # Determine statement period
+        transactions.append({
+            "date": formatted_date,
+            "description": " ".join(t for t, a in zip(texts, is_amount) if not a).strip(),
+            **amounts
+        })
+
+    return transactions, columns
+
+
+def parse_transactions(page):
+    """
+    Parse the transaction rows on a single page of OCR output.
+
+    Args:
+        page (list): OCR output for a single page.
+
+    Returns:
+        list: Transaction dicts with date, description, money_out, money_in and borrowings.
+    """
+    return parse_page(page)[0]
+
+
+def statement_period(transactions):
+    """
+    Determine the first and last transaction dates.
+
+    Returns:
+        tuple: (start_date, end_date) as "%d-%m-%Y" strings, or (None, None).
+    """
     dates = [datetime.strptime(t['date'], "%d-%m-%Y") for t in transactions]
     start_date = min(dates).strftime("%d-%m-%Y") if dates else None
     end_date = max(dates).strftime("%d-%m-%Y") if dates else None
+    return start_date, end_date
+
+
+def parser(page_ocr, page_matches=None):
+    """
+    Parse OCR results to extract masked account number and transaction details.
+
+    Args:
+        page_ocr (list): OCR output for every page of the statement.
+        page_matches (list, optional): `scan_page` results for each page, if already computed.
+
+    Returns:
+        dict: {
+            "masked_account_number": str,
+            "start_date": str,
+            "end_date": str,
+            "transactions": list of dicts, each with a `reconciliation` status
+        }
+    """
+    # Extract masked account number from the first page that carries one
+    masked_account = None
+    for page, matches in zip(page_ocr, page_matches or [None] * len(page_ocr)):
+        masked_account = extract_masked_account(page, matches)
+        if masked_account:
+            break
+
+    # Parse transactions from every page, carrying column headers across pages, and
+    # put each amount on the side the running balance says it belongs to. The
+    # balance carries over too, unless the page is headed by another account.
+    transactions = []
+    columns = None
+    balance = None
+    account = None
+    for page, matches in zip(page_ocr, page_matches or [None] * len(page_ocr)):
+        page_account = extract_masked_account(page, matches)
+        if page_account and account and page_account != account:
+            balance = None
+        account = page_account or account
+        page_transactions, columns = parse_page(page, columns)
+        page_transactions, balance = reconcile(page_transactions, balance)
+        transactions.extend(page_transactions)
+
+    # Determine statement period
+    start_date, end_date = statement_period(transactions)
 
     bank_statement = {
         "masked_account_number": masked_account,
@@ -134,4 +315,4 @@ def parser(page_ocr):
         "transactions": transactions
     }
 
-    return
+    return bank_statement
@@ -0,0 +1,181 @@
+# pii.py
+
+"""
+Registry of sensitive-field rules shared by parsing and redaction.
+
+Every rule is a regular expression; all registered rules are compiled into one
+alternation and run in a single pass over a page's OCR text, so adding a new PII
+type adds a branch to the matcher rather than another scan of the page.
+
+Rules for values that are only sensitive when they belong to the client, such
+as phone numbers and addresses, are registered with `anchors`: they only match
+in the client block, the lines around the account number and client name. The
+bank's own contact details in headers and footers are left readable.
+"""
+
+import re
+from bisect import bisect_right
+from typing import Callable, Dict, List, Optional, Tuple
+
+from extractor.ocrpage import as_page
+
+# Whitespace that does not cross into the next OCR box (boxes are joined with "\n")
+_S = r"[^\S\n]"
+_SEP = rf"(?:{_S}|[.\-])"
+
+# Line heights above and below an anchor match that still belong to the client block
+ANCHOR_LINES = 4
+
+# name -> (pattern, validator, anchors); patterns may mark the sensitive part with (?P<value>...)
+_RULES: Dict[str, tuple] = {}
+_matcher = None
+
+
+def register_rule(name: str, pattern: str, validate: Optional[Callable[[str], bool]] = None,
+                  anchors: Optional[Tuple[str, ...]] = None):
+    """
+    Add (or replace) a PII rule.
+
+    Args:
+        name: Identifier for the rule, e.g. "account_number".
+        pattern: Regular expression matched case-insensitively against each box's text.
+            A named group `value` marks the part to redact; otherwise the whole match is used.
+        validate: Optional check on the matched value (e.g. a Luhn check) to reject false positives.
+        anchors: Rules whose matches mark the client block. When given, this rule's
+            matches are kept only within `ANCHOR_LINES` line heights of an anchor match.
+            On a page without any anchor match they are all kept, since the
+            client block cannot be told apart there.
+    """
+    global _matcher
+    if not name.isidentifier() or "__" in name:
+        raise ValueError(f"Invalid rule name: {name!r}")
+    _RULES[name] = (pattern, validate, tuple(anchors or ()))
+    _matcher = None
+
+
+def unregister_rule(name: str):
+    global _matcher
+    _RULES.pop(name, None)
+    _matcher = None
+
+
+def rule_names() -> List[str]:
+    return list(_RULES)
+
+
+def _compiled():
+    global _matcher
+    if _matcher is None:
+        branches = [
+            f"(?P<{name}>{pattern.replace('(?P<value>', f'(?P<{name}__value>')})"
+            for name, (pattern, _, _) in _RULES.items()
+        ]
+        _matcher = re.compile("|".join(branches), re.IGNORECASE)
+    return _matcher
+
+
+def _in_client_block(box, anchors):
+    # Vertical overlap with any anchor's box widened by ANCHOR_LINES of its own height
+    ys = [y for _, y in box]
+    for anchor in anchors:
+        top, bottom = min(y for _, y in anchor["box"]), max(y for _, y in anchor["box"])
+        reach = ANCHOR_LINES * (bottom - top)
+        if max(ys) >= top - reach and min(ys) <= bottom + reach:
+            return True
+    return False
+
+
+def scan_page(page: List) -> List[dict]:
+    """
+    Find every sensitive value on a page in one pass.
+
+    Args:
+        page: OCR output for a single page (`OCRPage` or list of box-text pairs).
+
+    Returns:
+        One dict per match with the rule name, the matched `value`, the OCR `box`
+        and `text` it was found in, and the value's `start`/`end` offsets in that text.
+    """
+    if not page or not _RULES:
+        return []
+
+    page = as_page(page)
+    texts = page.texts
+    offsets = []
+    position = 0
+    for text in texts:
+        offsets.append(position)
+        position += len(text) + 1
+
+    matches = []
+    for m in _compiled().finditer("\n".join(texts)):
+        rule = m.lastgroup
+        value_group = f"{rule}__value"
+        group = value_group if value_group in m.re.groupindex and m.group(value_group) is not None else rule
+
+        value = m.group(group).strip()
+        validate = _RULES[rule][1]
+        if not value or (validate is not None and not validate(value)):
+            continue
+
+        idx = bisect_right(offsets, m.start(group)) - 1
+        start = m.start(group) - offsets[idx]
+        start += len(m.group(group)) - len(m.group(group).lstrip())
+        matches.append({
+            "rule": rule,
+            "value": value,
+            "box": page.box(idx),
+            "text": texts[idx],
+            "start": start,
+            "end": start + len(value),
+        })
+
+    kept = []
+    for m in matches:
+        anchor_rules = _RULES[m["rule"]][2]
+        anchors = [a for a in matches if a["rule"] in anchor_rules]
+        if not anchors or _in_client_block(m["box"], anchors):
+            kept.append(m)
+    return kept
+
+
+def luhn_valid(number: str) -> bool:
+    """
+    Luhn checksum used by payment card numbers.
+    """
+    digits = [int(c) for c in number if c.isdigit()]
+    if not 13 <= len(digits) <= 19:
+        return False
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        if i % 2:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return total % 10 == 0
+
+
+# --- Built-in rules ---
+
+# Matches that place a phone number or address in the client's own details
+CLIENT_ANCHORS = ("account_number", "client_name", "representative")
+
+register_rule("account_number", rf"account{_S}+(?:number|no\.?|#){_S}*[:#]?{_S}*(?P<value>\d(?:[\d\-]|{_S})*\d)")
+register_rule("representative", rf"your{_S}+representative{_S}*[:\-]?{_S}*(?P<value>[^\n]+)")
+register_rule("client_name", rf"(?:client|customer|account{_S}+holder){_S}+name{_S}*:{_S}*(?P<value>[^\n]+)")
+register_rule("card_number", r"(?<!\d)(?:\d[ -]?){12,18}\d(?!\d)", validate=luhn_valid)
+register_rule(
+    "phone_number",
+    rf"(?<![\d$.,])(?:\+?\d{{1,3}}{_SEP}{{0,2}})?"
+    rf"(?:\(\d{{3}}\)|\d{{3}}){_SEP}{{0,2}}\d{{3}}{_SEP}{{0,2}}\d{{4}}(?![\d.,])",
+    anchors=CLIENT_ANCHORS,
+)
+register_rule(
+    "address",
+    rf"\b\d{{1,5}}{_S}+(?:[A-Za-z]+{_S}+){{1,4}}"
+    rf"(?:street|st|avenue|ave|road|rd|boulevard|blvd|drive|dr|lane|ln|way|court|ct|crescent|cres)\b\.?"
+    rf"(?:{_S}+(?:north|south|east|west|n|s|e|w)\b)?"
+    rf"|p\.?{_S}*o\.?{_S}*box{_S}+\d+",
+    anchors=CLIENT_ANCHORS,
+)
@@ -0,0 +1,278 @@
+# pipeline.py
+
+"""
+Producer/consumer execution of per-item stages over bounded queues.
+
+A `Pipeline` is a chain of `Stage`s. Every stage runs on its own worker threads
+(or feeds its own process pool) and hands items to the next stage through a
+`queue.Queue` of at most `queue_size` entries, so rendering, deskewing, OCR,
+parsing and encoding of different pages all run at the same time:
+
+    pipeline = Pipeline([
+        Stage("render", render, workers=2),
+        Stage("ocr", recognize),
+        Stage("parse", parse, ordered=True),
+    ], queue_size=4)
+    for result in pipeline.run(page_numbers):
+        ...
+
+Once the queues fill up, a document takes about as long as its slowest stage
+rather than the sum of all of them. Results come out in input order. A stage
+marked `ordered` also sees its items in input order, one at a time, for work
+that carries state from one item to the next. The number of items inside the
+pipeline at once is capped, so memory stays bounded however slow the slowest
+stage is.
+
+With a metrics sink attached, the depth of every stage's input queue is sent as
+a `queue_depth` gauge labelled with the stage each time an item is queued.
+Busy, idle (waiting for input) and blocked (waiting for room downstream) time,
+item counts and the deepest queue seen per stage are in `Pipeline.stats` after
+a run.
+"""
+
+import contextvars
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from extractor import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Seconds a blocked worker waits before checking whether the run was stopped
+_POLL = 0.1
+
+# Passed down the queues once the input is exhausted
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a `Pipeline`.
+
+    Args:
+        name (str): Stage name, used in metrics and `Pipeline.stats`.
+        fn (Callable): Called as `fn(item)` for each item; its return value goes to the next stage.
+        workers (int): Threads calling `fn` concurrently. Stages whose work releases
+            the GIL (poppler, OpenCV, PIL encoders, PaddleOCR) scale with threads.
+        processes (int): When set, `fn` runs in a pool of this many processes
+            instead, fed by as many threads; `fn` and its items must be picklable.
+        ordered (bool): Call `fn` on one item at a time, in input order.
+    """
+
+    def __init__(self, name, fn, workers=1, processes=0, ordered=False):
+        self.name = name
+        self.fn = fn
+        self.ordered = ordered
+        self.processes = processes
+        self.workers = 1 if ordered else max(1, processes or workers)
+
+
+def parse_stage_workers(spec):
+    """
+    Parse a per-stage worker count such as "render=3,redact=2" into a dict.
+
+    Raises:
+        ValueError: If an entry is not `name=count` with a positive count.
+    """
+    counts = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, sep, value = part.partition("=")
+        if not sep or not value.strip().isdigit() or int(value) < 1:
+            raise ValueError(f"invalid stage worker count: {part.strip()!r} (expected name=count)")
+        counts[name.strip()] = int(value)
+    return counts
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Pipeline:
+    """
+    Run items through a chain of stages concurrently; see the module docstring.
+
+    Args:
+        stages (List[Stage]): Stages in execution order.
+        queue_size (int): Capacity of the queue in front of each stage.
+    """
+
+    def __init__(self, stages, queue_size=4):
+        self.stages = list(stages)
+        self.queue_size = max(1, queue_size)
+        self.stats = {}
+
+    def _put(self, q, entry, stage=None):
+        while not self._stop.is_set():
+            try:
+                q.put(entry, timeout=_POLL)
+                break
+            except queue.Full:
+                continue
+        else:
+            raise _Stopped
+        if stage is not None and entry is not _DONE:
+            depth = q.qsize()
+            stats = self.stats[stage.name]
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], depth)
+            telemetry.gauge("queue_depth", depth, stage=stage.name)
+
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _Stopped
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _feed(self, items, inbox):
+        try:
+            for seq, item in enumerate(items):
+                while not self._slots.acquire(timeout=_POLL):
+                    if self._stop.is_set():
+                        raise _Stopped
+                self._put(inbox, (seq, item), self.stages[0])
+            self._put(inbox, _DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _work(self, stage, inbox, outbox, executor, remaining):
+        stats = self.stats[stage.name]
+        pending, next_seq = {}, 0
+        try:
+            while True:
+                waited = time.perf_counter()
+                entry = self._get(inbox)
+                if entry is _DONE:
+                    # Let the stage's other workers see the end of the input too
+                    self._put(inbox, _DONE)
+                    break
+                if stage.ordered:
+                    pending[entry[0]] = entry[1]
+                    batch = []
+                    while next_seq in pending:
+                        batch.append((next_seq, pending.pop(next_seq)))
+                        next_seq += 1
+                else:
+                    batch = [entry]
+
+                idle = time.perf_counter() - waited
+                busy = blocked = 0.0
+                for seq, item in batch:
+                    started = time.perf_counter()
+                    if executor is not None:
+                        result = executor.submit(stage.fn, item).result()
+                    else:
+                        result = stage.fn(item)
+                    finished = time.perf_counter()
+                    # Time spent waiting for room downstream is backpressure, not work
+                    self._put(outbox, (seq, result), self._next.get(stage.name))
+                    busy += finished - started
+                    blocked += time.perf_counter() - finished
+                with self._lock:
+                    stats["idle_seconds"] += idle
+                    stats["busy_seconds"] += busy
+                    stats["blocked_seconds"] += blocked
+                    stats["items"] += len(batch)
+        except _Stopped:
+            return
+        except BaseException as e:
+            self._fail(e)
+            return
+
+        # The last worker of a stage to finish passes the end of the input on
+        with self._lock:
+            remaining[stage.name] -= 1
+            last = remaining[stage.name] == 0
+        if last:
+            try:
+                self._put(outbox, _DONE)
+            except _Stopped:
+                pass
+
+    def run(self, items):
+        """
+        Push `items` through every stage.
+
+        Args:
+            items (Iterable): Inputs to the first stage; consumed on a feeder thread.
+
+        Yields:
+            Results of the last stage, in the order of `items`.
+
+        Raises:
+            Exception: The first error raised by any stage, once it reaches the consumer.
+        """
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._error = None
+        self.stats = {stage.name: {"workers": stage.workers, "items": 0, "busy_seconds": 0.0, "idle_seconds": 0.0,
+                                   "blocked_seconds": 0.0, "max_queue_depth": 0} for stage in self.stages}
+        self._next = {a.name: b for a, b in zip(self.stages, self.stages[1:])}
+        # Items between the feeder and the consumer: every queue full plus one in each worker's hands
+        self._slots = threading.Semaphore(self.queue_size * (len(self.stages) + 1)
+                                          + sum(stage.workers for stage in self.stages))
+
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        executors = []
+        threads = []
+
+        def start(target, *args, name):
+            # Each thread gets its own copy of the caller's context, so telemetry labels carry over
+            context = contextvars.copy_context()
+            thread = threading.Thread(target=context.run, args=(target,) + args, name=name, daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for index, stage in enumerate(self.stages):
+                executor = None
+                if stage.processes:
+                    executor = ProcessPoolExecutor(stage.processes, mp_context=multiprocessing.get_context("spawn"))
+                    executors.append(executor)
+                for worker in range(stage.workers):
+                    start(self._work, stage, queues[index], queues[index + 1], executor, remaining,
+                          name=f"{stage.name}-{worker}")
+            start(self._feed, iter(items), queues[0], name="feed")
+
+            pending, next_seq = {}, 0
+            while True:
+                try:
+                    entry = self._get(queues[-1])
+                except _Stopped:
+                    break
+                if entry is _DONE:
+                    break
+                pending[entry[0]] = entry[1]
+                while next_seq in pending:
+                    result = pending.pop(next_seq)
+                    next_seq += 1
+                    self._slots.release()
+                    yield result
+
+            if self._error is not None:
+                raise self._error
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+            for name, stats in self.stats.items():
+                logger.debug("Stage %s: %d items, %.2fs busy, %.2fs idle, %.2fs blocked, queue depth up to %d",
+                             name, stats["items"], stats["busy_seconds"], stats["idle_seconds"],
+                             stats["blocked_seconds"], stats["max_queue_depth"])
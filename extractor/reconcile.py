@@ -0,0 +1,229 @@
+# reconcile.py
+
+"""
+Balance reconciliation for parsed transactions.
+
+`parse_page` puts each amount under the column it sits beneath or, without
+headers, guesses from how many numbers a row holds, and it gets the money in /
+money out side wrong often enough to matter. The statement's own running
+balance (the `borrowings` column) settles it: from one row to the next the
+balance moves by exactly the row's amount, and the direction of the move says
+which side the amount belongs on.
+
+`reconcile` checks a whole statement (or one page of it) in a single vectorized
+pass and marks every row in a `reconciliation` field:
+
+    ok            the balance moved by the amount, on the side it was parsed on
+    corrected     it moved by the amount on the other side; money_in and money_out were swapped
+    unreconciled  it did not move by the amount either way; left as parsed
+    unchecked     nothing to compare against: the first row, a row with no balance
+                  read, or a balance line (opening/closing balance, no amount moved)
+
+Whether the balance rises with money in (a deposit account) or with money out
+(a loan or card balance, as on the sample statement) is decided by the rows
+themselves, see `detect_direction`.
+
+A statement can hold several accounts, each with its own running balance (the
+sample's main account and its sub-accounts). An opening balance line starts a
+new one: the rows from there on are reconciled as a separate run, with their
+own direction, and nothing carries over from the account before them.
+
+    python -m extractor.reconcile data/transactions.csv    # rewrites the CSV with corrected columns
+"""
+
+import argparse
+import csv
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RECONCILIATION_STATUSES = ("ok", "corrected", "unreconciled", "unchecked")
+_OK, _CORRECTED, _UNRECONCILED, _UNCHECKED = range(len(RECONCILIATION_STATUSES))
+
+# Largest difference, in currency units, still treated as equal (half a cent)
+BALANCE_TOLERANCE = 0.005
+# Rows that state a balance rather than move it; their amounts, if any, are period totals
+BALANCE_LINES = {"opening balance", "closing balance", "statement balance", "balance brought forward",
+                 "balance carried forward"}
+# Balance lines that start another account's running balance rather than continue one
+OPENING_LINES = {"opening balance"}
+
+
+def _amounts(transactions, field):
+    return np.fromiter((np.nan if t.get(field) is None else t[field] for t in transactions),
+                       dtype=np.float64, count=len(transactions))
+
+
+def _previous_balances(money_out, money_in, balance, direction, opening):
+    # The balance each row starts from. A row with no balance read inherits the
+    # last one read, moved by the amounts parsed in between.
+    known = ~np.isnan(balance)
+    change = np.where(known, 0.0, direction * (money_in - money_out))
+    moved = np.cumsum(change)
+
+    group = np.cumsum(known)
+    heads = np.flatnonzero(known)
+    base = np.where(group > 0, balance[heads[np.maximum(group - 1, 0)]] if len(heads) else np.nan, opening)
+    base_moved = np.where(group > 0, moved[heads[np.maximum(group - 1, 0)]] if len(heads) else 0.0, 0.0)
+
+    running = base + moved - base_moved
+    return np.concatenate(([opening], running[:-1])), running
+
+
+def _line_kind(transactions, lines):
+    return np.fromiter(((t.get("description") or "").lower().strip(" .:") in lines for t in transactions),
+                       dtype=bool, count=len(transactions))
+
+
+def detect_direction(money_out, money_in, balance, opening=np.nan, balance_lines=None):
+    """
+    Decide which way the running balance moves.
+
+    Every row whose balance moved by its amount votes for the direction that
+    matches the side it was parsed on; the parser is right more often than not.
+
+    Returns:
+        int | None: +1 if the balance rises with money in, -1 if it rises with
+        money out, None if no row moved by its amount.
+    """
+    previous = np.concatenate(([opening], balance[:-1]))
+    delta = balance - previous
+    net = np.nan_to_num(money_in) - np.nan_to_num(money_out)
+    moving = net != 0
+    if balance_lines is not None:
+        moving &= ~balance_lines
+    rises_with_in = np.count_nonzero(moving & (np.abs(delta - net) <= BALANCE_TOLERANCE))
+    rises_with_out = np.count_nonzero(moving & (np.abs(delta + net) <= BALANCE_TOLERANCE))
+    if rises_with_in == rises_with_out == 0:
+        return None
+    return 1 if rises_with_in >= rises_with_out else -1
+
+
+def reconcile_arrays(money_out, money_in, balance, state=None, balance_lines=None):
+    """
+    Array form of `reconcile`: NaN stands for an amount that was not read, and
+    `balance_lines` marks rows that state a balance (see `BALANCE_LINES`).
+
+    Returns:
+        tuple: (money_out, money_in, status, state) - corrected copies of the
+        amounts, an int8 index into `RECONCILIATION_STATUSES` per row, and the
+        state to pass in with the next page.
+    """
+    state = dict(state or {})
+    opening = state.get("balance")
+    opening = np.nan if opening is None else opening
+    if balance_lines is None:
+        balance_lines = np.zeros(len(balance), dtype=bool)
+    direction = state.get("direction") or detect_direction(money_out, money_in, balance, opening, balance_lines)
+
+    status = np.full(len(balance), _UNCHECKED, dtype=np.int8)
+    if direction is None or len(balance) == 0:
+        if len(balance):
+            # Nothing moved by its amount yet; carry the last balance read
+            known = np.flatnonzero(~np.isnan(balance))
+            if len(known):
+                state["balance"] = float(balance[known[-1]])
+        return money_out.copy(), money_in.copy(), status, state
+
+    out, inn = np.nan_to_num(money_out), np.nan_to_num(money_in)
+    previous, running = _previous_balances(out, inn, balance, direction, opening)
+    delta = balance - previous
+    # Balance lines and rows without an amount restart the chain instead of being checked
+    checked = ~np.isnan(delta) & ~balance_lines & ((out != 0) | (inn != 0))
+
+    as_parsed = np.abs(delta - direction * (inn - out)) <= BALANCE_TOLERANCE
+    swapped = np.abs(delta - direction * (out - inn)) <= BALANCE_TOLERANCE
+    status[checked] = np.where(as_parsed, _OK, np.where(swapped, _CORRECTED, _UNRECONCILED))[checked]
+
+    fix = status == _CORRECTED
+    money_out, money_in = np.where(fix, money_in, money_out), np.where(fix, money_out, money_in)
+
+    state["direction"] = direction
+    state["balance"] = float(running[-1])
+    return money_out, money_in, status, state
+
+
+def reconcile(transactions, state=None):
+    """
+    Correct the money_in / money_out side of each transaction from the running balance.
+
+    Args:
+        transactions (list): Transaction dicts as returned by `parse_page`, in statement order.
+        state (dict, optional): State returned for the previous page of the same
+            account: its closing balance and the balance direction. Ignored from
+            the first opening balance line on.
+
+    Returns:
+        tuple: (transactions, state) - new transaction dicts with corrected amounts
+        and a `reconciliation` status, and the state to pass in with the next page.
+    """
+    money_out, money_in = _amounts(transactions, "money_out"), _amounts(transactions, "money_in")
+    balance, balance_lines = _amounts(transactions, "borrowings"), _line_kind(transactions, BALANCE_LINES)
+
+    # Each opening balance starts another account's run; the state only carries into the first
+    starts = np.flatnonzero(_line_kind(transactions, OPENING_LINES))
+    bounds = [0] + [i for i in starts.tolist() if i > 0] + [len(transactions)]
+    if len(starts) and starts[0] == 0:
+        state = None
+    status = np.full(len(transactions), _UNCHECKED, dtype=np.int8)
+    for lo, hi in zip(bounds, bounds[1:]):
+        if lo > 0:
+            state = None
+        money_out[lo:hi], money_in[lo:hi], status[lo:hi], state = reconcile_arrays(
+            money_out[lo:hi], money_in[lo:hi], balance[lo:hi], state, balance_lines[lo:hi]
+        )
+
+    corrected = []
+    for t, out, inn, code in zip(transactions, money_out.tolist(), money_in.tolist(), status.tolist()):
+        corrected.append({
+            **t,
+            "money_out": None if out != out else out,
+            "money_in": None if inn != inn else inn,
+            "reconciliation": RECONCILIATION_STATUSES[code],
+        })
+    return corrected, state
+
+
+def summarize(transactions):
+    """
+    Count transactions per reconciliation status.
+    """
+    counts = dict.fromkeys(RECONCILIATION_STATUSES, 0)
+    for t in transactions:
+        counts[t.get("reconciliation", "unchecked")] += 1
+    return counts
+
+
+def _read_amount(value):
+    value = (value or "").strip()
+    return float(value) if value else None
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Correct money in/out columns of a transactions CSV "
+                                                     "from its running balance")
+    arg_parser.add_argument("csv", help="transactions.csv written by the extractor")
+    arg_parser.add_argument("--output", default=None, help="Where to write the corrected CSV (default: in place)")
+
+    args = arg_parser.parse_args()
+    with open(args.csv, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fields = list(reader.fieldnames)
+        rows = [{**row, **{k: _read_amount(row[k]) for k in ("money_out", "money_in", "borrowings")}}
+                for row in reader]
+
+    rows, _ = reconcile(rows)
+    if "reconciliation" not in fields:
+        fields.append("reconciliation")
+    with open(args.output or args.csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    counts = summarize(rows)
+    print(", ".join(f"{counts[s]} {s}" for s in RECONCILIATION_STATUSES))
+    for i, row in enumerate(rows):
+        if row["reconciliation"] == "unreconciled":
+            print(f"row {i + 1}: {row['date']} {row['description']!r} does not reconcile")
@@ -1,64 +1,231 @@
 # redaction.py
 
+import contextvars
+import logging
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Tuple
-import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageDraw
 
+from extractor import telemetry
+from extractor.pii import scan_page
 
-def extract_text_box(full_box: List[Tuple[int, int]], full_text: str, target: str):
+logger = logging.getLogger(__name__)
+
+# File extension for each supported output format
+OUTPUT_EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp", "tiff": "tif"}
+
+
+# Approximate advance widths (grouped Helvetica/Arial metrics, 1/1000 em) - statements are
+# set in proportional sans fonts, so "1" and "W" are far from equal width
+_NARROW = dict.fromkeys("il.,:;'|!", 250)
+_NARROW.update(dict.fromkeys("fjtI/[]()-r ", 300))
+_WIDE = dict.fromkeys("mwMW@", 850)
+_WIDE.update(dict.fromkeys("ABCDEGHKNOQRUVXY&%", 700))
+GLYPH_WIDTHS = {**_NARROW, **_WIDE}
+DEFAULT_GLYPH_WIDTH = 556
+
+# Pixels of padding around a located substring, and the ink threshold of the projection profile
+REDACT_PAD = 2
+INK_THRESHOLD = 128
+
+
+@lru_cache(maxsize=4096)
+def _glyph_edges(text: str) -> np.ndarray:
+    # Cumulative advance of each character boundary, as a fraction of the string's width
+    widths = np.array([GLYPH_WIDTHS.get(c, DEFAULT_GLYPH_WIDTH) for c in text], dtype=np.float64)
+    edges = np.concatenate(([0.0], np.cumsum(widths)))
+    return edges / edges[-1]
+
+
+def _ink_profile(image: Image.Image, left: int, top: int, right: int, bottom: int):
+    # Column projection profile of the dark pixels inside a box
+    crop = np.asarray(image.crop((left, top, right, bottom)).convert("L"))
+    if crop.size == 0:
+        return None
+    return (crop < INK_THRESHOLD).sum(axis=0)
+
+
+def _snap_to_gap(profile: np.ndarray, x: float, reach: float) -> float:
+    # Move a boundary to the emptiest column within `reach`, preferring the closest one
+    lo = max(int(x - reach), 0)
+    hi = min(int(x + reach) + 1, len(profile))
+    if lo >= hi:
+        return x
+    window = profile[lo:hi]
+    candidates = np.flatnonzero(window == window.min()) + lo
+    return float(candidates[np.argmin(np.abs(candidates - x))])
+
+
+def _advance(text: str) -> float:
+    return sum(GLYPH_WIDTHS.get(c, DEFAULT_GLYPH_WIDTH) for c in text)
+
+
+def _word_spans(text: str, profile: np.ndarray, offset: float):
+    # Align the words of `text` with the ink, left to right. Each word's end is
+    # predicted with the width table scaled to the ink still unaccounted for, then
+    # snapped to the nearest blank run, so errors in the table do not accumulate
+    # along long lines. Returns (char_start, char_end, x_left, x_right) per word.
+    words = [(m.start(), m.end()) for m in re.finditer(r"\S+", text)]
+    ink = np.flatnonzero(profile)
+    if not words or not len(ink):
+        return None
+
+    blank = np.concatenate(([0], (profile[ink[0]:ink[-1] + 1] == 0).astype(np.int8), [0]))
+    change = np.flatnonzero(np.diff(blank))
+    runs = np.stack((change[::2], change[1::2]), axis=1) + ink[0]
+
+    # Word gaps are clearly wider than letter gaps: calibrate on the widest runs,
+    # one per expected space
+    widths = runs[:, 1] - runs[:, 0]
+    spaces = min(len(words) - 1, len(widths))
+    min_gap = 0.6 * float(np.median(np.sort(widths)[-spaces:])) if spaces else np.inf
+
+    spans = []
+    cursor, ink_right = float(ink[0]), float(ink[-1] + 1)
+    for i, (cs, ce) in enumerate(words):
+        if i == len(words) - 1:
+            spans.append((cs, ce, offset + cursor, offset + ink_right))
+            break
+
+        scale = (ink_right - cursor) / _advance(text[cs:words[-1][1]])
+        space = _advance(text[ce:words[i + 1][0]]) * scale
+        predicted = cursor + _advance(text[cs:ce]) * scale + space / 2
+
+        later = runs[(runs[:, 0] > cursor) & (widths >= min_gap)]
+        centers = later.mean(axis=1) if len(later) else later
+        nearest = int(np.argmin(np.abs(centers - predicted))) if len(later) else None
+        if nearest is not None and abs(centers[nearest] - predicted) <= max(space, DEFAULT_GLYPH_WIDTH * scale):
+            right, cursor_next = float(later[nearest][0]), float(later[nearest][1])
+        else:
+            right, cursor_next = predicted - space / 2, predicted + space / 2
+
+        spans.append((cs, ce, offset + cursor, offset + right))
+        cursor = cursor_next
+
+    return spans
+
+
+def _char_x(spans, text: str, index: int, left: float, right: float) -> float:
+    # x position of the boundary before `text[index]`
+    if spans is None:
+        return left + _glyph_edges(text)[index] * (right - left)
+    for cs, ce, wl, wr in spans:
+        if index <= ce:
+            if index <= cs:
+                return wl
+            return wl + _glyph_edges(text[cs:ce])[index - cs] * (wr - wl)
+    return spans[-1][3]
+
+
+def extract_text_box(full_box: List[Tuple[int, int]], full_text: str, target: str, start: int = None,
+                     image: Image.Image = None):
     """
     Extract bounding box for a substring within an OCR-detected text box.
     Returns a 4-point polygon around the target substring.
+
+    Character positions come from a per-glyph advance-width table rather than
+    assuming equal widths. When the page image is given, a column projection
+    profile of the box locates the inked span and the blank runs between words,
+    so substrings on word boundaries get exact edges and the polygon hugs the
+    glyphs instead of carrying a safety margin.
+
+    `start` is the substring's offset in `full_text` when already known; otherwise
+    its first occurrence is used.
     """
     if not full_text or not target:
         return None
 
-    x1, y1 = full_box[0]
-    x2, y2 = full_box[1]
-    x3, y3 = full_box[2]
-    x4, y4 = full_box[3]
+    if start is None:
+        try:
+            start = full_text.index(target)
+        except ValueError:
+            return None
+    end = start + len(target)
 
-    box_width = x2 - x1
-    box_height = y3 - y2
+    box = np.asarray(full_box, dtype=np.float64).reshape(4, 2)
+    x1 = max(int(box[:, 0].min()), 0)
+    x2 = int(box[:, 0].max())
+    left, right = x1, x2
 
-    try:
-        start = full_text.index(target)
-        end = start + len(target)
-    except ValueError:
-        return None
+    profile = None
+    if image is not None:
+        top = int(max(box[:, 1].min(), 0))
+        bottom = int(min(box[:, 1].max(), image.height))
+        profile = _ink_profile(image, x1, top, min(x2, image.width), bottom)
+        if profile is not None:
+            ink = np.flatnonzero(profile)
+            if len(ink):
+                # OCR boxes carry padding; lay glyphs out over the inked span only
+                left, right = x1 + ink[0], x1 + ink[-1] + 1
+
+    # Word edges come from the ink; only positions inside a word use the width table
+    spans = _word_spans(full_text, profile, x1) if profile is not None else None
+    start_x = _char_x(spans, full_text, start, left, right)
+    end_x = _char_x(spans, full_text, end, left, right)
 
-    offset_start = start / len(full_text)
-    offset_end = end / len(full_text)
+    # Boundaries that fall inside a word move to the nearest gap between glyphs
+    if profile is not None:
+        reach = (right - left) / len(full_text) / 2
+        if not full_text[start - 1:start].isspace():
+            start_x = x1 + _snap_to_gap(profile, start_x - x1, reach)
+        if not full_text[end:end + 1].isspace():
+            end_x = x1 + _snap_to_gap(profile, end_x - x1, reach)
 
-    # Compute x-coordinates with margin
-    margin = 0.05 * box_width
-    start_x = max(x1 + offset_start * box_width - margin, 0)
-    end_x = min(x1 + offset_end * box_width + margin, x2)
+    start_x = max(start_x - REDACT_PAD, 0)
+    end_x = min(end_x + REDACT_PAD, x2)
 
+    # Follow the box's top and bottom edges so slanted boxes stay tight
+    def along(p, q, x):
+        t = 0.0 if q[0] == p[0] else (x - p[0]) / (q[0] - p[0])
+        return p + t * (q - p)
+
+    tl, tr, br, bl = box
     return [
-        (int(start_x), y1),
-        (int(end_x), y2),
-        (int(end_x), y3),
-        (int(start_x), y4)
+        tuple(int(round(v)) for v in along(tl, tr, start_x)),
+        tuple(int(round(v)) for v in along(tl, tr, end_x)),
+        tuple(int(round(v)) for v in along(bl, br, end_x)),
+        tuple(int(round(v)) for v in along(bl, br, start_x)),
     ]
 
 
+def find_pii_boxes(page_ocr: List, matches: List[dict] = None, rules: List[str] = None,
+                   image: Image.Image = None):
+    """
+    Locate bounding boxes for every sensitive value found by the PII rules.
+
+    Args:
+        page_ocr: OCR results for the page.
+        matches: Result of `scan_page` for this page, if already computed.
+        rules: Restrict to these rule names; all rules by default.
+        image: Page image the OCR ran on, used to fit boxes to the glyphs' ink.
+
+    Returns:
+        A list of flattened box coordinates.
+    """
+    if matches is None:
+        matches = scan_page(page_ocr)
+
+    boxes = []
+    for m in matches:
+        if rules is not None and m["rule"] not in rules:
+            continue
+        tb = extract_text_box(m["box"], m["text"], m["value"], m["start"], image)
+        if tb:
+            boxes.append([coord for pt in tb for coord in pt])
+    return boxes
+
+
 def find_account_number_boxes(page_ocr: List):
     """
     Locate bounding boxes for account numbers in OCR data.
     Returns a list of flattened box coordinates.
     """
-    boxes = []
-    for box, (text, _) in page_ocr:
-        if "account number" in text.lower():
-            digits = ''.join(filter(str.isdigit, text))
-            if digits:
-                tb = extract_text_box(box, text, digits)
-                if tb:
-                    boxes.append([coord for pt in tb for coord in pt])
-    return boxes
+    return find_pii_boxes(page_ocr, rules=["account_number"])
 
 
 def find_representative_boxes(page_ocr: List):
@@ -66,65 +233,161 @@ def find_representative_boxes(page_ocr: List):
     Locate bounding boxes for representative names in OCR data.
     Returns a list of flattened box coordinates.
     """
-    boxes = []
-    for box, (text, _) in page_ocr:
-        match = re.search(r"your\s+representative\s*[:\-]?\s*(.+)", text, re.IGNORECASE)
-        if match:
-            name = match.group(1).strip()
-            tb = extract_text_box(box, text, name)
-            if tb:
-                boxes.append([coord for pt in tb for coord in pt])
-    return boxes
+    return find_pii_boxes(page_ocr, rules=["representative"])
+
+
+def redact_in_place(pil_img: Image.Image, ocr_data: List, matches: List[dict] = None) -> int:
+    """
+    Black out every PII match directly in the page's own pixel buffer.
+
+    Args:
+        pil_img: PIL image of the page; modified in place.
+        ocr_data: OCR results for the page.
+        matches: Result of `scan_page` for this page, if already computed.
+
+    Returns:
+        Number of regions redacted.
+    """
+    coords = find_pii_boxes(ocr_data, matches, image=pil_img)
+    if coords:
+        draw = ImageDraw.Draw(pil_img)
+        for polygon in coords:
+            draw.polygon(polygon, fill="black")
+    return len(coords)
+
+
+def save_image(img: Image.Image, output_path: str, fmt: str = "jpeg", quality: int = 95):
+    """
+    Encode a page image once in the requested format.
+    """
+    fmt = fmt.lower()
+    options = {"quality": quality} if fmt in ("jpeg", "webp") else {}
+    img.save(output_path, format=fmt.upper(), **options)
+
+
+def redacted_path(output_dir: str, page_number: int, fmt: str = "jpeg") -> str:
+    """
+    File name for a redacted page in the given output format.
+    """
+    return os.path.join(output_dir, f"page_{page_number}_redacted.{OUTPUT_EXTENSIONS[fmt.lower()]}")
 
 
-def redact_image(img: np.ndarray, coords_list: List[List[int]], output_path: str):
+def redact_page(pil_img: Image.Image, ocr_data: List, output_path: str, fmt: str = "jpeg",
+                quality: int = 95, matches: List[dict] = None) -> Image.Image:
     """
-    Redact specified polygon regions on an image and save to disk.
+    Redact account and representative info from a single page and save it.
+
+    Args:
+        pil_img: PIL image of the page; redacted in place.
+        ocr_data: OCR results for the page.
+        output_path: File path for the redacted image.
+        fmt: Output format ("jpeg", "png", "webp" or "tiff").
+        quality: Encoder quality for lossy formats.
+        matches: Result of `scan_page` for this page, if already computed.
+
+    Returns:
+        The redacted PIL image.
     """
-    for coords in coords_list:
-        pts = np.array(
-            [(coords[i], coords[i+1]) for i in range(0, len(coords), 2)],
-            dtype=np.int32
-        )
-        cv2.fillPoly(img, [pts], (0, 0, 0))
-    cv2.imwrite(output_path, img)
+    with telemetry.stage("redact"):
+        redact_in_place(pil_img, ocr_data, matches)
+    with telemetry.stage("encode"):
+        save_image(pil_img, output_path, fmt, quality)
+    logger.info("Saved redacted page to: %s", output_path)
+    return pil_img
+
+
+class RedactionWriter:
+    """
+    Redacts pages on the caller's thread and encodes them on a small thread pool.
+
+    Redaction itself is a handful of in-place polygon fills; the expensive part is
+    the image encode, which releases the GIL and so overlaps with OCR and parsing
+    of the following pages. At most `max_pending` encodes are queued, which bounds
+    how many page images are kept alive.
+    """
+
+    def __init__(self, output_dir: str, fmt: str = "jpeg", quality: int = 95, workers: int = 2,
+                 max_pending: int = 4):
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="redact")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def _encode(self, pil_img: Image.Image, output_path: str, page_number: int):
+        try:
+            with telemetry.stage("encode", page=page_number):
+                save_image(pil_img, output_path, self.fmt, self.quality)
+            logger.info("Saved redacted page to: %s", output_path)
+        finally:
+            self._slots.release()
+
+    def write(self, pil_img: Image.Image, ocr_data: List, page_number: int, matches: List[dict] = None) -> str:
+        """
+        Redact a page now and queue it for encoding.
+
+        Returns:
+            The path the redacted page will be written to.
+        """
+        with telemetry.stage("redact", page=page_number):
+            redact_in_place(pil_img, ocr_data, matches)
+        output_path = redacted_path(self.output_dir, page_number, self.fmt)
+
+        with telemetry.stage("encode_backpressure", page=page_number):
+            self._slots.acquire()
+        # Run in a copy of the caller's context so the encode keeps its document labels
+        context = contextvars.copy_context()
+        self._futures.append(self._executor.submit(context.run, self._encode, pil_img, output_path, page_number))
+        # Surface encoder errors early and drop finished futures
+        done = [f for f in self._futures if f.done()]
+        self._futures = [f for f in self._futures if not f.done()]
+        for future in done:
+            future.result()
+        return output_path
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def redact_sensitive_info(
     images: List[Image.Image],
     page_ocr: List[List],
-    output_dir: str = "."
+    output_dir: str = ".",
+    page_numbers: List[int] = None,
+    fmt: str = "jpeg",
+    quality: int = 95,
+    page_matches: List[List[dict]] = None
 ) -> List[Image.Image]:
     """
     Redact account and representative info from images using OCR data.
 
     Args:
-        images: List of PIL images to redact.
+        images: List of PIL images to redact; they are redacted in place.
         page_ocr: OCR results corresponding to each image.
         output_dir: Directory to save redacted images.
+        page_numbers: 1-based page number of each image, used in the file names; defaults to 1..n.
+        fmt: Output format ("jpeg", "png", "webp" or "tiff").
+        quality: Encoder quality for lossy formats.
+        page_matches: `scan_page` results for each page, if already computed.
 
     Returns:
         List of redacted PIL images.
     """
-    redacted_images = []
-
-    for i, (pil_img, ocr_data) in enumerate(zip(images, page_ocr), start=1):
-        # Convert PIL to OpenCV format
-        img_cv = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-
-        # Find boxes and apply redaction
-        coords = find_account_number_boxes(ocr_data) + find_representative_boxes(ocr_data)
-        if coords:
-            redacted_cv = img_cv.copy()
-            redact_image(redacted_cv, coords, f"{output_dir}/page_{i}_redacted.jpg")
-            # Convert back to PIL
-            redacted_img = Image.fromarray(cv2.cvtColor(redacted_cv, cv2.COLOR_BGR2RGB))
-        else:
-            # No redaction needed
-            redacted_img = pil_img
-            redacted_img.save(f"{output_dir}/page_{i}_redacted.jpg")
+    page_numbers = page_numbers or range(1, len(images) + 1)
+    page_matches = page_matches or [None] * len(images)
 
-        redacted_images.append(redacted_img)
-        print(f"Saved redacted page {i} to: {output_dir}/page_{i}_redacted.jpg")
+    with RedactionWriter(output_dir, fmt, quality) as writer:
+        for i, pil_img, ocr_data, matches in zip(page_numbers, images, page_ocr, page_matches):
+            writer.write(pil_img, ocr_data, i, matches)
 
-    return redacted_images
+    return list(images)
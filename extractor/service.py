@@ -0,0 +1,257 @@
+# service.py
+
+"""
+Resident extraction service.
+
+Loads the OCR models once (in-process or as a pool of warm workers) and runs
+statements submitted over a local HTTP API through a bounded job queue, so each
+document only pays for its own rendering, OCR and parsing.
+
+    python -m extractor.service --port 8765 --workers 4 --queue-size 32
+
+Endpoints:
+    POST /jobs        {"pdf": "...", "output": "...", "stream": false} -> 202 {"id": ...}
+    GET  /jobs        status of every tracked job
+    GET  /jobs/<id>   status, timings and parsed result of one job
+    GET  /health      queue depth, capacity and runner count
+    GET  /metrics     per-stage timings and counters in the Prometheus text format
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from extractor import telemetry
+from extractor.__main__ import main, main_stream
+from extractor.ocr import OCRWorkerPool, get_ocr_engine
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionService:
+    """
+    Bounded job queue in front of the extraction pipeline.
+
+    Jobs are plain dicts holding their status ("queued", "running", "done" or
+    "failed"), timestamps and either the parsed statement or an error message.
+    """
+
+    def __init__(self, workers=1, queue_size=16, history=1000):
+        self.workers = workers
+        self.history = history
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+        # Load the OCR models up front so the first job is as fast as the rest
+        if workers > 1:
+            self._pool = OCRWorkerPool(workers)
+        else:
+            self._pool = None
+            get_ocr_engine()
+
+        # A single in-process engine is not safe to share, so without a pool
+        # jobs run one at a time
+        self.runners = workers if self._pool is not None else 1
+
+    def start(self):
+        for _ in range(self.runners):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._pool is not None:
+            self._pool.close()
+
+    def submit(self, pdf_path, output_dir, stream=False):
+        """
+        Queue a statement for extraction.
+
+        Raises:
+            queue.Full: If the queue is at capacity; callers should retry later.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "pdf": pdf_path,
+            "output": output_dir,
+            "stream": stream,
+            "status": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "queue_seconds": None,
+            "run_seconds": None,
+            "error": None,
+            "result": None,
+        }
+        with self._lock:
+            self._queue.put_nowait(job)
+            self._jobs[job["id"]] = job
+            self._trim()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [{k: v for k, v in job.items() if k != "result"} for job in self._jobs.values()]
+
+    def health(self):
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "runners": self.runners,
+            "workers": self.workers,
+        }
+
+    def _trim(self):
+        # Forget the oldest finished jobs once history is full
+        finished = [k for k, job in self._jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            with self._lock:
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                job["queue_seconds"] = job["started_at"] - job["submitted_at"]
+
+            try:
+                run = main_stream if job["stream"] else main
+                with telemetry.labels(job=job["id"]):
+                    result = run(job["pdf"], job["output"], self.workers, pool=self._pool)
+                status, error = "done", None
+            except Exception:
+                result, status, error = None, "failed", traceback.format_exc()
+
+            telemetry.count("jobs", status=status)
+            with self._lock:
+                job["finished_at"] = time.time()
+                job["run_seconds"] = job["finished_at"] - job["started_at"]
+                job["status"] = status
+                job["result"] = result
+                job["error"] = error
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+    metrics = None
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._send(200, self.service.health())
+        if self.path == "/jobs":
+            return self._send(200, self.service.list())
+        if self.path == "/metrics" and self.metrics is not None:
+            body = self.metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path.startswith("/jobs/"):
+            job = self.service.get(self.path[len("/jobs/"):])
+            if job is None:
+                return self._send(404, {"error": "unknown job"})
+            return self._send(200, job)
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            return self._send(404, {"error": "not found"})
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            pdf_path, output_dir = body["pdf"], body["output"]
+        except (ValueError, KeyError):
+            return self._send(400, {"error": "expected JSON with 'pdf' and 'output'"})
+
+        if not os.path.isfile(pdf_path):
+            return self._send(400, {"error": f"no such file: {pdf_path}"})
+
+        try:
+            job = self.service.submit(pdf_path, output_dir, bool(body.get("stream", False)))
+        except queue.Full:
+            return self._send(429, {"error": "queue full"}, {"Retry-After": "5"})
+
+        self._send(202, {"id": job["id"], "status": job["status"]})
+
+    def log_message(self, format, *args):
+        logger.info("[service] %s %s", self.address_string(), format % args)
+
+
+def serve(host="127.0.0.1", port=8765, workers=1, queue_size=16, metrics=None):
+    """
+    Start the service and block until interrupted.
+
+    Args:
+        metrics (telemetry.PrometheusSink, optional): Totals served on `GET /metrics`.
+    """
+    service = ExtractionService(workers=workers, queue_size=queue_size)
+    service.start()
+
+    handler = type("Handler", (_Handler,), {"service": service, "metrics": metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info("Extraction service listening on http://%s:%d (%d runners, queue size %d)",
+                host, port, service.runners, queue_size)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Peepalytics resident extraction service")
+    arg_parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    arg_parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="Number of warm OCR worker processes (and concurrent jobs)")
+    arg_parser.add_argument("--queue-size", type=int, default=16,
+                            help="Maximum number of queued jobs before submissions are rejected")
+
+    arg_parser.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"],
+                            help="Logging verbosity")
+    arg_parser.add_argument("--metrics-jsonl", default=None,
+                            help="Append per-stage timings and counters to this JSON lines file")
+    arg_parser.add_argument("--no-metrics", action="store_true", help="Do not collect metrics for GET /metrics")
+
+    args = arg_parser.parse_args()
+    metrics = telemetry.configure(args.log_level, args.metrics_jsonl, prometheus=not args.no_metrics)
+    serve(args.host, args.port, args.workers, args.queue_size, metrics)
@@ -0,0 +1,226 @@
+# store.py
+
+"""
+Columnar storage for parsed transactions.
+
+Statements are written as typed Arrow columns into a Parquet dataset that is
+hive-partitioned by transaction month:
+
+    <dataset>/month=2023-04/<statement_id>-0.parquet
+
+Each statement only ever adds (or replaces) its own files, so many statements -
+including concurrent batch workers - can append to the same dataset, and
+re-running a statement overwrites its previous output instead of duplicating it.
+Readers load just the columns and months they need:
+
+    pyarrow.dataset.dataset(path, partitioning="hive").to_table(columns=["date", "money_out"])
+
+The "index" output merges the statement into a per-account index instead, where
+overlapping statements are deduplicated (see index.py). CSV and JSON exports of
+the same statement remain available for hand inspection.
+
+pyarrow is imported by the functions that need it, so runs that only export
+CSV or JSON never load it.
+"""
+
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+
+from extractor import telemetry
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_FIELDS = ["date", "description", "money_out", "money_in", "borrowings", "reconciliation"]
+OUTPUT_FORMATS = ("parquet", "index", "csv", "json")
+
+DATE_FORMAT = "%d-%m-%Y"
+PARTITION_COLUMN = "month"
+
+
+@lru_cache(maxsize=None)
+def transaction_schema():
+    """
+    Arrow schema of the transactions dataset.
+    """
+    import pyarrow as pa
+
+    return pa.schema([
+        ("statement_id", pa.string()),
+        ("masked_account_number", pa.string()),
+        ("period_start", pa.date32()),
+        ("period_end", pa.date32()),
+        ("row", pa.int32()),
+        ("date", pa.date32()),
+        ("description", pa.string()),
+        ("money_out", pa.float64()),
+        ("money_in", pa.float64()),
+        ("borrowings", pa.float64()),
+        ("reconciliation", pa.string()),
+        (PARTITION_COLUMN, pa.string()),
+    ])
+
+
+def statement_id(pdf_path):
+    """
+    Stable identifier for a statement: the PDF's name plus a short hash of its full path.
+    """
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    digest = hashlib.blake2b(os.path.abspath(pdf_path).encode(), digest_size=4).hexdigest()
+    return f"{stem}-{digest}"
+
+
+def _parse_dates(values):
+    # "%d-%m-%Y" strings (or None) -> date32, parsed in one vectorized call
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    strings = pa.array(values, type=pa.string())
+    return pc.strptime(strings, format=DATE_FORMAT, unit="s", error_is_null=True).cast(pa.date32())
+
+
+def transactions_table(statement, statement_key):
+    """
+    Convert a parsed statement into an Arrow table with one row per transaction.
+
+    Args:
+        statement (dict): Output of `parser` / `main_stream`.
+        statement_key (str): Identifier stored in every row, see `statement_id`.
+
+    Returns:
+        pyarrow.Table: Rows typed per `transaction_schema()`, with the account and
+        statement period repeated as columns.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    transactions = statement["transactions"]
+    n = len(transactions)
+
+    dates = _parse_dates([t["date"] for t in transactions])
+    period = _parse_dates([statement.get("start_date"), statement.get("end_date")])
+
+    columns = {
+        "statement_id": pa.array([statement_key] * n, type=pa.string()),
+        "masked_account_number": pa.array([statement.get("masked_account_number")] * n, type=pa.string()),
+        "period_start": pa.repeat(period[0], n),
+        "period_end": pa.repeat(period[1], n),
+        "row": pa.array(range(n), type=pa.int32()),
+        "date": dates,
+        "description": pa.array([t["description"] for t in transactions], type=pa.string()),
+        "money_out": pa.array([t["money_out"] for t in transactions], type=pa.float64()),
+        "money_in": pa.array([t["money_in"] for t in transactions], type=pa.float64()),
+        "borrowings": pa.array([t["borrowings"] for t in transactions], type=pa.float64()),
+        "reconciliation": pa.array([t.get("reconciliation") for t in transactions], type=pa.string()),
+        PARTITION_COLUMN: pc.fill_null(pc.strftime(dates, format="%Y-%m"), "unknown"),
+    }
+    return pa.table(columns, schema=transaction_schema())
+
+
+def write_parquet(statement, dataset_dir, statement_key):
+    """
+    Append one statement's transactions to a partitioned Parquet dataset.
+
+    Args:
+        statement (dict): Output of `parser` / `main_stream`.
+        dataset_dir (str): Root folder of the dataset, shared between statements.
+        statement_key (str): Identifier of the statement; names its files.
+
+    Returns:
+        int: Number of rows written.
+    """
+    # Replace, rather than add to, files from an earlier run of the same statement
+    for path in glob.glob(os.path.join(dataset_dir, "*", f"{glob.escape(statement_key)}-*.parquet")):
+        os.remove(path)
+
+    table = transactions_table(statement, statement_key)
+    if table.num_rows == 0:
+        return 0
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    with telemetry.stage("store"):
+        ds.write_dataset(
+            table,
+            dataset_dir,
+            format="parquet",
+            partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"),
+            basename_template=f"{statement_key}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+    logger.info("Wrote %d transactions to %s", table.num_rows, dataset_dir)
+    return table.num_rows
+
+
+def read_transactions(dataset_dir, columns=None, filter=None):
+    """
+    Load transactions from a dataset written by `write_parquet`.
+
+    Args:
+        dataset_dir (str): Root folder of the dataset.
+        columns (list, optional): Columns to read; all by default.
+        filter (pyarrow.compute.Expression, optional): Row filter, pushed down to
+            partitions and row groups.
+
+    Returns:
+        pyarrow.Table
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning="hive", schema=transaction_schema())
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def export_csv(statement, output_dir):
+    """
+    Write `transactions.csv` and `account_number_statement_period.csv` for one statement.
+    """
+    with open(os.path.join(output_dir, "transactions.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=TRANSACTION_FIELDS)
+        writer.writeheader()
+        writer.writerows(statement["transactions"])
+    export_period_csv(statement, output_dir)
+
+
+def export_period_csv(statement, output_dir):
+    with open(os.path.join(output_dir, "account_number_statement_period.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["masked_account_number", "start_date", "end_date"])
+        writer.writerow([statement["masked_account_number"], statement["start_date"], statement["end_date"]])
+
+
+def export_json(statement, output_dir):
+    """
+    Write the parsed statement as `statement.json`.
+    """
+    with open(os.path.join(output_dir, "statement.json"), "w", encoding="utf-8") as f:
+        json.dump(statement, f, indent=2)
+
+
+def save_statement(statement, output_dir, pdf_path, outputs=("parquet",), dataset_dir=None, index_dir=None):
+    """
+    Persist a parsed statement in each requested format.
+
+    Args:
+        statement (dict): Output of `parser` / `main_stream`.
+        output_dir (str): Folder for the statement's CSV/JSON exports.
+        pdf_path (str): Source PDF, used to derive the statement id.
+        outputs (tuple): Any of `OUTPUT_FORMATS`.
+        dataset_dir (str, optional): Parquet dataset root; defaults to `<output_dir>/transactions`.
+        index_dir (str, optional): Transaction index root; defaults to `<output_dir>/index`.
+    """
+    if "parquet" in outputs:
+        write_parquet(statement, dataset_dir or os.path.join(output_dir, "transactions"), statement_id(pdf_path))
+    if "index" in outputs:
+        from extractor.index import upsert
+
+        upsert(index_dir or os.path.join(output_dir, "index"), statement, statement_id(pdf_path))
+    if "csv" in outputs:
+        export_csv(statement, output_dir)
+    if "json" in outputs:
+        export_json(statement, output_dir)
@@ -0,0 +1,329 @@
+# telemetry.py
+
+"""
+Per-stage timers and counters for the extraction pipeline.
+
+Pipeline code marks its stages and counts its work:
+
+    with telemetry.stage("ocr", page=page_number):
+        result = ocr_page(engine, img)
+    telemetry.count("ocr_pages")
+
+Nothing is measured until a sink is attached; with no sinks `stage()` hands back
+one shared no-op context manager and `count()` returns at once, so leaving the
+calls in hot paths costs next to nothing.
+
+Sinks receive one event dict per timer or counter:
+
+    {"type": "timer", "name": "ocr", "seconds": 0.84, "labels": {"page": 3, "document": "..."}, "ts": ...}
+    {"type": "counter", "name": "ocr_pages", "value": 1, "labels": {...}, "ts": ...}
+    {"type": "gauge", "name": "queue_depth", "value": 3, "labels": {"stage": "ocr", ...}, "ts": ...}
+
+Available sinks: `JsonLinesSink` (append to a file), `CallbackSink` (any
+callable) and `PrometheusSink` (in-process totals rendered in the Prometheus
+text format, optionally served over HTTP). Labels set with `labels(...)` apply
+to every event inside the block, including work handed to threads started with
+`contextvars.copy_context()`.
+
+Command-line entry points wire this up with `configure` from their
+`--log-level`, `--metrics-jsonl` and `--metrics-port` flags.
+"""
+
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+_sinks = []
+_context_labels = contextvars.ContextVar("telemetry_labels", default={})
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopStage()
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def add_sink(sink):
+    """
+    Start sending events to `sink` (any object with an `emit(event)` method).
+    """
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def clear_sinks():
+    for sink in list(_sinks):
+        remove_sink(sink)
+        close = getattr(sink, "close", None)
+        if close is not None:
+            close()
+
+
+def _emit(event):
+    for sink in list(_sinks):
+        sink.emit(event)
+
+
+class _Stage:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        seconds = time.perf_counter() - self.start
+        labels = {**_context_labels.get(), **self.labels}
+        if exc_type is not None:
+            labels["error"] = exc_type.__name__
+        _emit({"type": "timer", "name": self.name, "seconds": seconds, "labels": labels, "ts": time.time()})
+        return False
+
+
+def stage(name, **labels):
+    """
+    Time a block of work as one run of the stage `name`.
+
+    Args:
+        name: Stage name, e.g. "render", "deskew", "ocr", "parse", "redact", "encode".
+        **labels: Extra dimensions such as `page=3`.
+    """
+    if not _sinks:
+        return _NOOP
+    return _Stage(name, labels)
+
+
+def count(name, value=1, **labels):
+    """
+    Add `value` to the counter `name`.
+    """
+    if not _sinks:
+        return
+    _emit({"type": "counter", "name": name, "value": value,
+           "labels": {**_context_labels.get(), **labels}, "ts": time.time()})
+
+
+def gauge(name, value, **labels):
+    """
+    Record the current value of `name`, e.g. how many items wait in a queue.
+    """
+    if not _sinks:
+        return
+    _emit({"type": "gauge", "name": name, "value": value,
+           "labels": {**_context_labels.get(), **labels}, "ts": time.time()})
+
+
+@contextmanager
+def labels(**values):
+    """
+    Attach labels (e.g. `document=...`) to every event emitted inside the block.
+    """
+    token = _context_labels.set({**_context_labels.get(), **values})
+    try:
+        yield
+    finally:
+        _context_labels.reset(token)
+
+
+class CallbackSink:
+    """
+    Pass every event to a callable.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, event):
+        self.callback(event)
+
+
+class JsonLinesSink:
+    """
+    Append every event as one JSON object per line.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Labels that identify a single unit of work; kept out of Prometheus series to bound their number
+HIGH_CARDINALITY_LABELS = {"page", "path", "document", "job"}
+
+
+class PrometheusSink:
+    """
+    Keep running totals per stage and counter, rendered in the Prometheus text format.
+
+    Timers become `<prefix>_stage_seconds_total`, `<prefix>_stage_calls_total` and
+    `<prefix>_stage_seconds_max`; counters become `<prefix>_<name>_total` and gauges
+    `<prefix>_<name>` (latest value) plus `<prefix>_<name>_max`. Per-page labels are
+    dropped so the number of series stays bounded.
+    """
+
+    def __init__(self, prefix="peepalytics"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+        self._gauges = {}
+        self._server = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if k not in HIGH_CARDINALITY_LABELS))
+
+    def emit(self, event):
+        key = self._key(event["name"], event["labels"])
+        with self._lock:
+            if event["type"] == "timer":
+                calls, total, peak = self._timers.get(key, (0, 0.0, 0.0))
+                self._timers[key] = (calls + 1, total + event["seconds"], max(peak, event["seconds"]))
+            elif event["type"] == "gauge":
+                _, peak = self._gauges.get(key, (0, event["value"]))
+                self._gauges[key] = (event["value"], max(peak, event["value"]))
+            else:
+                self._counters[key] = self._counters.get(key, 0) + event["value"]
+
+    @staticmethod
+    def _format_labels(pairs):
+        if not pairs:
+            return ""
+        escape = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        """
+        Current totals in the Prometheus text exposition format.
+        """
+        with self._lock:
+            timers = dict(self._timers)
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        p = self.prefix
+        lines = []
+        if timers:
+            series = {
+                f"{p}_stage_seconds_total": ("counter", "Time spent per pipeline stage", 1),
+                f"{p}_stage_calls_total": ("counter", "Runs per pipeline stage", 0),
+                f"{p}_stage_seconds_max": ("gauge", "Longest single run per pipeline stage", 2),
+            }
+            for metric, (kind, help_text, field) in series.items():
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+                for (name, pairs), values in sorted(timers.items()):
+                    value = values[0] if field == 0 else values[field]
+                    lines.append(f"{metric}{self._format_labels((('stage', name),) + pairs)} {value}")
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{p}_{name}_total"
+            lines += [f"# TYPE {metric} counter"]
+            for (n, pairs), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{metric}{self._format_labels(pairs)} {value}")
+        for name in sorted({name for name, _ in gauges}):
+            for metric, field in ((f"{p}_{name}", 0), (f"{p}_{name}_max", 1)):
+                lines += [f"# TYPE {metric} gauge"]
+                for (n, pairs), values in sorted(gauges.items()):
+                    if n == name:
+                        lines.append(f"{metric}{self._format_labels(pairs)} {values[field]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host="127.0.0.1", port=9464):
+        """
+        Expose `GET /metrics` on a background thread.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+def add_arguments(arg_parser):
+    """
+    Add the shared logging and metrics flags to a command-line parser.
+    """
+    arg_parser.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"],
+                            help="Logging verbosity")
+    arg_parser.add_argument("--metrics-jsonl", default=None,
+                            help="Append per-stage timings and counters to this JSON lines file")
+    arg_parser.add_argument("--metrics-port", type=int, default=None,
+                            help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics")
+
+
+def configure(log_level="info", metrics_jsonl=None, metrics_port=None, prometheus=False):
+    """
+    Set up logging and attach the sinks requested on the command line.
+
+    Args:
+        log_level (str): Root logging level.
+        metrics_jsonl (str, optional): JSON lines file to append events to.
+        metrics_port (int, optional): Port to serve Prometheus metrics on.
+        prometheus (bool): Keep Prometheus totals even without a port, e.g. for a
+            server that exposes them on its own endpoint.
+
+    Returns:
+        PrometheusSink or None: The Prometheus sink, if one was attached.
+    """
+    logging.basicConfig(level=log_level.upper(), format="%(message)s")
+    if metrics_jsonl:
+        add_sink(JsonLinesSink(metrics_jsonl))
+    if metrics_port is None and not prometheus:
+        return None
+    sink = add_sink(PrometheusSink())
+    if metrics_port is not None:
+        sink.serve(port=metrics_port)
+    return sink
@@ -0,0 +1,161 @@
+# textlayer.py
+
+"""
+Native text-layer extraction for born-digital PDFs.
+
+Reads word boxes straight from the PDF with poppler's `pdftotext -bbox-layout`
+and converts them into the same [box, (text, confidence)] structure PaddleOCR
+returns, so `parser` and `redact_sensitive_info` consume them unchanged and the
+page never has to go through OCR.
+"""
+
+import logging
+import os
+import subprocess
+import xml.etree.ElementTree as ET
+
+from scripts.preprocess import POPPLAR_path
+from extractor import telemetry
+
+logger = logging.getLogger(__name__)
+
+# A page needs at least this many words, mostly alphanumeric, to skip OCR
+MIN_WORDS = 10
+MIN_ALNUM_RATIO = 0.6
+
+# Words further apart than this fraction of the line height start a new box
+PHRASE_GAP_RATIO = 0.6
+
+
+def _pdftotext_cmd():
+    exe = "pdftotext.exe" if os.name == "nt" else "pdftotext"
+    if POPPLAR_path and os.path.isdir(POPPLAR_path):
+        return os.path.join(POPPLAR_path, exe)
+    return exe
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_text_layer(pdf_path, first_page=None, last_page=None):
+    """
+    Read every word and its bounding box from the PDF's embedded text layer.
+
+    Args:
+        pdf_path (str): Path to the PDF.
+        first_page (int, optional): First 1-based page to read.
+        last_page (int, optional): Last 1-based page to read.
+
+    Returns:
+        Dict[int, List[List[Tuple[float, float, float, float, str]]]]: For each page
+        number, its text lines as lists of (x_min, y_min, x_max, y_max, word) in PDF points.
+    """
+    cmd = [_pdftotext_cmd(), "-bbox-layout"]
+    if first_page:
+        cmd += ["-f", str(first_page)]
+    if last_page:
+        cmd += ["-l", str(last_page)]
+    cmd += [pdf_path, "-"]
+
+    try:
+        with telemetry.stage("text_layer"):
+            out = subprocess.run(cmd, capture_output=True, check=True).stdout
+            root = ET.fromstring(out)
+    except (OSError, subprocess.CalledProcessError, ET.ParseError) as e:
+        logger.info("No usable text layer (%s); falling back to OCR.", e)
+        return {}
+
+    pages = {}
+    page_number = (first_page or 1) - 1
+    for page in root.iter():
+        if _local(page.tag) != "page":
+            continue
+        page_number += 1
+
+        lines = []
+        for line in page.iter():
+            if _local(line.tag) != "line":
+                continue
+            words = [
+                (float(w.get("xMin")), float(w.get("yMin")), float(w.get("xMax")), float(w.get("yMax")), w.text or "")
+                for w in line
+                if _local(w.tag) == "word"
+            ]
+            if words:
+                lines.append(words)
+        pages[page_number] = lines
+
+    return pages
+
+
+def _is_usable(lines):
+    words = [w[4] for line in lines for w in line]
+    if len(words) < MIN_WORDS:
+        return False
+    chars = "".join(words)
+    alnum = sum(c.isalnum() for c in chars)
+    return bool(chars) and alnum / len(chars) >= MIN_ALNUM_RATIO
+
+
+def lines_to_ocr(lines, dpi=300):
+    """
+    Convert text-layer lines to PaddleOCR-style boxes in page-image pixels.
+
+    Words on a line are joined into one box until the gap to the next word exceeds
+    a fraction of the line height, mirroring the phrase-level boxes PaddleOCR emits
+    (so table cells on the same baseline stay separate).
+
+    Args:
+        lines (list): Lines as returned by `read_text_layer` for one page.
+        dpi (int): Resolution the page image is rendered at.
+
+    Returns:
+        List: OCR output for the page (list of box-text pairs).
+    """
+    scale = dpi / 72.0
+    result = []
+
+    for line in lines:
+        phrase = [line[0]]
+        for word in line[1:] + [None]:
+            if word is not None:
+                prev = phrase[-1]
+                height = max(prev[3] - prev[1], word[3] - word[1])
+                if word[0] - prev[2] <= PHRASE_GAP_RATIO * height:
+                    phrase.append(word)
+                    continue
+
+            x1 = min(w[0] for w in phrase) * scale
+            y1 = min(w[1] for w in phrase) * scale
+            x2 = max(w[2] for w in phrase) * scale
+            y2 = max(w[3] for w in phrase) * scale
+            text = " ".join(w[4] for w in phrase)
+            result.append([[[x1, y1], [x2, y1], [x2, y2], [x1, y2]], (text, 1.0)])
+            phrase = [word]
+
+    return result
+
+
+def text_layer_pages(pdf_path, dpi=300, first_page=None, last_page=None):
+    """
+    Extract OCR-equivalent results for every page that has a usable text layer.
+
+    Args:
+        pdf_path (str): Path to the PDF.
+        dpi (int): Resolution the page images are rendered at.
+        first_page (int, optional): First 1-based page to read.
+        last_page (int, optional): Last 1-based page to read.
+
+    Returns:
+        Dict[int, List]: OCR-style output keyed by page number. Scanned pages are
+        left out and still need OCR.
+    """
+    native = {}
+    for page_number, lines in read_text_layer(pdf_path, first_page, last_page).items():
+        if _is_usable(lines):
+            native[page_number] = lines_to_ocr(lines, dpi)
+
+    telemetry.count("pages_text_layer", len(native))
+    logger.info("Text layer found on %d page(s).", len(native))
+    return native
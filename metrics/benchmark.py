@@ -0,0 +1,315 @@
+"""
+End-to-end benchmark of the extraction pipeline on the stored fixtures.
+
+Replays the OCR output in data/ocr/*.json and the processed page images in
+scripts/data/processed/*.jpg through the pipeline stages, optionally scaled up
+into synthetic documents (hundreds of pages, thousands of rows on a page).
+Each stage runs in its own fresh process, so its peak RSS is its own, and
+reports throughput plus p50/p99 latency per unit of work as JSON.
+
+    python -m metrics.benchmark --pages 200 --rows 5000 --output bench.json
+    python -m metrics.benchmark --baseline bench.json --tolerance 0.2
+
+With `--baseline`, the run exits non-zero when any stage's p50 latency is slower
+than the baseline by more than the tolerance. The "startup" stage times
+`python -m extractor --help` in fresh interpreters and fails the run outright
+when importing the CLI pulls in any of `HEAVY_MODULES`.
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+OCR_FIXTURES = "data/ocr/page_*_paddleocr.json"
+IMAGE_FIXTURES = "scripts/data/processed/page_*.jpg"
+
+STAGES = ("startup", "parse", "parse_long", "reconcile", "pii", "redact", "deskew", "deskew_fast", "ocr")
+DEFAULT_STAGES = ("startup", "parse", "parse_long", "reconcile", "pii", "redact", "deskew", "deskew_fast")
+
+# Modules only the stages that need them may import; the CLI must start without them
+HEAVY_MODULES = ("paddleocr", "paddle", "cv2", "pandas", "pdf2image", "pyarrow")
+
+
+def _page_number(path):
+    return int(os.path.basename(path).split("_")[1].split(".")[0])
+
+
+def load_ocr_fixtures(root="."):
+    paths = sorted(glob.glob(os.path.join(root, OCR_FIXTURES)), key=_page_number)
+    pages = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            pages.append(json.load(f))
+    return pages
+
+
+def load_image_fixtures(root="."):
+    from PIL import Image
+
+    paths = sorted(glob.glob(os.path.join(root, IMAGE_FIXTURES)), key=_page_number)
+    return [Image.open(p).convert("RGB") for p in paths]
+
+
+def synthetic_document(pages, page_count):
+    """
+    A document of `page_count` pages, cycling through the fixture pages.
+    """
+    return [pages[i % len(pages)] for i in range(page_count)]
+
+
+def synthetic_long_page(page, rows):
+    """
+    Stack copies of a page's transaction table until it holds at least `rows` rows.
+
+    Copies are placed below one another, as if the table simply continued, so row
+    clustering and column assignment see a realistic but much longer page.
+    """
+    from extractor.parse import parse_page
+
+    per_copy = max(len(parse_page(page)[0]), 1)
+    height = max(pt[1] for box, _ in page for pt in box) + 50
+    copies = -(-rows // per_copy)
+    return [
+        [[[x, y + k * height] for x, y in box], (text, conf)]
+        for k in range(copies)
+        for box, (text, conf) in page
+    ]
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _time_each(fn, items):
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - start
+
+
+def _run_stage(stage, config):
+    # Runs inside a fresh process; pipeline progress output is discarded so it
+    # neither floods the report nor skews the timings
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return _measure(stage, config)
+
+
+def _measure(stage, config):
+    root = config["root"]
+    unit = "page"
+
+    heavy_imports = None
+    if stage == "startup":
+        # Fresh interpreters, as a user typing the command would start them
+        command = [sys.executable, "-m", "extractor", "--help"]
+        items = range(config["repeat"])
+        fn = lambda _: subprocess.run(command, cwd=root, stdout=subprocess.DEVNULL, check=True)
+        unit = "process start"
+        probe = ("import sys, json, extractor.__main__; "
+                 f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+        heavy_imports = json.loads(subprocess.run([sys.executable, "-c", probe], cwd=root, check=True,
+                                                  capture_output=True, text=True).stdout)
+        setup_rss = _peak_rss_mb()
+        latencies, wall = _time_each(fn, items)
+
+    elif stage in ("parse", "pii", "parse_long", "reconcile"):
+        from extractor.parse import parse_page
+        from extractor.pii import scan_page
+        from extractor.reconcile import reconcile
+
+        fixtures = load_ocr_fixtures(root)
+        if stage == "reconcile":
+            # One statement of every transaction on the synthetic long page
+            transactions = parse_page(synthetic_long_page(fixtures[1 if len(fixtures) > 1 else 0], config["rows"]))[0]
+            items = [transactions] * config["repeat"]
+            fn = reconcile
+            unit = f"statement of {len(transactions)} rows"
+        elif stage == "parse_long":
+            long_page = synthetic_long_page(fixtures[1 if len(fixtures) > 1 else 0], config["rows"])
+            items = [long_page] * config["repeat"]
+            rows = len(parse_page(long_page)[0])
+            fn = lambda page: parse_page(page)
+            unit = f"page of {rows} rows"
+        else:
+            items = synthetic_document(fixtures, config["pages"])
+            if stage == "parse":
+                state = {"columns": None}
+
+                def fn(page):
+                    _, state["columns"] = parse_page(page, state["columns"])
+            else:
+                fn = scan_page
+        setup_rss = _peak_rss_mb()
+        latencies, wall = _time_each(fn, items)
+
+    elif stage in ("redact", "deskew", "deskew_fast", "ocr"):
+        images = load_image_fixtures(root)
+        count = config["image_pages"]
+
+        if stage == "redact":
+            import tempfile
+            from extractor.redact import redact_page, redacted_path
+
+            fixtures = load_ocr_fixtures(root)
+            out_dir = tempfile.mkdtemp(prefix="bench_redact_")
+            # Each page is a fresh copy, since redaction draws into the image
+            items = [(i, images[i % len(images)], fixtures[i % len(fixtures)]) for i in range(count)]
+
+            def fn(item):
+                i, img, page = item
+                redact_page(img.copy(), page, redacted_path(out_dir, i + 1, config["fmt"]), config["fmt"])
+        elif stage == "ocr":
+            from extractor.ocr import get_ocr_engine, ocr_page
+
+            engine = get_ocr_engine()
+            items = [images[i % len(images)] for i in range(count)]
+            fn = lambda img: ocr_page(engine, img)
+        else:
+            from scripts.preprocess import deskew_image, deskew_image_fast
+
+            items = [images[i % len(images)] for i in range(count)]
+            fn = deskew_image if stage == "deskew" else deskew_image_fast
+
+        setup_rss = _peak_rss_mb()
+        latencies, wall = _time_each(fn, items)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    lat_ms = np.asarray(latencies) * 1000
+    result = {
+        "stage": stage,
+        "unit": unit,
+        "units": len(latencies),
+        "seconds": wall,
+        "throughput_per_s": len(latencies) / wall if wall else None,
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p99_ms": float(np.percentile(lat_ms, 99)),
+        "mean_ms": float(lat_ms.mean()),
+        "setup_rss_mb": setup_rss,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    if heavy_imports is not None:
+        result["heavy_imports"] = heavy_imports
+    return result
+
+
+def run_benchmarks(stages=DEFAULT_STAGES, pages=100, rows=2000, image_pages=10, repeat=5, fmt="jpeg", root="."):
+    """
+    Benchmark each stage in its own process.
+
+    Args:
+        stages: Stage names from `STAGES`.
+        pages: Pages in the synthetic document for "parse" and "pii".
+        rows: Minimum transaction rows on the synthetic page for "parse_long".
+        image_pages: Page images run through "redact", "deskew", "deskew_fast" and "ocr".
+        repeat: Number of "parse_long" runs and "startup" process starts.
+        fmt: Output format for "redact".
+        root: Repository root holding the fixtures.
+
+    Returns:
+        dict: Run configuration, environment and one result per stage.
+    """
+    config = {"pages": pages, "rows": rows, "image_pages": image_pages, "repeat": repeat, "fmt": fmt,
+              "root": os.path.abspath(root)}
+    ctx = multiprocessing.get_context("spawn")
+
+    results = []
+    for stage in stages:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(_run_stage, (stage, config)))
+
+    return {
+        "config": config,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "stages": results,
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Stages whose p50 latency regressed by more than `tolerance` against a baseline report.
+    """
+    before = {r["stage"]: r for r in baseline["stages"]}
+    regressions = []
+    for result in report["stages"]:
+        old = before.get(result["stage"])
+        if old and old["p50_ms"] and result["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append({"stage": result["stage"], "baseline_p50_ms": old["p50_ms"],
+                                "p50_ms": result["p50_ms"]})
+    return regressions
+
+
+def print_summary(report):
+    print(f"\n{'stage':<12} {'units':>6} {'per s':>9} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12}")
+    for r in report["stages"]:
+        rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+        print(f"{r['stage']:<12} {r['units']:>6} {r['throughput_per_s']:>9.1f} {r['p50_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {rss:>12}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline on stored fixtures")
+    arg_parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                            help=f"Comma-separated stages from: {', '.join(STAGES)} (ocr needs PaddleOCR)")
+    arg_parser.add_argument("--pages", type=int, default=100, help="Pages in the synthetic document for parse/pii")
+    arg_parser.add_argument("--rows", type=int, default=2000, help="Rows on the synthetic long page for parse_long")
+    arg_parser.add_argument("--image-pages", type=int, default=10,
+                            help="Page images processed by redact/deskew/ocr")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Runs of parse_long and startup")
+    arg_parser.add_argument("--format", default="jpeg", help="Output format for redact")
+    arg_parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    arg_parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    arg_parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Allowed p50 slowdown against the baseline, as a fraction")
+
+    args = arg_parser.parse_args()
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        arg_parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(stages, args.pages, args.rows, args.image_pages, args.repeat, args.format)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print_summary(report)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    heavy = [r for r in report["stages"] if r.get("heavy_imports")]
+    for r in heavy:
+        print(f"Regression in {r['stage']}: importing the CLI loads {', '.join(r['heavy_imports'])}", file=sys.stderr)
+    if report.get("regressions"):
+        for r in report["regressions"]:
+            print(f"Regression in {r['stage']}: p50 {r['baseline_p50_ms']:.2f} ms -> {r['p50_ms']:.2f} ms",
+                  file=sys.stderr)
+    if heavy or report.get("regressions"):
+        sys.exit(1)
@@ -1,6 +1,31 @@
+"""
+OCR quality evaluation against hand-labelled statements.
+
+Every ground-truth field (account number, dates, descriptions and amounts) is
+compared with every OCR text box in one similarity matrix computed by
+`rapidfuzz.process.cdist` across all cores. Fields are then paired one-to-one
+with an optimal assignment (`scipy.optimize.linear_sum_assignment`), so a box
+that fits several fields is given to the field it fits best instead of the first
+one that asks. Precision, recall and F1 are reported overall and per field type.
+
+    python -m metrics.evaluate --gt data/json_file.json --pred data/ocr/page_2_paddleocr.json
+    python -m metrics.evaluate --gt-dir labels/ --pred-dir data/ocr/ --json report.json
+"""
+
+import argparse
 import json
-from difflib import SequenceMatcher
-from typing import List
+import os
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from scipy.optimize import linear_sum_assignment
+
+FIELD_TYPES = ("account", "date", "description", "amount")
+
+_DATE = re.compile(r"^\d{1,2}[\s\-/.]+(?:[a-z]{3,9}|\d{1,2})[\s\-/.]+\d{2,4}$")
+_AMOUNT = re.compile(r"^[-+]?\$?\d[\d]*(?:\.\d+)?$")
 
 
 def normalize(val):
@@ -10,69 +35,215 @@ def normalize(val):
     return str(val).strip().lower().replace(",", "")
 
 
-def fuzzy_match(a: str, b: str, threshold: float = 0.95) -> bool:
-    return SequenceMatcher(None, normalize(a), normalize(b)).ratio() >= threshold
-
-
-def extract_gt_fields(gt_path: str) -> List[str]:
+def field_type(text: str) -> str:
+    """
+    Classify an OCR text box as a date, amount, masked account or description.
+    """
+    text = normalize(text)
+    if _DATE.match(text):
+        return "date"
+    if _AMOUNT.match(text):
+        return "amount"
+    if "*" in text and any(c.isdigit() for c in text):
+        return "account"
+    return "description"
+
+
+def extract_gt_typed(gt_path: str) -> List[Tuple[str, str]]:
+    """
+    Read a ground-truth statement as (field type, value) pairs.
+    """
     with open(gt_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    fields = []
-    fields.append(data.get("masked_account_number", ""))
-    fields.append(data.get("start_date", ""))
-    fields.append(data.get("end_date", ""))
+    fields = [
+        ("account", data.get("masked_account_number", "")),
+        ("date", data.get("start_date", "")),
+        ("date", data.get("end_date", "")),
+    ]
 
     for tx in data.get("transactions", []):
-        fields.append(tx.get("date", ""))
-        fields.append(tx.get("description", ""))
+        fields.append(("date", tx.get("date", "")))
+        fields.append(("description", tx.get("description", "")))
         for k in ["money_out", "money_in", "borrowings"]:
             val = tx.get(k)
             if val is not None:
-                fields.append(f"{val:.2f}")
+                fields.append(("amount", f"{val:.2f}"))
     return fields
 
 
+def extract_gt_fields(gt_path: str) -> List[str]:
+    return [value for _, value in extract_gt_typed(gt_path)]
+
+
 def extract_predicted_text(pred_path: str) -> List[str]:
     with open(pred_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     return [entry[1][0] for entry in data if entry and entry[1][0].strip()]
 
 
-def evaluate(gt_path: str, pred_path: str):
-    gt_fields = extract_gt_fields(gt_path)
-    pred_fields = extract_predicted_text(pred_path)
+def similarity_matrix(gt_fields: List[str], pred_fields: List[str], workers: int = -1) -> np.ndarray:
+    """
+    Normalized similarity in [0, 1] of every ground-truth field to every prediction.
+
+    Uses the Indel ratio, the same measure as `difflib.SequenceMatcher.ratio`.
+    """
+    return process.cdist(
+        [normalize(v) for v in gt_fields],
+        [normalize(v) for v in pred_fields],
+        scorer=fuzz.ratio,
+        dtype=np.float32,
+        workers=workers,
+    ) / 100.0
+
+
+def match_fields(gt_fields: List[str], pred_fields: List[str], threshold: float = 0.95,
+                 workers: int = -1) -> List[Tuple[int, int, float]]:
+    """
+    Optimal one-to-one pairing of ground-truth fields and predictions.
+
+    Pairs scoring below `threshold` can never match; among the rest the
+    assignment maximizes total similarity.
+
+    Returns:
+        (gt index, prediction index, similarity) for every accepted pair.
+    """
+    if not gt_fields or not pred_fields:
+        return []
+
+    scores = similarity_matrix(gt_fields, pred_fields, workers)
+    weights = np.where(scores >= threshold, scores, 0.0)
+    rows, cols = linear_sum_assignment(weights, maximize=True)
+    keep = weights[rows, cols] > 0
+    return [(int(i), int(j), float(scores[i, j])) for i, j in zip(rows[keep], cols[keep])]
 
-    matched = 0
-    matched_pred_indices = set()
-    matched_gt_indices = set()
-
-    for i, gt in enumerate(gt_fields):
-        for j, pred in enumerate(pred_fields):
-            if j in matched_pred_indices:
-                continue
-            if fuzzy_match(gt, pred):
-                matched += 1
-                matched_gt_indices.add(i)
-                matched_pred_indices.add(j)
-                break
 
-    precision = matched / len(pred_fields) if pred_fields else 0.0
-    recall = matched / len(gt_fields) if gt_fields else 0.0
+def _prf(matched: int, predicted: int, truth: int) -> Dict[str, float]:
+    precision = matched / predicted if predicted else 0.0
+    recall = matched / truth if truth else 0.0
     f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) else 0.0
+    return {
+        "matched": matched, "predicted": predicted, "ground_truth": truth,
+        "precision": precision, "recall": recall, "f1": f1,
+    }
+
+
+def score_pair(gt_path: str, pred_path: str, threshold: float = 0.95, workers: int = -1) -> Dict:
+    """
+    Match one ground-truth file against one OCR output and count matches per field type.
+
+    Returns:
+        Dict with "overall" and "by_type" counts and metrics.
+    """
+    gt_typed = extract_gt_typed(gt_path)
+    gt_fields = [value for _, value in gt_typed]
+    pred_fields = extract_predicted_text(pred_path)
+    pairs = match_fields(gt_fields, pred_fields, threshold, workers)
+
+    # Predictions are typed by the field they matched, or by their own shape if unmatched
+    pred_types = [field_type(p) for p in pred_fields]
+    matched_by_type = dict.fromkeys(FIELD_TYPES, 0)
+    for i, j, _ in pairs:
+        matched_by_type[gt_typed[i][0]] += 1
+        pred_types[j] = gt_typed[i][0]
+
+    by_type = {
+        t: _prf(matched_by_type[t], pred_types.count(t), sum(1 for ft, _ in gt_typed if ft == t))
+        for t in FIELD_TYPES
+    }
+    return {
+        "gt": gt_path,
+        "pred": pred_path,
+        "overall": _prf(len(pairs), len(pred_fields), len(gt_fields)),
+        "by_type": by_type,
+    }
+
+
+def _combine(results: List[Dict]) -> Dict:
+    # Micro-average: add up counts across documents, then recompute the ratios
+    def total(metrics):
+        return _prf(*(sum(m[k] for m in metrics) for k in ("matched", "predicted", "ground_truth")))
+
+    return {
+        "documents": len(results),
+        "overall": total([r["overall"] for r in results]),
+        "by_type": {t: total([r["by_type"][t] for r in results]) for t in FIELD_TYPES},
+    }
+
+
+def find_pairs(gt_dir: str, pred_dir: str) -> List[Tuple[str, str]]:
+    """
+    Pair ground-truth and prediction files by name.
+
+    A ground-truth file `name.json` is paired with `name.json` in `pred_dir`, or
+    failing that with `name_paddleocr.json`.
+    """
+    pairs = []
+    for name in sorted(os.listdir(gt_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() != ".json":
+            continue
+        for candidate in (name, f"{stem}_paddleocr.json"):
+            pred_path = os.path.join(pred_dir, candidate)
+            if os.path.isfile(pred_path):
+                pairs.append((os.path.join(gt_dir, name), pred_path))
+                break
+    return pairs
+
 
+def print_report(report: Dict):
+    overall = report["overall"]
     print("\nOCR Quality Evaluation")
     print("----------------------------")
-    print(f"Matched fields   : {matched}")
-    print(f"Predicted fields : {len(pred_fields)}")
-    print(f"Ground truth     : {len(gt_fields)}")
-    print(f"Precision        : {precision:.4f}")
-    print(f"Recall           : {recall:.4f}")
-    print(f"F1 Score         : {f1:.4f}")
-
-
-# === Runing with file paths ===
-evaluate(
-    gt_path= r"C:\Users\DELL\OneDrive\Desktop\ZTH COHORT 4.0\Data Science\Peepalytics\data\json_file.json",
-    pred_path=r"C:\Users\DELL\OneDrive\Desktop\ZTH COHORT 4.0\Data Science\Peepalytics\data\ocr\page_2_paddleocr.json"
-)
+    if "documents" in report:
+        print(f"Documents        : {report['documents']}")
+    print(f"Matched fields   : {overall['matched']}")
+    print(f"Predicted fields : {overall['predicted']}")
+    print(f"Ground truth     : {overall['ground_truth']}")
+    print(f"Precision        : {overall['precision']:.4f}")
+    print(f"Recall           : {overall['recall']:.4f}")
+    print(f"F1 Score         : {overall['f1']:.4f}")
+    print("\nBy field type      Matched  Precision  Recall     F1")
+    for t, m in report["by_type"].items():
+        print(f"  {t:<16} {m['matched']:>7}  {m['precision']:>9.4f}  {m['recall']:.4f}  {m['f1']:.4f}")
+
+
+def evaluate(gt_path: str, pred_path: str, threshold: float = 0.95, workers: int = -1) -> Dict:
+    report = score_pair(gt_path, pred_path, threshold, workers)
+    print_report(report)
+    return report
+
+
+def evaluate_dir(gt_dir: str, pred_dir: str, threshold: float = 0.95, workers: int = -1) -> Dict:
+    """
+    Evaluate every ground-truth/prediction pair found by `find_pairs` and report
+    micro-averaged metrics across them.
+    """
+    results = [score_pair(gt, pred, threshold, workers) for gt, pred in find_pairs(gt_dir, pred_dir)]
+    report = {**_combine(results), "pairs": results}
+    print_report(report)
+    return report
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Evaluate OCR output against ground-truth statements")
+    arg_parser.add_argument("--gt", help="Ground-truth JSON file")
+    arg_parser.add_argument("--pred", help="OCR output JSON file to evaluate")
+    arg_parser.add_argument("--gt-dir", help="Directory of ground-truth JSON files")
+    arg_parser.add_argument("--pred-dir", help="Directory of OCR outputs, paired by file name")
+    arg_parser.add_argument("--threshold", type=float, default=0.95, help="Minimum similarity for a match")
+    arg_parser.add_argument("--workers", type=int, default=-1, help="Threads for the similarity matrix (-1: all cores)")
+    arg_parser.add_argument("--json", help="Also write the full report to this file")
+
+    args = arg_parser.parse_args()
+
+    if args.gt_dir and args.pred_dir:
+        report = evaluate_dir(args.gt_dir, args.pred_dir, args.threshold, args.workers)
+    elif args.gt and args.pred:
+        report = evaluate(args.gt, args.pred, args.threshold, args.workers)
+    else:
+        arg_parser.error("pass --gt and --pred, or --gt-dir and --pred-dir")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -3,23 +3,110 @@
 # Install dependencies:
 # pip install pdf2image
 # Download Poppler and set up the path
+#
+# OpenCV and pdf2image are imported inside the functions that use them, so code
+# that only needs page ranges or RENDER_DPI (e.g. the CLI) starts without them.
 
+import logging
 import os
-import cv2
+import re
 import numpy as np
-from pdf2image import convert_from_path
 from PIL import Image
 
+from extractor import telemetry
+
+logger = logging.getLogger(__name__)
+
 # Set paths for Poppler and input/output directories
 POPPLAR_path = r'C:\Program Files\poppler-24.08.0\Library\bin'
 file_path = r"C:\Users\DELL\OneDrive\Desktop\ZTH COHORT 4.0\Data Science\Peepalytics\sample_dataset.pdf"
 output_folder = r"C:\Users\DELL\OneDrive\Desktop\ZTH COHORT 4.0\Data Science\Peepalytics\data\processed"
 
+# Fall back to poppler on PATH when the Windows install above is not present
+if not os.path.isdir(POPPLAR_path):
+    POPPLAR_path = None
+
+
+# Resolution pages are rendered at; OCR boxes, the text layer and redaction all use its pixel coordinates
+RENDER_DPI = 300
+
+# Longest side of the thumbnail used to estimate skew, and the most ink pixels fed to minAreaRect
+SKEW_MAX_SIDE = 1000
+SKEW_MAX_POINTS = 100_000
+
+# One comma-separated part of a page selection: "3", "5-7", "4-" or "-2"
+_PAGE_PART = re.compile(r"(\d*)\s*(?:(-)\s*(\d*))?")
+
+
+def estimate_skew(image, max_side=SKEW_MAX_SIDE, max_points=SKEW_MAX_POINTS):
+    """
+    Estimates the skew angle of a page from a downscaled copy.
+
+    The page is box-averaged down to at most `max_side` pixels (which keeps the outline
+    of the text block intact) and shrunk further until at most `max_points` ink pixels
+    remain, so the cost no longer grows with the rendering DPI.
+
+    Returns:
+        float: The skew angle in degrees.
+    """
+    import cv2
+
+    # Box-average down to thumbnail size before touching the pixels in Python
+    factor = -(-max(image.size) // max_side)
+    thumb = image.reduce(factor) if factor > 1 else image
+    gray = np.asarray(thumb.convert("L"))
+    scale = 1.0
+
+    while True:
+        small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        # Otsu on the inverted page: ink becomes foreground
+        _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        points = cv2.findNonZero(binary)
+        if points is None:
+            return 0.0
+        if len(points) <= max_points:
+            break
+        scale *= max(0.5, (max_points / len(points)) ** 0.5)
+
+    angle = cv2.minAreaRect(points)[-1]
+
+    # Normalize the angle to avoid flipping orientation
+    if angle < -45:
+        angle = 90 + angle
+    elif angle > 45:
+        angle = angle - 90
+
+    return float(angle)
+
+
+def deskew_image_fast(image, angle_threshold=1.0):
+    """
+    Deskews a PIL image using a downscaled skew estimate, rotating only when needed.
+    """
+    angle = estimate_skew(image)
+    logger.debug("Detected skew angle: %.2f°", angle)
+
+    if abs(angle) < angle_threshold:
+        logger.debug("Image is not significantly skewed.")
+        return image
+
+    import cv2
+
+    # Rotate the page in its own color space - one conversion in, one out
+    img = np.asarray(image.convert("RGB"))
+    (h, w) = img.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    rotated = cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return Image.fromarray(rotated)
+
 
 def deskew_image(image, angle_threshold=1.0):
     """
     Deskews a PIL image if the skew angle is significant, preserving the original layout (landscape/portrait).
     """
+    import cv2
+
     # Convert the PIL image to grayscale in OpenCV format
     img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
 
@@ -29,8 +116,8 @@ def deskew_image(image, angle_threshold=1.0):
     # Apply Otsu's thresholding to get a binary image
     _, binary = cv2.threshold(img_inverted, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
 
-    # Find non-zero pixel coordinates
-    coords = np.column_stack(np.where(binary > 0))
+    # Find non-zero pixel coordinates as (x, y) points
+    coords = np.column_stack(np.where(binary > 0)[::-1])
     rect = cv2.minAreaRect(coords)
     angle = rect[-1]
 
@@ -40,11 +127,11 @@ def deskew_image(image, angle_threshold=1.0):
     elif angle > 45:
         angle = angle - 90
 
-    print(f"Detected skew angle: {angle:.2f}°")
+    logger.debug("Detected skew angle: %.2f°", angle)
 
     # If the image is not significantly skewed, return the original image
     if abs(angle) < angle_threshold:
-        print("Image is not significantly skewed.")
+        logger.debug("Image is not significantly skewed.")
         return image
 
     # Get image size and compute the rotation matrix
@@ -62,35 +149,87 @@ def deskew_image(image, angle_threshold=1.0):
     return Image.fromarray(final_img)
 
 
-def pdf_to_images(pdf_path, dpi=300):
+def pdf_page_count(pdf_path):
     """
-    Converts a PDF to deskewed images and saves them to the specified output folder.
+    Returns the number of pages in a PDF without rendering any of them.
     """
-    # Create the output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
+    from pdf2image import pdfinfo_from_path
 
-    # Convert PDF pages to images
-    pages = convert_from_path(pdf_path, dpi=dpi, poppler_path=POPPLAR_path)
+    return pdfinfo_from_path(pdf_path, poppler_path=POPPLAR_path)["Pages"]
 
-    processed_images_list = []
 
-    # Process each page of the PDF
-    for i, page in enumerate(pages):
-        print(f"\nProcessing page {i + 1}...")
+def parse_page_range(spec, page_count):
+    """
+    Expands a page selection such as "1-2", "3,5-7" or "4-" into sorted 1-based page numbers.
 
-        # Deskew the image
-        processed_image = deskew_image(page)
+    Pages beyond `page_count` are dropped; an empty spec or "all" selects every page.
 
-        # Save the processed image to the output folder
-        output_path = os.path.join(output_folder, f"page_{i + 1}.jpg")
-        processed_image.save(output_path, format="JPEG")
+    Raises:
+        ValueError: If a part is not a page number or range, names page 0, or runs backwards.
+    """
+    if not spec or spec.strip().lower() == "all":
+        return list(range(1, page_count + 1))
+
+    selected = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        match = _PAGE_PART.fullmatch(part)
+        if not match or not (match.group(1) or match.group(3)):
+            raise ValueError(f'invalid page selection "{part}"; expected e.g. "1-2", "3,5-7" or "all"')
+        first, dash, last = match.groups()
+        start = int(first) if first else 1
+        end = int(last) if last else (page_count if dash else start)
+        if start < 1 or (first and last and start > end):
+            raise ValueError(f'invalid page range "{part}"; pages are numbered from 1, low to high')
+        selected.update(range(start, min(end, page_count) + 1))
+
+    return sorted(selected)
+
+
+def render_page(pdf_path, page_number, dpi=RENDER_DPI):
+    """
+    Rasterizes a single 1-based page of a PDF with poppler's first/last page options.
+    """
+    from pdf2image import convert_from_path
+
+    with telemetry.stage("render", page=page_number):
+        page = convert_from_path(
+            pdf_path, dpi=dpi, first_page=page_number, last_page=page_number, poppler_path=POPPLAR_path
+        )[0]
+    telemetry.count("pages_rendered")
+    return page
 
-        # Append the processed image to the list
-        processed_images_list.append(processed_image)
-        print(f"Saved: {output_path}")
 
-    # Return only the first two processed images
-    processed_images_list = processed_images_list[0:2]
-    print(f"Processed images: {len(processed_images_list)}")
+def pdf_to_images(pdf_path, dpi=RENDER_DPI, skip_deskew=(), pages=(1, 2), save_dir=output_folder):
+    """
+    Converts the selected pages of a PDF to deskewed images, optionally saving them to `save_dir`.
+
+    Only the pages listed in `pages` (1-based; None for all) are rasterized, one at a
+    time, so the work scales with the pages actually used. Pages listed in
+    `skip_deskew` are kept exactly as rendered, e.g. pages whose text boxes come
+    from the PDF's own text layer.
+    """
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    if pages is None:
+        pages = range(1, pdf_page_count(pdf_path) + 1)
+
+    processed_images_list = []
+    for page_number in pages:
+        logger.info("Processing page %d...", page_number)
+        processed_image = render_page(pdf_path, page_number, dpi)
+        if page_number not in skip_deskew:
+            with telemetry.stage("deskew", page=page_number):
+                processed_image = deskew_image_fast(processed_image)
+
+        if save_dir:
+            output_path = os.path.join(save_dir, f"page_{page_number}.jpg")
+            with telemetry.stage("save_processed", page=page_number):
+                processed_image.save(output_path, format="JPEG")
+            logger.info("Saved: %s", output_path)
+        processed_images_list.append(processed_image)
+    logger.info("Processed images: %d", len(processed_images_list))
 
     return processed_images_list
@@ -0,0 +1,107 @@
+# test_reconcile.py
+
+"""
+Row-level checks for extractor/reconcile.py.
+
+    python -m pytest tests
+"""
+
+import numpy as np
+
+from extractor.reconcile import detect_direction, reconcile, reconcile_arrays, RECONCILIATION_STATUSES
+
+NAN = np.nan
+
+
+def _row(description, money_out=None, money_in=None, balance=None):
+    return {"date": "01 Jan", "description": description, "money_out": money_out, "money_in": money_in,
+            "borrowings": balance}
+
+
+def _statuses(status):
+    return [RECONCILIATION_STATUSES[code] for code in status.tolist()]
+
+
+def test_detect_direction_deposit_account():
+    # Balance rises with money in
+    money_out = np.array([NAN, NAN, 30.0])
+    money_in = np.array([NAN, 50.0, NAN])
+    balance = np.array([100.0, 150.0, 120.0])
+    assert detect_direction(money_out, money_in, balance) == 1
+
+
+def test_detect_direction_loan_account():
+    # Balance rises with money out, as on the sample statement
+    money_out = np.array([NAN, 40.0, NAN])
+    money_in = np.array([NAN, NAN, 25.0])
+    balance = np.array([500.0, 540.0, 515.0])
+    assert detect_direction(money_out, money_in, balance) == -1
+
+
+def test_detect_direction_nothing_moved():
+    money_out = np.array([NAN, 10.0])
+    money_in = np.array([NAN, NAN])
+    balance = np.array([100.0, 250.0])
+    assert detect_direction(money_out, money_in, balance) is None
+
+
+def test_swapped_amount_is_corrected():
+    # The 20.00 deposit was parsed as money out; the balance says it came in
+    money_out = np.array([NAN, NAN, 20.0, 5.0])
+    money_in = np.array([NAN, 50.0, NAN, NAN])
+    balance = np.array([100.0, 150.0, 170.0, 165.0])
+
+    out, inn, status, state = reconcile_arrays(money_out, money_in, balance)
+
+    assert _statuses(status) == ["unchecked", "ok", "corrected", "ok"]
+    assert np.isnan(out[2]) and inn[2] == 20.0
+    assert state == {"direction": 1, "balance": 165.0}
+
+
+def test_misread_balance_is_flagged():
+    # 170.00 misread as 710.00: neither side explains the move, so the row is left as parsed
+    money_out = np.array([NAN, NAN, NAN, 5.0])
+    money_in = np.array([NAN, 50.0, 20.0, NAN])
+    balance = np.array([100.0, 150.0, 710.0, 165.0])
+
+    out, inn, status, _ = reconcile_arrays(money_out, money_in, balance)
+
+    assert _statuses(status)[2] == "unreconciled"
+    assert inn[2] == 20.0 and np.isnan(out[2])
+
+
+def test_state_carries_to_the_next_page():
+    _, _, _, state = reconcile_arrays(np.array([NAN, NAN]), np.array([NAN, 50.0]), np.array([100.0, 150.0]))
+    _, _, status, _ = reconcile_arrays(np.array([NAN]), np.array([25.0]), np.array([175.0]), state)
+    assert _statuses(status) == ["ok"]
+
+
+def test_opening_balance_starts_a_new_run():
+    rows = [
+        # Loan account: the balance rises with money out
+        _row("Opening balance", balance=500.0),
+        _row("Card purchase", money_out=40.0, balance=540.0),
+        _row("Payment received", money_in=25.0, balance=515.0),
+        # Deposit sub-account: the balance rises with money in
+        _row("Opening balance", balance=1000.0),
+        _row("Salary", money_in=200.0, balance=1200.0),
+        _row("Transfer out", money_out=50.0, balance=1150.0),
+    ]
+
+    reconciled, state = reconcile(rows)
+
+    assert [t["reconciliation"] for t in reconciled] == ["unchecked", "ok", "ok", "unchecked", "ok", "ok"]
+    assert reconciled[4]["money_in"] == 200.0 and reconciled[4]["money_out"] is None
+    assert state == {"direction": 1, "balance": 1150.0}
+
+
+def test_opening_balance_drops_incoming_state():
+    # State from a loan account's previous page must not decide the sub-account's direction
+    rows = [
+        _row("Opening balance", balance=1000.0),
+        _row("Salary", money_in=200.0, balance=1200.0),
+    ]
+
+    reconciled, _ = reconcile(rows, {"direction": -1, "balance": 515.0})
+
+    assert [t["reconciliation"] for t in reconciled] == ["unchecked", "ok"]